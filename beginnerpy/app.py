@@ -4,49 +4,62 @@ import re
 import psycopg2
 import pickle
 import urllib.parse
-from flask import Flask, render_template, redirect, url_for, request, flash
+import click
+from flask import Flask, render_template, redirect, url_for, request, flash, abort, jsonify, get_flashed_messages
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import generate_password_hash, check_password_hash
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
 from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, ValidationError, Email, EqualTo
-from sqlalchemy import create_engine, desc
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import desc, func, and_, exists, literal, select
+from sqlalchemy.orm import load_only, noload
 
 from beginnerpy.models import *
-from beginnerpy.func import getSideNav
+from beginnerpy import db
+from beginnerpy.db import engine, Session
+from beginnerpy.func import getSideNav, replaceBr, bumpNavVersion
+from beginnerpy import cache, templating, render, revisions, ratelimit, snapshot, jobs, loadtest
+from beginnerpy import queryaudit, conditional, profiler, suggest, glossary, links, invalidation
+from beginnerpy import compression
+from beginnerpy.queryaudit import query_budget
+from beginnerpy.templating import batched, stream_template
 from beginnerpy.bot.challenges import challenges_blueprint
 from beginnerpy.bot.rules import rules_blueprint
+from beginnerpy.bot.api import api_blueprint
+from beginnerpy.bot import grader
+from beginnerpy.images import images_blueprint
 
 app = Flask(__name__)
 app.register_blueprint(challenges_blueprint)
 app.register_blueprint(rules_blueprint)
+app.register_blueprint(api_blueprint)
+app.register_blueprint(images_blueprint)
+app.register_blueprint(suggest.suggest_blueprint)
 
 app.jinja_env.filters['quote_plus'] = lambda f: urllib.parse.quote_plus(f)
+templating.init_app(app)
 
 app.secret_key = os.environ.get("SECRET_KEY", "safe-for-committing")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 DEBUG = os.environ.get("PRODUCTION", False) is False
+# Articles of this category are shown under the module they belong to
+MODULE_CATEGORY = 9
 
 Base = declarative_base()
-dbname = os.environ.get("DB_NAME", "bpydb")
-user = os.environ.get("DB_USER", "postgresadmin")
-host = os.environ.get("DB_HOST", "0.0.0.0")
-port = os.environ.get("DB_PORT", "5432")
-sslmode = "require" if os.environ.get("PRODUCTION", False) else None
-password = os.environ.get("DB_PASSWORD", "dev-env-password-safe-to-be-public")
-
-engine = create_engine(
-    f"postgresql://{user}:{password}@{host}:{port}/{dbname}",
-    connect_args={"sslmode": sslmode},
-    pool_recycle=300,
-    max_overflow=0,
-)
-
-Session = sessionmaker(bind=engine)
+compression.init_app(app)
+db.init_app(app)
+profiler.init_app(app)
+ratelimit.init_app(app)
+snapshot.init_app(app)
+jobs.init_app(app)
+queryaudit.init_app(app)
+conditional.init_app(app)
+suggest.init_app(app)
+invalidation.init_app(app)
 
 csrf = CSRFProtect(app)
+csrf.exempt(api_blueprint)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
@@ -55,8 +68,11 @@ login_manager.login_view = "login"
 @login_manager.user_loader
 def load_user(user_id):
     s = Session()
-    u = s.query(Useraccount).get(int(user_id))
-    user = u
+    try:
+        user = s.query(Useraccount).get(int(user_id))
+    except snapshot.DATABASE_ERRORS:
+        # Pages served from the snapshot are shown to everyone as to a visitor
+        user = None
     s.close()
     return user
 
@@ -86,6 +102,7 @@ class LoginForm(FlaskForm):
 
 
 @app.route("/challenges/pip-version")
+@query_budget(5)
 def challenge_version():
     session = Session()
     row = session.query(Settings).filter_by(name="PIP_CHALLENGE_VERSION").first()
@@ -151,6 +168,7 @@ def logout():
 
 
 @app.route("/", methods=["POST", "GET"])
+@query_budget(10)
 def index():
     session = Session()
     latest = (
@@ -172,10 +190,14 @@ def index():
 
 
 @app.route("/module/<module_link>", methods=["POST", "GET"])
+@query_budget(10)
 def module(module_link):
     session = Session()
     module = session.query(Module).filter_by(link=module_link).first()
-    module.clickCount = module.clickCount + 1
+    # Counted in the database, the row read may come from a replica that is behind
+    session.query(Module).filter_by(id=module.id).update(
+        {Module.clickCount: Module.clickCount + 1}, synchronize_session=False
+    )
     session.commit()
     articles = (
         session.query(Article)
@@ -196,10 +218,13 @@ def module(module_link):
 
 
 @app.route("/tag/<tag_link>", methods=["POST", "GET"])
+@query_budget(10)
 def tag(tag_link):
     session = Session()
     tag = session.query(Tag).filter_by(link=tag_link).first()
-    tag.clickCount = tag.clickCount + 1
+    session.query(Tag).filter_by(id=tag.id).update(
+        {Tag.clickCount: Tag.clickCount + 1}, synchronize_session=False
+    )
     session.commit()
     articles = (
         session.query(Article)
@@ -221,6 +246,7 @@ def tag(tag_link):
 
 # Displays the category homepage to the user
 @app.route("/category/<category_link>")
+@query_budget(10)
 def category(category_link):
     sidenav = getSideNav()
     cat = [item for item in sidenav if item["link"] == category_link][0]
@@ -229,8 +255,9 @@ def category(category_link):
         session.close()
         return redirect(url_for("index"))
     else:
-        category = session.query(Category).filter_by(id=int(cat["id"])).first()
-        category.viewCount = category.viewCount + 1
+        session.query(Category).filter_by(id=int(cat["id"])).update(
+            {Category.viewCount: Category.viewCount + 1}, synchronize_session=False
+        )
         session.commit()
         items = session.query(Article).filter_by(draft=0, category_id=int(cat["id"]))
     session.close()
@@ -247,34 +274,36 @@ def category(category_link):
 # Displays an article to the user
 @app.route("/<category>/<link>")
 @app.route("/<category>/<module>/<link>")
+@query_budget(10)
 def page(category, link, module=None):
     session = Session()
     if module:
-        article = session.query(Article).filter_by(link=module + "/" + link).first()
-    else:
-        article = session.query(Article).filter_by(link=link).first()
-    article.viewCount = article.viewCount + 1
+        link = module + "/" + link
+    article = session.query(Article).filter_by(link=link).first()
+    if article is None:
+        session.close()
+        # Renamed articles are still found by the links they had before
+        target = links.lookup(link)
+        if target:
+            return redirect(target, 301)
+        abort(404)
+    session.query(Article).filter_by(id=article.id).update(
+        {Article.viewCount: Article.viewCount + 1}, synchronize_session=False
+    )
+    # Articles saved before rendering moved to the job runner get their render job now
+    if article.rendered_content is None or article.reading_time is None:
+        jobs.enqueue(session, "render_article", article_id=article.id)
     session.commit()
     session.close()
 
     sidenav = getSideNav()
 
     session = Session()
-    if module:
-        article = session.query(Article).filter_by(link=module + "/" + link).first()
-    else:
-        article = session.query(Article).filter_by(link=link).first()
+    article = session.query(Article).filter_by(link=link).first()
     session.close()
-
-    # Some unnecessary elements the editor places into the html structure needfixing
-    article.content = article.content.replace(' contenteditable="true"', "")
-    article.content = article.content.replace("ck ck-widget__selection-handle", "hide")
-    article.summary = article.summary.replace(' contenteditable="true"', "")
-    article.summary = article.summary.replace("ck ck-widget__selection-handle", "hide")
-
-    # Fix removed <br> tags in code blocks by replacing them with \n
-    article.summary = replaceBr(article.summary)
-    article.content = replaceBr(article.content)
+    # Nothing is written back, the job stores the real render
+    if article.rendered_content is None:
+        article.rendered_content = render.fallback(article.content)
 
     if (current_user.is_authenticated and current_user.is_admin) or article.draft == 0:
         context = {
@@ -288,25 +317,26 @@ def page(category, link, module=None):
     return redirect(url_for("index"))
 
 
-def replaceBr(string):
-    summ = re.findall(r"<code|</code>|.+?(?=<code|</code>|$)", string)
-    insidePre = False
-    for item in summ:
-        if insidePre:
-            summ[summ.index(item)] = item.replace("<br>", "\n")
-        if item == "<code":
-            insidePre = True
-        else:
-            insidePre = False
-    string = "".join(summ)
-    return string
-
-
 # Main admin page, displays all the data we collect and create throughout the site
 @app.route("/admin")
 @login_required
+@query_budget(15)
 def admin():
-    context = {"sidenav": getSideNav(), "endpoint": "admin", "property": "admin"}
+    session = Session()
+    context = {
+        "sidenav": getSideNav(),
+        "cache_stats": cache.hit_rates(),
+        "rate_limit_stats": ratelimit.stats,
+        "job_metrics": jobs.metrics(session),
+        "job_stats": jobs.stats,
+        "pool_wait": db.pool_wait() * 1000,
+        "invalidation": dict(invalidation.status, active=invalidation.active()),
+        "query_reports": list(reversed(queryaudit.reports)),
+        "compression_stats": compression.route_stats(),
+        "endpoint": "admin",
+        "property": "admin",
+    }
+    session.close()
     return render_template("admin/admin.html", **context)
 
 
@@ -336,20 +366,22 @@ def admin_db(id):
 def admin_categories():
     sidenav = getSideNav()
     session = Session()
-    items = session.query(Category).order_by(Category.name)
-    session.close()
+    items = batched(session.query(Category).order_by(Category.name))
     context = {
         "sidenav": sidenav,
         "categories": items,
         "endpoint": "categories",
         "property": "admin",
+        # Taken before streaming, the session cookie dropping them is sent ahead of the body
+        "flashed": get_flashed_messages(with_categories=True),
     }
-    return render_template("admin/categories.html", **context)
+    return stream_template("admin/categories.html", session, **context)
 
 
 # Lists out the articles from the specified category
 @app.route("/admin/category/<category_link>")
 @login_required
+@query_budget(15)
 def admin_category(category_link):
     sidenav = getSideNav()
     try:
@@ -363,30 +395,41 @@ def admin_category(category_link):
     elif cat["name"] == "Tags":
         items = session.query(Tag).order_by(Tag.name)
     elif category_link == "messages":
+        # The template quotes the titles for the edit links itself
         items = session.query(Message).order_by(Message.title)
-        for i in range(items.count()):
-            items[i].title = urllib.parse.quote(items[i].title, safe='')
-            print(items[i].title)
-        print(items[0].title)
     else:
+        # Only the columns the table shows, the tags and modules of each row aren't needed
         items = (
             session.query(Article)
+                .options(
+                    load_only(
+                        "id", "title", "link", "date_created", "last_modified", "draft",
+                        "viewCount",
+                    ),
+                    noload(Article.tags),
+                    noload(Article.modules),
+                )
                 .filter_by(category_id=int(cid))
                 .order_by(desc(Article.id))
         )
         draft = session.query(Article).filter_by(category_id=int(cid), draft=1).count()
         live = session.query(Article).filter_by(category_id=int(cid), draft=0).count()
-    session.close()
+        tags = session.query(Tag).order_by(Tag.name).all()
+        modules = session.query(Module).order_by(Module.name).all()
     context = {
         "category": cat,
         "sidenav": sidenav,
-        "articles": items,
+        "articles": batched(items),
         "property": "admin",
+        # Taken before streaming, the session cookie dropping them is sent ahead of the body
+        "flashed": get_flashed_messages(with_categories=True),
     }
     if cat["name"] not in ["Modules", "Tags"] and category_link != "messages":
         context["draft"] = draft
         context["live"] = live
-    return render_template("admin/category.html", **context)
+        context["tags"] = tags
+        context["modules"] = modules
+    return stream_template("admin/category.html", session, **context)
 
 
 # Loads an empty creator page to write content
@@ -438,6 +481,9 @@ def save_item():
         else:
             item = Tag(name=item_name, title=item_title, link=item_link)
             session.add(item)
+            session.flush()
+        bumpNavVersion(session)
+        invalidation.publish(session, "tag", [(tag or item).id])
         session.commit()
         session.close()
         flash(
@@ -453,6 +499,9 @@ def save_item():
         else:
             item = Module(name=item_name, title=item_title, link=item_link)
             session.add(item)
+            session.flush()
+        bumpNavVersion(session)
+        invalidation.publish(session, "module", [(module or item).id])
         session.commit()
         session.close()
         flash(
@@ -555,6 +604,8 @@ def save_category():
             if description not in [None, "None", "<p>None</p>", "<p><br></p>"]
             else None
         )
+        bumpNavVersion(session)
+        invalidation.publish(session, "category", [category.id])
         session.commit()
         session.close()
         flash(f"<strong>{title}</strong> category was successfully updated.", "success")
@@ -569,6 +620,8 @@ def save_category():
             formtitle=formtitle,
         )
         session.add(category)
+        bumpNavVersion(session)
+        invalidation.publish(session, "category")
         session.commit()
         session.close()
         flash(f"<strong>{title}</strong> category was successfully created.", "success")
@@ -584,6 +637,8 @@ def delete_category(cid):
     category = session.query(Category).filter_by(id=int(cid)).first()
     if not category.articles:
         session.delete(category)
+        bumpNavVersion(session)
+        invalidation.publish(session, "category", [int(cid)])
         session.commit()
         flash(
             f"<strong>{category.name}</strong> category was successfully deleted.",
@@ -614,8 +669,13 @@ def delete_article(category_link, article_id):
         session.execute(
             articleModules.delete().where(articleModules.c.article_id == article.id)
         )
+        session.query(ArticleRevision).filter_by(article_id=article.id).delete()
+        links.forget(session, [article.id])
         session.commit()
         session.delete(article)
+        if category_link == glossary.CATEGORY_LINK:
+            glossary.changed(session)
+        invalidation.publish(session, "article", [int(article_id)])
         session.commit()
 
     session.close()
@@ -623,6 +683,98 @@ def delete_article(category_link, article_id):
     return redirect(url_for("admin_category", category_link=category_link))
 
 
+# Applies one action to every selected article with a few set based statements in one transaction
+@app.route("/admin/bulk_articles/<category_link>", methods=["POST"])
+@login_required
+def bulk_articles(category_link):
+    action = request.form.get("action")
+    ids = [int(item) for item in request.form.getlist("article") if item.isdigit()]
+    if not ids:
+        flash("No articles were selected.", "warning")
+        return redirect(url_for("admin_category", category_link=category_link))
+    session = Session()
+    selected = session.query(Article).filter(Article.id.in_(ids))
+    target = None
+    try:
+        if action == "publish":
+            changed = selected.update({"draft": 0}, synchronize_session=False)
+            summary = f"Published {changed} articles."
+        elif action == "unpublish":
+            changed = selected.update({"draft": 1}, synchronize_session=False)
+            summary = f"Unpublished {changed} articles."
+        elif action == "delete":
+            session.execute(articleTags.delete().where(articleTags.c.article_id.in_(ids)))
+            session.execute(articleModules.delete().where(articleModules.c.article_id.in_(ids)))
+            session.query(ArticleRevision).filter(ArticleRevision.article_id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            links.forget(session, ids)
+            changed = selected.delete(synchronize_session=False)
+            summary = f"Deleted {changed} articles."
+        elif action in ("add_tag", "remove_tag"):
+            tag = session.query(Tag).get(int(request.form.get("tag_id", 0)))
+            changed = bulk_link(session, articleTags, articleTags.c.tag_id, tag, ids, action)
+            verb = "Added" if action == "add_tag" else "Removed"
+            summary = f"{verb} tag <strong>{tag.name}</strong> on {changed} articles."
+        elif action in ("add_module", "remove_module"):
+            module = session.query(Module).get(int(request.form.get("module_id", 0)))
+            changed = bulk_link(
+                session, articleModules, articleModules.c.module_id, module, ids, action
+            )
+            verb = "Added" if action == "add_module" else "Removed"
+            summary = f"{verb} module <strong>{module.name}</strong> on {changed} articles."
+        elif action == "move":
+            target = session.query(Category).get(int(request.form.get("category_id", 0)))
+            if target is None:
+                raise ValueError("The category doesn't exist")
+            # Moving into or out of the modules category changes links, like saving does
+            for article in selected:
+                if MODULE_CATEGORY not in (article.category_id, target.id):
+                    continue
+                if target.id == MODULE_CATEGORY and not article.modules:
+                    raise ValueError(f"{article.title} has no module to be listed under")
+                old_link = article.link
+                prefix = article.modules[0].link if article.modules else ""
+                article.link = article_link(article.title, target.id, prefix)
+                links.record_rename(session, article, old_link)
+            changed = selected.update({"category_id": target.id}, synchronize_session=False)
+            summary = f"Moved {changed} articles to <strong>{target.name}</strong>."
+        else:
+            raise ValueError(f"Unknown action {action}")
+        # Listings tell their versions apart by the newest change, see conditional.py
+        if action != "delete":
+            selected.update({"last_modified": datetime.now()}, synchronize_session=False)
+        if glossary.CATEGORY_LINK in (category_link, target and target.link):
+            glossary.changed(session)
+        invalidation.publish(session, "article", ids)
+        session.commit()
+        flash(f"{summary} ({len(ids)} selected)", "success")
+    except ValueError as error:
+        session.rollback()
+        flash(f"Nothing was changed, the action couldn't be applied: {error}", "danger")
+    session.close()
+    return redirect(url_for("admin_category", category_link=category_link))
+
+
+# Adds or removes one tag or module on many articles, rows that already exist aren't inserted again
+def bulk_link(session, table, column, item, ids, action):
+    if item is None:
+        raise ValueError("The tag or module doesn't exist")
+    if action.startswith("remove"):
+        return session.execute(
+            table.delete().where(and_(table.c.article_id.in_(ids), column == item.id))
+        ).rowcount
+    missing = select([Article.id, literal(item.id)]).where(
+        and_(
+            Article.id.in_(ids),
+            ~exists().where(and_(table.c.article_id == Article.id, column == item.id)),
+        )
+    )
+    return session.execute(
+        table.insert().from_select([table.c.article_id, column], missing)
+    ).rowcount
+
+
 # Deletes a tag or a module
 @app.route("/admin/delete_item/<category_link>/<item_id>", methods=["POST", "GET"])
 @login_required
@@ -639,6 +791,8 @@ def delete_item(category_link, item_id):
         )
         session.commit()
         session.delete(item)
+        bumpNavVersion(session)
+        invalidation.publish(session, category_link[:-1], [int(item_id)])
         session.commit()
         flash(
             f"<strong>{item.name}</strong> has been removed from {category_link}.",
@@ -654,9 +808,39 @@ def delete_item(category_link, item_id):
     return redirect(url_for("admin_category", category_link=category_link))
 
 
+# Inserts the article's tag and module rows, one executemany per table
+def link_tags_and_modules(session, article_id, tags, modules):
+    if tags:
+        session.execute(
+            articleTags.insert(), [{"article_id": article_id, "tag_id": item} for item in tags]
+        )
+    if modules:
+        session.execute(
+            articleModules.insert(),
+            [{"article_id": article_id, "module_id": item} for item in modules],
+        )
+
+
+# Articles in the modules category live under the link of their module
+def article_link(title, category_id, module_link=""):
+    slug = title.replace(" ", "-").replace("(", "").replace(")", "").lower()
+    if str(category_id) == str(MODULE_CATEGORY):
+        return module_link + "/" + slug
+    return slug
+
+
+# The link of the first module picked in the editor
+def module_link(moduleslist, modules):
+    for module in moduleslist:
+        if modules and module.id == int(modules[0]):
+            return module.link
+    return ""
+
+
 # Saves any other type of new content except tag or module
 @app.route("/admin/save_article", methods=["POST"])
 @login_required
+@query_budget(30)
 def save_article():
     title = request.form.get("title")
     link = request.form.get("link")
@@ -667,18 +851,13 @@ def save_article():
     tags = []
     session = Session()
 
-    moduleslist = session.query(Module)
-    counter = 0
-    while counter < moduleslist.count():
-        counter += 1
-        if request.form.get(f"module_{counter}") == "on":
-            modules.append(counter)
-    tagslist = session.query(Tag)
-    counter = 0
-    while counter < tagslist.count():
-        counter += 1
-        if request.form.get(f"tag_{counter}") == "on":
-            tags.append(counter)
+    moduleslist = session.query(Module).all()
+    for module in moduleslist:
+        if request.form.get(f"module_{module.id}") == "on":
+            modules.append(module.id)
+    for (tag_id,) in session.query(Tag.id):
+        if request.form.get(f"tag_{tag_id}") == "on":
+            tags.append(tag_id)
 
     category = request.form.get("cat_id")
     cat_link = request.form.get("cat_link")
@@ -691,24 +870,14 @@ def save_article():
     article = session.query(Article).filter_by(link=link).first()
     # If the article exists, update it.
     if article:
+        old_fields = revisions.fields_of(article)
         article.title = title
-        if category == "9":
-            modulename = ""
-            for module in moduleslist:
-                if module.id == int(modules[0]):
-                    modulename = module.link
-                    break
-            article.link = (
-                    modulename
-                    + "/"
-                    + title.replace(" ", "-").replace("(", "").replace(")", "").lower()
-            )
-        else:
-            article.link = (
-                title.replace(" ", "-").replace("(", "").replace(")", "").lower()
-            )
+        article.link = article_link(title, category, module_link(moduleslist, modules))
+        links.record_rename(session, article, link)
         article.content = content
         article.summary = summary
+        render.schedule(session, article)
+        revisions.record(session, article, current_user.id, old_fields)
         if article.draft == 0 and draft == 1:
             article.date_created = datetime.now()
         article.draft = draft
@@ -722,32 +891,13 @@ def save_article():
         )
         session.commit()
 
-        for item in tags:
-            session.execute(
-                articleTags.insert().values(article_id=article.id, tag_id=item)
-            )
-        for item in modules:
-            session.execute(
-                articleModules.insert().values(article_id=article.id, module_id=item)
-            )
+        link_tags_and_modules(session, article.id, tags, modules)
 
         flash(
             f"The article <strong>{title}</strong> was successfully updated.", "success"
         )
     else:
-        if category == "9":
-            modulename = ""
-            for module in moduleslist:
-                if module.id == int(modules[0]):
-                    modulename = module.link
-                    break
-            link = (
-                    modulename
-                    + "/"
-                    + title.replace(" ", "-").replace("(", "").replace(")", "").lower()
-            )
-        else:
-            link = title.replace(" ", "-").replace("(", "").replace(")", "").lower()
+        link = article_link(title, category, module_link(moduleslist, modules))
         article = Article(
             title=title,
             author_id=current_user.id,
@@ -760,25 +910,96 @@ def save_article():
             date_created=datetime.now(),
         )
         session.add(article)
+        session.flush()
+        render.schedule(session, article)
+        revisions.record(session, article, current_user.id)
         session.commit()
         article = session.query(Article).filter_by(link=link).first()
-        for item in tags:
-            session.execute(
-                articleTags.insert().values(article_id=article.id, tag_id=item)
-            )
-        for item in modules:
-            session.execute(
-                articleModules.insert().values(article_id=article.id, module_id=item)
-            )
+        link_tags_and_modules(session, article.id, tags, modules)
 
         flash(
             f"The article <strong>{title}</strong> was successfully created.", "success"
         )
+    if cat_link == glossary.CATEGORY_LINK:
+        glossary.changed(session)
+    invalidation.publish(session, "article", [article.id])
     session.commit()
     session.close()
     return redirect(url_for("admin_category", category_link=cat_link))
 
 
+# Lists the stored revisions of an article
+@app.route("/admin/revisions/<int:article_id>")
+@login_required
+def article_revisions(article_id):
+    session = Session()
+    article = session.query(Article).filter_by(id=article_id).first()
+    items = (
+        session.query(ArticleRevision)
+            .filter_by(article_id=article_id)
+            .order_by(desc(ArticleRevision.number))
+            .all()
+    )
+    stats = revisions.stats(session, article_id)
+    session.close()
+    context = {
+        "sidenav": getSideNav(),
+        "article": article,
+        "revisions": items,
+        "stats": stats,
+        "endpoint": "revisions",
+        "property": "admin",
+    }
+    return render_template("admin/revisions.html", **context)
+
+
+# Shows what a revision changed compared to the one before it
+@app.route("/admin/revisions/<int:article_id>/<int:number>")
+@login_required
+def article_revision(article_id, number):
+    session = Session()
+    article = session.query(Article).filter_by(id=article_id).first()
+    fields = revisions.reconstruct(session, article_id, number)
+    previous = revisions.reconstruct(session, article_id, number - 1) if number > 1 else None
+    session.close()
+    if fields is None:
+        flash(f"Revision <strong>{number}</strong> wasn't found.", "danger")
+        return redirect(url_for("article_revisions", article_id=article_id))
+    context = {
+        "sidenav": getSideNav(),
+        "article": article,
+        "number": number,
+        "fields": fields,
+        "diff": revisions.diff(previous, fields),
+        "endpoint": "revisions",
+        "property": "admin",
+    }
+    return render_template("admin/revision.html", **context)
+
+
+# Puts the summary and content of an old revision back, recorded as a new revision
+@app.route("/admin/revisions/<int:article_id>/<int:number>/restore", methods=["POST"])
+@login_required
+def restore_revision(article_id, number):
+    session = Session()
+    article = session.query(Article).filter_by(id=article_id).first()
+    fields = revisions.reconstruct(session, article_id, number)
+    if article and fields:
+        article.summary = fields["summary"]
+        article.content = fields["content"]
+        article.last_modified = datetime.now()
+        render.schedule(session, article)
+        revisions.record(session, article, current_user.id)
+        # Same as a save, glossary terms and cached pages follow the restored text
+        if article.category.link == glossary.CATEGORY_LINK:
+            glossary.changed(session)
+        invalidation.publish(session, "article", [article.id])
+        session.commit()
+        flash(f"Revision <strong>{number}</strong> was restored.", "success")
+    session.close()
+    return redirect(url_for("article_revisions", article_id=article_id))
+
+
 # Allows to activate or inactivate a sidemenu category so they become visible or hidden to users
 # They remain visible in admin either way
 @app.route("/admin/toggle_active")
@@ -794,24 +1015,53 @@ def toggle_active():
     category = session.query(Category).filter_by(id=cat).first()
     category.active = active
     link = category.link
+    bumpNavVersion(session)
+    invalidation.publish(session, "category", [cat])
     session.commit()
     session.close()
     return redirect(url_for("admin_category", category_link=link))
 
 
+# Lists the latest request profiles of this pod, add ?_profile to any url to record one
+@app.route("/admin/profiles")
+@login_required
+def profiles():
+    context = {
+        "sidenav": getSideNav(),
+        "profiles": profiler.recent(),
+        "sample_rate": profiler.SAMPLE_RATE,
+        "endpoint": "profiles",
+        "property": "admin",
+    }
+    return render_template("admin/profiles.html", **context)
+
+
+# Downloads a profile as collapsed stacks for flamegraph.pl or as a speedscope file
+@app.route("/admin/profiles/<name>.<format>")
+@login_required
+def profile_download(name, format):
+    profile = profiler.load(name)
+    if profile is None or format not in ("collapsed", "speedscope"):
+        abort(404)
+    if format == "collapsed":
+        return profiler.collapsed(profile), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    response = jsonify(profiler.speedscope(profile))
+    response.headers["Content-Disposition"] = f"attachment; filename={name}.speedscope.json"
+    return response
+
+
 @app.route("/admin/users")
 @login_required
 def users():
     session = Session()
-    userlist = session.query(Useraccount)
-    session.close()
+    userlist = batched(session.query(Useraccount).order_by(Useraccount.id))
     context = {
         "sidenav": getSideNav(),
         "users": userlist,
         "endpoint": "edit",
         "property": "admin",
     }
-    return render_template("admin/users.html", **context)
+    return stream_template("admin/users.html", session, **context)
 
 
 @app.route("/admin/build")
@@ -835,12 +1085,160 @@ def build_db():
             "ALTER TABLE category ADD COLUMN IF NOT EXISTS bot INTEGER NOT NULL DEFAULT 0;"
         )
 
+        connection.execute(
+            "ALTER TABLE article ADD COLUMN IF NOT EXISTS rendered_content TEXT;"
+        )
+
+        connection.execute(
+            "ALTER TABLE article ADD COLUMN IF NOT EXISTS rendered_summary TEXT;"
+        )
+
+        for column in [
+            "excerpt TEXT", "reading_time INTEGER", "toc TEXT", "code_block_count INTEGER",
+            "rendered_at TIMESTAMP",
+        ]:
+            connection.execute(f"ALTER TABLE article ADD COLUMN IF NOT EXISTS {column};")
+
         connection.execute(
             "CREATE TABLE IF NOT EXISTS message (id serial PRIMARY KEY, message_type varchar(20) NOT NULL, message varchar(2000) NOT NULL, title varchar(200) NOT NULL, label varchar(100) NOT NULL, author varchar(100) NOT NULL);"
         )
 
+    for table in [Challenge, ChallengeTest, ChallengeSubmission, Settings, ArticleRevision, Redirect]:
+        table.__table__.create(bind=engine, checkfirst=True)
+    jobs.create_tables(engine)
+
     return redirect(url_for("admin"))
 
 
+# Renders all articles again and extracts their metadata, run it after changing either
+@app.cli.command("render-articles")
+@click.option("--workers", default=None, type=int, help="Number of processes to use.")
+def render_articles(workers):
+    session = Session()
+    updated = render.backfill(session, workers)
+    session.close()
+    print(f"Rendered {updated} articles.")
+
+
+# Lists links between articles that lead nowhere, to drafts or through a redirect
+@app.cli.command("check-links")
+@click.option("--workers", default=None, type=int, help="Number of processes to use.")
+def check_links(workers):
+    session = Session()
+    problems = links.scan(session, links.reserved_prefixes(app), workers)
+    session.close()
+    for problem in problems:
+        print(f"{problem['problem']:<10} {problem['href']}  in  {problem['title']} ({problem['article_id']})")
+    print(f"Found {len(problems)} broken or redirected links.")
+
+
+# Runs background jobs in this process, for when JOB_RUNNER=none keeps them out of the web workers
+@app.cli.command("run-jobs")
+@click.option("--once", is_flag=True, help="Exit when no job is due instead of polling.")
+def run_jobs(once):
+    if once:
+        print(f"Ran {jobs.run_pending()} jobs.")
+        return
+    jobs.work()
+
+
+# Grades challenge submissions, it has to start as root so solutions run as GRADER_UID without
+# network access. Web workers running as another user leave submissions pending for it.
+@app.cli.command("run-grader")
+def run_grader():
+    grader.serve()
+
+
+# Measures throughput and latency percentiles under a mix of reader and editor traffic.
+# --url drives a running server, start it with RATE_LIMIT_PROXY_HOPS=1 so visitors get distinct addresses
+@app.cli.command("loadtest")
+@click.option("--url", default=None, help="Base url of a running server, in process when left out.")
+@click.option("--mix", default=loadtest.DEFAULT_MIX, help="Weights per kind of request.")
+@click.option("--concurrency", default=8, help="Number of simulated clients.")
+@click.option("--duration", default=30.0, help="Seconds to run for.")
+@click.option("--requests", default=None, type=int, help="Stop after this many requests instead.")
+@click.option("--seed", "seed_value", default=0, help="Seed for the dataset and the request order.")
+@click.option("--articles", default=200, help="Load test articles to create before the run.")
+@click.option("--password", required=True, help="Password of the load test admin account.")
+@click.option(
+    "--seed-database",
+    is_flag=True,
+    help="Confirms the configured database is disposable, the run adds an admin account and articles.",
+)
+def run_loadtest(url, mix, concurrency, duration, requests, seed_value, articles, password,
+                 seed_database):
+    if not seed_database:
+        raise click.UsageError(
+            f"The load test creates the admin account {loadtest.EMAIL} and {articles} articles, "
+            "pass --seed-database to run it against this database."
+        )
+    mix = loadtest.parse_mix(mix)
+    session = Session()
+    try:
+        created = loadtest.seed(session, articles, seed_value, password)
+        targets = loadtest.load_targets(session)
+        user_id = session.query(Useraccount.id).filter_by(email=loadtest.EMAIL).scalar()
+        session.close()
+        print(f"Created {created} articles, {len(targets['articles'])} published articles in total.")
+        if url:
+            def make_client(generator):
+                return loadtest.HTTPClient(url, loadtest.EMAIL, password, generator)
+
+            counter = loadtest.TransactionCounter(engine) if engine.dialect.name == "postgresql" else None
+        else:
+            app.config["WTF_CSRF_ENABLED"] = False
+
+            def make_client(generator):
+                return loadtest.WSGIClient(app, user_id, generator)
+
+            counter = None
+        summary = loadtest.run(
+            make_client, targets, mix, concurrency, None if requests else duration, requests,
+            seed_value, counter,
+        )
+        print(loadtest.report(summary))
+    finally:
+        session.rollback()
+        deleted = loadtest.cleanup(session)
+        session.close()
+        print(f"Removed the load test account and {deleted} articles.")
+
+
+# Prints a header that gets requests profiled for the next few minutes, for pages admins can't open
+@app.cli.command("profile-header")
+def profile_header():
+    print(f"{profiler.HEADER}: {profiler.header_value()}")
+
+
+# Writes the content snapshot served while the database is unreachable
+@app.cli.command("write-snapshot")
+@click.option("--path", default=snapshot.PATH, help="Where to write the snapshot file.")
+def write_snapshot(path):
+    session = Session()
+    documents, size = snapshot.write(session, path)
+    session.close()
+    print(f"Wrote {documents} documents, {size} bytes to {path}.")
+
+
+# Reports how many bytes the revision history stores per edit
+@app.cli.command("revision-stats")
+@click.option("--simulate", default=0, help="Replay this many random edits on the longest article.")
+def revision_stats(simulate):
+    session = Session()
+    stats = revisions.stats(session)
+    print(
+        f"{stats['revisions']} revisions, {stats['snapshots']} snapshots, "
+        f"{stats['bytes']} bytes, {stats['bytes_per_edit']:.0f} bytes per edit"
+    )
+    if simulate:
+        article = session.query(Article).order_by(desc(func.length(Article.content))).first()
+        result = revisions.simulate(article.content if article else "<p>Example</p>", simulate)
+        print(
+            f"Simulated {result['edits']} edits: {result['delta_bytes_per_edit']:.0f} bytes per edit "
+            f"stored, {result['full_bytes_per_edit']:.0f} bytes per edit as full copies"
+        )
+    session.close()
+
+
 if __name__ == "__main__":
     app.run(debug=DEBUG)
@@ -0,0 +1,251 @@
+import hashlib
+import hmac
+import json
+import os
+from flask import Blueprint, request, abort, url_for
+from werkzeug.http import quote_etag
+from beginnerpy.models import *
+from beginnerpy.db import Session
+from beginnerpy import cache, invalidation
+from beginnerpy.func import getSetting, bumpSetting
+from beginnerpy.bot import grader
+
+MESSAGE_VERSION_SETTING = "BOT_MESSAGE_VERSION"
+
+api_blueprint = Blueprint(
+	"bot_api",
+	__name__,
+	url_prefix="/api/v1/bot",
+)
+
+# Serialized payloads per message type and collection version
+_payload_cache = cache.namespace("bot_messages", ttl=3600)
+
+
+# Bumps the message collection version, call it inside the transaction that changes a message
+def bump_message_version(session):
+	invalidation.publish(session, "messages")
+	return bumpSetting(session, MESSAGE_VERSION_SETTING)
+
+
+invalidation.clears("messages", _payload_cache)
+
+
+def get_message_version(session):
+	return getSetting(session, MESSAGE_VERSION_SETTING, 0)
+
+
+def serialize_message(message):
+	return {
+		"id": message.id,
+		"message_type": message.message_type,
+		"title": message.title,
+		"labels": split_labels(message.label),
+		"author": message.author,
+		"message": message.message,
+	}
+
+
+# The editor stores labels as a single comma or space separated string
+def split_labels(label):
+	return [item for item in label.replace(",", " ").split() if item]
+
+
+def json_response(body, etag, version=None):
+	headers = {
+		"content-type": "application/json",
+		"ETag": quote_etag(etag),
+		"Cache-Control": "no-cache",
+	}
+	if version is not None:
+		headers["X-Collection-Version"] = str(version)
+	return body, 200, headers
+
+
+def not_modified(etag, version=None):
+	headers = {"ETag": quote_etag(etag), "Cache-Control": "no-cache"}
+	if version is not None:
+		headers["X-Collection-Version"] = str(version)
+	return "", 304, headers
+
+
+# Returns the payload and its serialized body, building them only once per collection version
+def build_payload(session, message_type, version):
+	return _payload_cache.get_or_set(
+		f"{message_type}:{version}", lambda: query_payload(session, message_type, version)
+	)
+
+
+def query_payload(session, message_type, version):
+	messages = (
+		session.query(Message)
+		.filter_by(message_type=message_type)
+		.order_by(Message.id)
+		.all()
+	)
+	payload = {
+		"version": version,
+		"message_type": message_type,
+		"messages": [serialize_message(message) for message in messages],
+	}
+	return payload, json.dumps(payload)
+
+
+# Lets the bot check whether anything changed with a single cheap request
+@api_blueprint.route("/version")
+def version():
+	session = Session()
+	current = get_message_version(session)
+	session.close()
+	etag = f"messages-v{current}"
+	if request.if_none_match.contains(etag):
+		return not_modified(etag, current)
+	return json_response(json.dumps({"version": current}), etag, current)
+
+
+# Returns every bot category, these are only edited through the admin so a content hash is enough
+@api_blueprint.route("/categories")
+def categories():
+	session = Session()
+	items = session.query(Category).filter_by(bot=1).order_by(Category.name).all()
+	payload = [
+		{
+			"id": item.id,
+			"name": item.name,
+			"link": item.link,
+			"description": item.description,
+			"active": item.active,
+		}
+		for item in items
+	]
+	session.close()
+	body = json.dumps({"categories": payload})
+	etag = hashlib.sha1(body.encode()).hexdigest()
+	if request.if_none_match.contains(etag):
+		return not_modified(etag)
+	return json_response(body, etag)
+
+
+# Returns all messages of one type (RULE, TIP, HELP) in a single response
+@api_blueprint.route("/messages/<message_type>")
+def messages(message_type):
+	message_type = message_type.upper()
+	session = Session()
+	current = get_message_version(session)
+	etag = f"{message_type}-v{current}"
+	if request.if_none_match.contains(etag):
+		session.close()
+		return not_modified(etag, current)
+	payload, body = build_payload(session, message_type, current)
+	session.close()
+	return json_response(body, etag, current)
+
+
+# Returns the first message of the given type carrying the label
+@api_blueprint.route("/messages/<message_type>/<label>")
+def message(message_type, label):
+	message_type = message_type.upper()
+	session = Session()
+	current = get_message_version(session)
+	etag = f"{message_type}-{label}-v{current}"
+	if request.if_none_match.contains(etag):
+		session.close()
+		return not_modified(etag, current)
+	payload, body = build_payload(session, message_type, current)
+	session.close()
+	label = label.lower()
+	for item in payload["messages"]:
+		if label in [value.lower() for value in item["labels"]]:
+			return json_response(
+				json.dumps({"version": current, "message": item}), etag, current
+			)
+	abort(404)
+
+
+# The bot authenticates its writes with a shared token, without one they are turned away
+def check_token():
+	token = os.environ.get("BOT_API_TOKEN")
+	if not token:
+		abort(503)
+	if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+		abort(401)
+
+
+def serialize_submission(submission):
+	return {
+		"id": submission.id,
+		"challenge_id": submission.challenge_id,
+		"author": submission.author,
+		"status": submission.status,
+		"passed": submission.passed,
+		"total": submission.total,
+		"result": json.loads(submission.result) if submission.result else None,
+		"url": url_for("bot_api.submission", submission_id=submission.id),
+	}
+
+
+# Returns a challenge with the tests that aren't hidden
+@api_blueprint.route("/challenges/<challenge_slug>")
+def challenge(challenge_slug):
+	session = Session()
+	item = session.query(Challenge).filter_by(slug=challenge_slug, active=True).first()
+	if item is None:
+		session.close()
+		abort(404)
+	payload = {
+		"slug": item.slug,
+		"title": item.title,
+		"description": item.description,
+		"function_name": item.function_name,
+		"tests": [
+			{"arguments": json.loads(test.arguments), "expected": json.loads(test.expected)}
+			for test in item.tests
+			if not test.hidden
+		],
+	}
+	session.close()
+	return json.dumps(payload), 200, {"content-type": "application/json"}
+
+
+# Accepts a solution and returns right away, the bot polls the submission url for the grade
+@api_blueprint.route("/challenges/<challenge_slug>/submissions", methods=["POST"])
+def submit_solution(challenge_slug):
+	check_token()
+	data = request.get_json(silent=True) or {}
+	solution = data.get("solution")
+	if not isinstance(solution, str) or not solution.strip():
+		abort(400)
+	session = Session()
+	item = session.query(Challenge).filter_by(slug=challenge_slug, active=True).first()
+	if item is None:
+		session.close()
+		abort(404)
+	try:
+		submission = grader.submit(session, item, str(data.get("author", ""))[:100], solution)
+	except grader.GraderBusy:
+		session.close()
+		return (
+			json.dumps({"error": "The grader is busy, try again shortly."}),
+			503,
+			{"content-type": "application/json", "Retry-After": "10"},
+		)
+	payload = serialize_submission(submission)
+	session.close()
+	status = 202 if payload["status"] == "pending" else 200
+	return (
+		json.dumps(payload),
+		status,
+		{"content-type": "application/json", "Location": payload["url"]},
+	)
+
+
+@api_blueprint.route("/submissions/<int:submission_id>")
+def submission(submission_id):
+	session = Session()
+	item = session.query(ChallengeSubmission).get(submission_id)
+	if item is None:
+		session.close()
+		abort(404)
+	payload = serialize_submission(item)
+	session.close()
+	return json.dumps(payload), 200, {"content-type": "application/json"}
@@ -1,6 +1,13 @@
-from flask import Blueprint, render_template
+import hashlib
+import json
+from datetime import datetime
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask_login import login_required
+from sqlalchemy import desc, func
 from beginnerpy.models import *
+from beginnerpy.db import Session
 from beginnerpy.func import getSideNav
+from beginnerpy.bot import grader
 
 static_folder = "../static/bot"
 template_folder = "../templates/bot"
@@ -15,15 +22,135 @@ challenges_blueprint = Blueprint(
 
 
 @challenges_blueprint.route("/challenges")
+@login_required
 def challenge_home():
+	session = Session()
+	counts = dict(
+		session.query(ChallengeSubmission.challenge_id, func.count(ChallengeSubmission.id))
+		.group_by(ChallengeSubmission.challenge_id)
+		.all()
+	)
+	items = session.query(Challenge).order_by(desc(Challenge.date_created)).all()
+	session.close()
 	context = {
 		"sidenav": getSideNav(),
+		"challenges": items,
+		"submission_counts": counts,
+		"queue_depth": grader.queue_depth(),
 		"endpoint": "challenges",
 		"property": "admin",
 	}
 	return render_template("challenge_list.html", **context)
 
 
+@challenges_blueprint.route("/create_challenge")
+@login_required
+def create_challenge():
+	context = {
+		"sidenav": getSideNav(),
+		"challenge": None,
+		"tests": "",
+		"submissions": [],
+		"endpoint": "challenges",
+		"property": "admin",
+	}
+	return render_template("challenge.html", **context)
+
+
 @challenges_blueprint.route("/challenges/<challenge_slug>")
+@login_required
 def view_challenge(challenge_slug):
-	return render_template("challenge_list.html")
+	session = Session()
+	item = session.query(Challenge).filter_by(slug=challenge_slug).first()
+	if item is None:
+		session.close()
+		flash(f"A challenge with the slug <strong>{challenge_slug}</strong> wasn't found.", "danger")
+		return redirect(url_for("challenges.challenge_home"))
+	tests = "\n".join(
+		json.dumps(
+			{
+				"arguments": json.loads(test.arguments),
+				"expected": json.loads(test.expected),
+				"hidden": bool(test.hidden),
+			}
+		)
+		for test in item.tests
+	)
+	submissions = (
+		session.query(ChallengeSubmission)
+		.filter_by(challenge_id=item.id)
+		.order_by(desc(ChallengeSubmission.id))
+		.limit(50)
+		.all()
+	)
+	session.close()
+	context = {
+		"sidenav": getSideNav(),
+		"challenge": item,
+		"tests": tests,
+		"submissions": submissions,
+		"endpoint": "challenges",
+		"property": "admin",
+	}
+	return render_template("challenge.html", **context)
+
+
+# Parses the tests textarea, one JSON object with arguments, expected and hidden per line
+def parse_tests(text):
+	tests = []
+	for number, line in enumerate(text.splitlines(), 1):
+		if not line.strip():
+			continue
+		try:
+			data = json.loads(line)
+			arguments = data["arguments"]
+			expected = data["expected"]
+		except (ValueError, KeyError, TypeError):
+			raise ValueError(f"Test on line {number} isn't valid JSON with arguments and expected.")
+		if not isinstance(arguments, list):
+			raise ValueError(f"The arguments of the test on line {number} must be a list.")
+		tests.append(
+			ChallengeTest(
+				arguments=json.dumps(arguments),
+				expected=json.dumps(expected),
+				hidden=bool(data.get("hidden", False)),
+			)
+		)
+	return tests
+
+
+def tests_hash(function_name, tests):
+	data = [function_name] + [[test.arguments, test.expected] for test in tests]
+	return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+# Saves a new challenge or updates an existing one, the tests are replaced as a whole
+@challenges_blueprint.route("/save_challenge", methods=["POST"])
+@login_required
+def save_challenge():
+	slug = request.form.get("slug")
+	previous_slug = request.form.get("previous_slug")
+	title = request.form.get("title")
+	try:
+		tests = parse_tests(request.form.get("tests", ""))
+	except ValueError as error:
+		flash(str(error), "danger")
+		if previous_slug:
+			return redirect(url_for("challenges.view_challenge", challenge_slug=previous_slug))
+		return redirect(url_for("challenges.create_challenge"))
+	session = Session()
+	item = session.query(Challenge).filter_by(slug=previous_slug).first() if previous_slug else None
+	if item is None:
+		item = Challenge(date_created=datetime.now())
+		session.add(item)
+	item.slug = slug
+	item.title = title
+	item.description = request.form.get("description", "")
+	item.function_name = request.form.get("function_name")
+	item.active = request.form.get("active") == "on"
+	item.tests = tests
+	item.tests_hash = tests_hash(item.function_name, tests)
+	session.commit()
+	session.close()
+	flash(f"<strong>{title}</strong> challenge has been successfully saved.", "success")
+	return redirect(url_for("challenges.view_challenge", challenge_slug=slug))
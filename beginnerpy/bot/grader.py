@@ -0,0 +1,386 @@
+import ctypes
+import hashlib
+import json
+import os
+import queue
+import resource
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import or_
+from datetime import datetime, timedelta
+from beginnerpy.models import *
+from beginnerpy.db import Session
+from beginnerpy import cache
+
+# Number of solutions graded at the same time by each web worker
+WORKERS = int(os.environ.get("GRADER_WORKERS", 2))
+# Submissions waiting beyond this are rejected so a burst can't grow memory without bound
+QUEUE_SIZE = int(os.environ.get("GRADER_QUEUE_SIZE", 500))
+# Limits applied to every sandboxed run
+TIME_LIMIT = float(os.environ.get("GRADER_TIME_LIMIT", 5))
+CPU_LIMIT = int(os.environ.get("GRADER_CPU_LIMIT", 3))
+MEMORY_LIMIT = int(os.environ.get("GRADER_MEMORY_LIMIT", 256)) * 1024 * 1024
+OUTPUT_LIMIT = 1024 * 1024
+# Processes the sandbox user may have at once across all runs, stops fork bombs
+PROCESS_LIMIT = int(os.environ.get("GRADER_PROCESS_LIMIT", 16))
+# Solutions run as this user, it owns no other process so it can't read their environment
+SANDBOX_UID = int(os.environ.get("GRADER_UID", 65534))
+SANDBOX_GID = int(os.environ.get("GRADER_GID", 65534))
+# How often `flask run-grader` looks for submissions left pending by the web workers
+POLL_INTERVAL = float(os.environ.get("GRADER_POLL_INTERVAL", 2))
+# Submissions still running this long after they were claimed belong to a worker that died
+STALE_AFTER = float(os.environ.get("GRADER_STALE_AFTER", TIME_LIMIT * 6))
+CLONE_NEWNET = 0x40000000
+
+# Loaded before forking, nothing may be loaded between fork and exec
+_libc = ctypes.CDLL(None, use_errno=True)
+
+# Executed by a fresh interpreter, reads the solution and the test arguments from stdin. The
+# expected values never reach it, the parent compares the returned values, so a solution that
+# forges its output can't pass the hidden tests. Results go to a pipe of their own, prefixed
+# with a nonce, and anything else written there fails the run.
+RUNNER = r"""
+import contextlib, io, json, os, sys
+job = json.loads(sys.stdin.read())
+channel = os.fdopen(job.pop("fd"), "w")
+nonce = job.pop("nonce")
+results = []
+with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+	namespace = {"__name__": "__solution__"}
+	try:
+		exec(compile(job["solution"], "<solution>", "exec"), namespace)
+		function = namespace[job["function"]]
+	except BaseException as error:
+		function = None
+		setup_error = f"{type(error).__name__}: {error}"
+	for arguments in job["tests"]:
+		if function is None:
+			results.append({"error": setup_error})
+			continue
+		try:
+			value = function(*arguments)
+		except BaseException as error:
+			results.append({"error": f"{type(error).__name__}: {error}"[:500]})
+			continue
+		try:
+			results.append({"value": json.dumps(value), "returned": repr(value)[:200]})
+		except (TypeError, ValueError):
+			results.append({"error": f"Returned {type(value).__name__}, which isn't a JSON value"})
+channel.write(nonce + json.dumps(results) + "\n")
+channel.close()
+"""
+
+
+class GraderBusy(Exception):
+	pass
+
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_threads = []
+_start_lock = threading.Lock()
+_results = cache.namespace("grader_results", ttl=86400)
+
+
+# Grades are only reusable while the tests stay the same, so they are part of the hash
+def solution_hash(challenge, solution):
+	digest = hashlib.sha256(challenge.tests_hash.encode())
+	digest.update(b"\0")
+	digest.update(solution.strip().encode())
+	return digest.hexdigest()
+
+
+def queue_depth():
+	return _queue.qsize()
+
+
+def cached_result(challenge_id, digest):
+	return _results.get(f"{challenge_id}:{digest}")
+
+
+def store_result(challenge_id, digest, result):
+	_results.set(f"{challenge_id}:{digest}", result)
+
+
+# Looks for an earlier grading of the same solution, first in memory then in the database
+def find_result(session, challenge_id, digest):
+	result = cached_result(challenge_id, digest)
+	if result is not None:
+		return result
+	previous = (
+		session.query(ChallengeSubmission)
+		.filter_by(challenge_id=challenge_id, solution_hash=digest)
+		.filter(ChallengeSubmission.status.in_(["passed", "failed"]))
+		.first()
+	)
+	if previous is None:
+		return None
+	result = {
+		"status": previous.status,
+		"passed": previous.passed,
+		"total": previous.total,
+		"result": previous.result,
+	}
+	store_result(challenge_id, digest, result)
+	return result
+
+
+def apply_result(submission, result):
+	submission.status = result["status"]
+	submission.passed = result["passed"]
+	submission.total = result["total"]
+	submission.result = result["result"]
+	submission.date_graded = datetime.now()
+
+
+# Stores a new submission, answering straight from the cache when the same solution was already graded
+def submit(session, challenge, author, solution):
+	digest = solution_hash(challenge, solution)
+	submission = ChallengeSubmission(
+		challenge_id=challenge.id,
+		author=author,
+		solution=solution,
+		solution_hash=digest,
+		date_created=datetime.now(),
+	)
+	result = find_result(session, challenge.id, digest)
+	if result is not None:
+		apply_result(submission, result)
+	session.add(submission)
+	session.commit()
+	if result is None:
+		try:
+			enqueue(submission.id)
+		except GraderBusy:
+			submission.status = "error"
+			submission.result = json.dumps([{"passed": False, "error": "The grader is busy"}])
+			session.commit()
+			raise
+	return submission
+
+
+def enqueue(submission_id):
+	start()
+	if not _threads:
+		return
+	try:
+		_queue.put_nowait(submission_id)
+	except queue.Full:
+		raise GraderBusy(f"{QUEUE_SIZE} submissions are already waiting to be graded.")
+
+
+# Solutions are only run where they can be given a user and a network of their own. Web
+# workers without that leave submissions pending for `flask run-grader`.
+def sandbox_ready():
+	return os.geteuid() == 0
+
+
+# Starts the grading threads once per process, they outlive the request that triggered them
+def start():
+	if _threads or not sandbox_ready():
+		return
+	with _start_lock:
+		if _threads:
+			return
+		for i in range(WORKERS):
+			thread = threading.Thread(target=work, name=f"grader-{i}", daemon=True)
+			thread.start()
+			_threads.append(thread)
+		requeue_pending()
+
+
+# Submissions left pending or running by a restarted worker are picked up again, claim() stops
+# double grading
+def requeue_pending():
+	session = Session()
+	cutoff = datetime.now() - timedelta(seconds=STALE_AFTER)
+	session.query(ChallengeSubmission).filter(
+		ChallengeSubmission.status == "running",
+		or_(ChallengeSubmission.date_graded.is_(None), ChallengeSubmission.date_graded < cutoff),
+	).update({"status": "pending"}, synchronize_session=False)
+	session.commit()
+	pending = (
+		session.query(ChallengeSubmission.id)
+		.filter_by(status="pending")
+		.order_by(ChallengeSubmission.id)
+		.limit(QUEUE_SIZE // 2)
+		.all()
+	)
+	session.close()
+	for (submission_id,) in pending:
+		try:
+			_queue.put_nowait(submission_id)
+		except queue.Full:
+			break
+
+
+# Grades in a process of its own, for web workers that can't sandbox solutions
+def serve():
+	if not sandbox_ready():
+		raise SystemExit("The grader has to start as root to run solutions as another user.")
+	start()
+	while True:
+		_queue.join()
+		time.sleep(POLL_INTERVAL)
+		requeue_pending()
+
+
+def work():
+	while True:
+		submission_id = _queue.get()
+		try:
+			grade(submission_id)
+		except Exception as error:
+			print(f"Grading submission {submission_id} failed: {error}")
+		finally:
+			_queue.task_done()
+
+
+# Marks the submission as running, only one worker across all processes wins. date_graded holds
+# the claim time until the result replaces it, requeue_pending() goes by it.
+def claim(session, submission_id):
+	claimed = (
+		session.query(ChallengeSubmission)
+		.filter_by(id=submission_id, status="pending")
+		.update({"status": "running", "date_graded": datetime.now()}, synchronize_session=False)
+	)
+	session.commit()
+	return claimed == 1
+
+
+def grade(submission_id):
+	session = Session()
+	try:
+		if not claim(session, submission_id):
+			return
+		submission = session.query(ChallengeSubmission).get(submission_id)
+		result = find_result(session, submission.challenge_id, submission.solution_hash)
+		if result is None:
+			challenge = session.query(Challenge).get(submission.challenge_id)
+			result = run(challenge, submission.solution)
+			if result["status"] != "error":
+				store_result(submission.challenge_id, submission.solution_hash, result)
+		apply_result(submission, result)
+		session.commit()
+	finally:
+		session.close()
+
+
+# Runs in the child between fork and exec. Any failure aborts the run instead of running the
+# solution with less isolation.
+def limit_resources():
+	os.setsid()
+	resource.setrlimit(resource.RLIMIT_CPU, (CPU_LIMIT, CPU_LIMIT))
+	resource.setrlimit(resource.RLIMIT_AS, (MEMORY_LIMIT, MEMORY_LIMIT))
+	resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+	resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+	resource.setrlimit(resource.RLIMIT_NPROC, (PROCESS_LIMIT, PROCESS_LIMIT))
+	# A network namespace of its own has nothing but a loopback device that is down
+	if _libc.unshare(CLONE_NEWNET) != 0:
+		raise OSError(ctypes.get_errno(), "unshare(CLONE_NEWNET) failed")
+	os.setgroups([])
+	os.setgid(SANDBOX_GID)
+	os.setuid(SANDBOX_UID)
+
+
+def read_channel(fd, output):
+	with os.fdopen(fd, "rb") as channel:
+		output.append(channel.read(OUTPUT_LIMIT + 1))
+
+
+def kill_group(process):
+	try:
+		os.killpg(process.pid, signal.SIGKILL)
+	except OSError:
+		pass
+
+
+# Runs a solution against every test of the challenge in an isolated, resource limited interpreter
+def run(challenge, solution):
+	tests = [
+		{"arguments": json.loads(test.arguments), "expected": json.loads(test.expected)}
+		for test in challenge.tests
+	]
+	nonce = secrets.token_hex(16)
+	read_fd, write_fd = os.pipe()
+	job = json.dumps(
+		{
+			"solution": solution,
+			"function": challenge.function_name,
+			"tests": [test["arguments"] for test in tests],
+			"fd": write_fd,
+			"nonce": nonce,
+		}
+	)
+	output = []
+	reader = threading.Thread(target=read_channel, args=(read_fd, output), daemon=True)
+	with tempfile.TemporaryDirectory() as directory:
+		try:
+			process = subprocess.Popen(
+				[sys.executable, "-I", "-S", "-c", RUNNER],
+				stdin=subprocess.PIPE,
+				stdout=subprocess.DEVNULL,
+				stderr=subprocess.DEVNULL,
+				cwd=directory,
+				env={},
+				pass_fds=(write_fd,),
+				preexec_fn=limit_resources,
+			)
+		except (OSError, subprocess.SubprocessError) as error:
+			os.close(read_fd)
+			print(f"Starting the sandbox failed: {error}")
+			return {"status": "error", "passed": 0, "total": len(tests), "result": None}
+		finally:
+			os.close(write_fd)
+		reader.start()
+		try:
+			process.communicate(job.encode(), timeout=TIME_LIMIT)
+		except subprocess.TimeoutExpired:
+			return failure(tests, f"Timed out after {TIME_LIMIT:g} seconds")
+		finally:
+			# Processes the solution started die with it
+			kill_group(process)
+			process.wait()
+			reader.join(1)
+	data = output[0] if output else b""
+	if process.returncode != 0 or len(data) > OUTPUT_LIMIT:
+		return failure(tests, "The solution exceeded its CPU or memory limit")
+	lines = data.decode(errors="replace").splitlines()
+	if len(lines) != 1 or not lines[0].startswith(nonce):
+		return failure(tests, "The solution interfered with the grader's result channel")
+	try:
+		returned = json.loads(lines[0][len(nonce):])
+		if len(returned) != len(tests):
+			raise ValueError("One result per test was expected")
+		results = [compare(item, test["expected"]) for item, test in zip(returned, tests)]
+	except (ValueError, KeyError, TypeError):
+		return {"status": "error", "passed": 0, "total": len(tests), "result": None}
+	passed = sum(1 for item in results if item["passed"])
+	return {
+		"status": "passed" if passed == len(tests) else "failed",
+		"passed": passed,
+		"total": len(tests),
+		"result": json.dumps(results),
+	}
+
+
+def compare(item, expected):
+	if "error" in item:
+		return {"passed": False, "error": str(item["error"])[:500]}
+	value = json.loads(item["value"])
+	return {"passed": value == expected, "returned": str(item["returned"])[:200]}
+
+
+# Runs the grader couldn't finish get "error", it's never cached so the solution is run again
+def failure(tests, reason):
+	results = [{"passed": False, "error": reason} for test in tests]
+	return {
+		"status": "error",
+		"passed": 0,
+		"total": len(tests),
+		"result": json.dumps(results),
+	}
@@ -1,25 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from beginnerpy.models import *
+from beginnerpy.db import Session
 from beginnerpy.func import getSideNav
+from beginnerpy.bot.api import bump_message_version
 from flask_login import login_required
 import urllib.parse
 
-dbname = os.environ.get("DB_NAME", "beginnerpy")
-user = os.environ.get("DB_USER", "postgres")
-host = os.environ.get("DB_HOST", "127.0.0.1")
-port = os.environ.get("DB_PORT", "5432")
-sslmode = "require" if os.environ.get("PRODUCTION", False) else None
-password = os.environ.get("DB_PASSWORD", "P7COFca3DBgu3j")
-
-engine = create_engine(
-	f"postgresql://{user}:{password}@{host}:{port}/{dbname}",
-	connect_args={"sslmode": sslmode},
-)
-
-Session = sessionmaker(bind=engine)
-
 static_folder = "../static/bot"
 template_folder = "../templates/bot"
 rules_blueprint = Blueprint(
@@ -86,6 +72,7 @@ def save_rule():
 		)
 		session.add(item)
 		flash(f"<strong>{item_title}</strong> rule has been successfully created.", "success")
+	bump_message_version(session)
 	session.commit()
 	session.close()
 	return redirect(url_for("admin_category", category_link="messages"))
@@ -99,6 +86,7 @@ def delete_rule(item_title):
 	item = session.query(Message).filter_by(title=item_title).first()
 	if item:
 		session.delete(item)
+		bump_message_version(session)
 		session.commit()
 		flash(f"<strong>{item.title}</strong> has been removed from Rules.", "success")
 	else:
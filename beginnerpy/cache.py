@@ -0,0 +1,407 @@
+import hashlib
+import importlib
+import os
+import pickle
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from beginnerpy.shm import SharedTable
+
+# "local" is a dict per worker, "shared" a memory mapped table for all workers of a pod,
+# "redis://host:port/db" any server speaking the Redis protocol, shared by every pod.
+# Anything else is imported as "module:attribute".
+BACKEND = os.environ.get("CACHE_BACKEND", "shared")
+PREFIX = os.environ.get("CACHE_PREFIX", "bpy")
+LOCAL_SIZE = int(os.environ.get("CACHE_LOCAL_SIZE", 4096))
+SHARED_SLOTS = int(os.environ.get("CACHE_SHM_SLOTS", 2048))
+SHARED_VALUE_SIZE = int(os.environ.get("CACHE_SHM_VALUE_SIZE", 16384))
+REDIS_TIMEOUT = float(os.environ.get("CACHE_REDIS_TIMEOUT", 0.5))
+# A namespace cleared by another worker is noticed after at most this long
+GENERATION_TTL = float(os.environ.get("CACHE_GENERATION_TTL", 1))
+# How long one worker may recompute a value while the others wait for it
+COMPUTE_LOCK_TTL = float(os.environ.get("CACHE_COMPUTE_LOCK_TTL", 10))
+COMPUTE_WAIT = float(os.environ.get("CACHE_COMPUTE_WAIT", 5))
+
+ENTRY = struct.Struct("d")
+MISSING = object()
+
+# Hits, misses and recomputes per namespace counted by this worker, shown on the admin page
+stats = {}
+
+
+def record(name, field):
+    entry = stats.setdefault(name, {"hits": 0, "misses": 0, "computed": 0, "waited": 0, "errors": 0})
+    entry[field] += 1
+
+
+def count(name, hit):
+    record(name, "hits" if hit else "misses")
+
+
+def hit_rates():
+    rates = []
+    for name, entry in sorted(stats.items()):
+        total = entry["hits"] + entry["misses"]
+        rate = entry["hits"] / total * 100 if total else 0
+        rates.append(dict(entry, name=name, rate=rate))
+    return rates
+
+
+class CacheError(Exception):
+    pass
+
+
+def expiry(ttl):
+    return time.time() + ttl if ttl else 0.0
+
+
+def expired(expires):
+    return expires and expires < time.time()
+
+
+# Backends store bytes, the namespaces take care of keys, pickling and stats
+class LocalBackend:
+    shared = False
+
+    def __init__(self, size=LOCAL_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        values = []
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None or expired(entry[0]):
+                    values.append(None)
+                    continue
+                self.entries.move_to_end(key)
+                values.append(entry[1])
+        return values
+
+    def set_many(self, items, ttl=None):
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = (expiry(ttl), value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def add(self, key, value, ttl=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not expired(entry[0]):
+                return False
+            self.entries[key] = (expiry(ttl), value)
+            return True
+
+
+# Values too big for a slot stay in a small per worker cache instead
+class SharedBackend:
+    shared = True
+
+    def __init__(self):
+        self.table = SharedTable("cache", SHARED_SLOTS, SHARED_VALUE_SIZE)
+        self.oversized = LocalBackend(256)
+
+    # Whether a value reaches the other workers or stays in this one's fallback
+    def fits(self, size):
+        return size + ENTRY.size <= SHARED_VALUE_SIZE
+
+    def get_many(self, keys):
+        values = []
+        for key, entry in zip(keys, self.table.get_many(keys)):
+            if entry is None:
+                values.append(self.oversized.get_many([key])[0])
+                continue
+            expires, = ENTRY.unpack_from(entry)
+            values.append(None if expired(expires) else entry[ENTRY.size:])
+        return values
+
+    def set_many(self, items, ttl=None):
+        fitting = []
+        for key, value in items:
+            if not self.fits(len(value)):
+                self.oversized.set_many([(key, value)], ttl)
+            else:
+                fitting.append((key, ENTRY.pack(expiry(ttl)) + value))
+        self.table.set_many(fitting)
+
+    def delete(self, keys):
+        for key in keys:
+            self.table.delete(key)
+        self.oversized.delete(keys)
+
+    def add(self, key, value, ttl=None):
+        new = ENTRY.pack(expiry(ttl)) + value
+
+        def update(entry):
+            if entry is not None and not expired(ENTRY.unpack_from(entry)[0]):
+                return None
+            return new
+
+        return self.table.update(key, update) is not None
+
+
+# A small client for the Redis protocol, one connection per thread and commands are pipelined
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url):
+        parts = urllib.parse.urlparse(url)
+        self.address = (parts.hostname or "localhost", parts.port or 6379)
+        self.password = parts.password
+        self.database = int(parts.path.strip("/") or 0)
+        self.local = threading.local()
+
+    def connect(self):
+        connection = socket.create_connection(self.address, timeout=REDIS_TIMEOUT)
+        self.local.socket = connection
+        self.local.reader = connection.makefile("rb")
+        self.local.pid = os.getpid()
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.database:
+            setup.append(("SELECT", self.database))
+        if setup:
+            self.pipeline(setup)
+
+    def close(self):
+        try:
+            self.local.socket.close()
+        except (AttributeError, OSError):
+            pass
+        self.local.socket = None
+
+    @staticmethod
+    def encode(command):
+        parts = [b"*%d\r\n" % len(command)]
+        for argument in command:
+            if not isinstance(argument, bytes):
+                argument = str(argument).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(argument), argument))
+        return b"".join(parts)
+
+    def read_reply(self):
+        line = self.local.reader.readline()
+        if not line:
+            raise CacheError("Connection closed by the cache server.")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise CacheError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return self.local.reader.read(length + 2)[:-2]
+        if kind == b"*":
+            return [self.read_reply() for i in range(int(rest))]
+        raise CacheError(f"Unexpected reply from the cache server: {line!r}")
+
+    def pipeline(self, commands):
+        if getattr(self.local, "socket", None) is None or self.local.pid != os.getpid():
+            self.connect()
+        try:
+            self.local.socket.sendall(b"".join(self.encode(command) for command in commands))
+            return [self.read_reply() for command in commands]
+        except (OSError, CacheError):
+            self.close()
+            raise
+
+    def get_many(self, keys):
+        return self.pipeline([("MGET", *keys)])[0]
+
+    def set_many(self, items, ttl=None):
+        expires = ("PX", int(ttl * 1000)) if ttl else ()
+        self.pipeline([("SET", key, value, *expires) for key, value in items])
+
+    def delete(self, keys):
+        self.pipeline([("DEL", *keys)])
+
+    def add(self, key, value, ttl=None):
+        expires = ("PX", int(ttl * 1000)) if ttl else ()
+        return self.pipeline([("SET", key, value, "NX", *expires)])[0] is not None
+
+
+def load_backend(name):
+    if name == "local":
+        return LocalBackend()
+    if name == "shared":
+        return SharedBackend()
+    if name.startswith("redis://"):
+        return RedisBackend(name)
+    module, _, attribute = name.partition(":")
+    backend = getattr(importlib.import_module(module), attribute)
+    return backend() if isinstance(backend, type) else backend
+
+
+backend = load_backend(BACKEND)
+namespaces = {}
+
+
+# Keys of a namespace carry its generation, so clearing it is a single write
+class Namespace:
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = ttl
+        self.generation = None
+        self.checked = 0
+        self.locks = [threading.Lock() for i in range(16)]
+        # Set once a value of this namespace was too big for the shared backend, other workers
+        # can't wait for values that stay in this worker
+        self.oversized = False
+
+    def generation_key(self):
+        return f"{PREFIX}:{self.name}:generation"
+
+    # A generation lost to eviction is replaced by a new one, so old entries are never trusted again
+    def current_generation(self):
+        now = time.monotonic()
+        if self.generation is None or now - self.checked > GENERATION_TTL:
+            value = backend.get_many([self.generation_key()])[0]
+            if value is None:
+                backend.add(self.generation_key(), str(time.time_ns()).encode())
+                value = backend.get_many([self.generation_key()])[0] or b"0"
+            self.generation = int(value)
+            self.checked = now
+        return self.generation
+
+    def full_key(self, key):
+        return f"{PREFIX}:{self.name}:{self.current_generation()}:{key}"
+
+    def error(self):
+        record(self.name, "errors")
+
+    # Returns the cached values by key, keys that aren't cached are left out
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            values = backend.get_many([self.full_key(key) for key in keys])
+        except (OSError, CacheError):
+            self.error()
+            values = [None] * len(keys)
+        found = {}
+        for key, value in zip(keys, values):
+            count(self.name, value is not None)
+            if value is not None:
+                found[key] = pickle.loads(value)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, mapping, ttl=None):
+        items = [(self.full_key(key), pickle.dumps(value)) for key, value in mapping.items()]
+        fits = getattr(backend, "fits", None)
+        if fits is not None and not all(fits(len(value)) for key, value in items):
+            self.oversized = True
+        try:
+            backend.set_many(items, ttl or self.ttl)
+        except (OSError, CacheError):
+            self.error()
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def delete(self, *keys):
+        try:
+            backend.delete([self.full_key(key) for key in keys])
+        except (OSError, CacheError):
+            self.error()
+
+    def clear(self):
+        generation = time.time_ns()
+        try:
+            backend.set_many([(self.generation_key(), str(generation).encode())])
+            self.generation = generation
+            self.checked = time.monotonic()
+        except (OSError, CacheError):
+            self.error()
+
+    # Returns the cached value or computes and stores it. Only one thread per worker, and with a
+    # shared backend only one worker, computes a missing value while the others wait for it.
+    def get_or_set(self, key, function, ttl=None):
+        value = self.get_many([key]).get(key, MISSING)
+        if value is not MISSING:
+            return value
+        stripe = self.locks[int(hashlib.sha1(key.encode()).hexdigest()[:4], 16) % len(self.locks)]
+        with stripe:
+            value = self.peek(key)
+            if value is not MISSING:
+                return value
+            # Values only this worker will see aren't worth making the others wait for
+            shared = backend.shared and not self.oversized
+            locked = self.lock(key) if shared else True
+            if not locked:
+                value = self.wait(key)
+                if value is not MISSING:
+                    return value
+            try:
+                value = function()
+                record(self.name, "computed")
+                self.set(key, value, ttl)
+            finally:
+                if locked and shared:
+                    self.unlock(key)
+            return value
+
+    # Looks up a value without counting it as a hit or miss
+    def peek(self, key):
+        try:
+            value = backend.get_many([self.full_key(key)])[0]
+        except (OSError, CacheError):
+            return MISSING
+        return MISSING if value is None else pickle.loads(value)
+
+    def lock(self, key):
+        if not backend.shared:
+            return True
+        try:
+            return backend.add(self.full_key(key) + ":lock", b"1", COMPUTE_LOCK_TTL)
+        except (OSError, CacheError):
+            return True
+
+    def unlock(self, key):
+        try:
+            backend.delete([self.full_key(key) + ":lock"])
+        except (OSError, CacheError):
+            self.error()
+
+    # Another worker is computing the value. It is computed here as well once that worker let go
+    # of the lock without storing a value anyone else can see, or after waiting too long.
+    def wait(self, key):
+        deadline = time.monotonic() + COMPUTE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            try:
+                value, lock = backend.get_many([self.full_key(key), self.full_key(key) + ":lock"])
+            except (OSError, CacheError):
+                return MISSING
+            if value is not None:
+                record(self.name, "waited")
+                return pickle.loads(value)
+            if lock is None:
+                return MISSING
+        return MISSING
+
+
+def namespace(name, ttl=None):
+    if name not in namespaces:
+        namespaces[name] = Namespace(name, ttl)
+    return namespaces[name]
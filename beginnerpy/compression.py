@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import os
+import time
+from flask import request
+from beginnerpy import cache
+
+try:
+    import brotli
+except ImportError:  # Without it every client gets gzip
+    brotli = None
+
+# Smaller bodies fit into a few packets either way
+MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+# Bodies with an ETag are compressed once and kept, so they can afford the slower levels
+CACHED_GZIP_LEVEL = int(os.environ.get("COMPRESS_CACHED_GZIP_LEVEL", 9))
+CACHED_BROTLI_QUALITY = int(os.environ.get("COMPRESS_CACHED_BROTLI_QUALITY", 9))
+# Responses the views build. Static files are sent straight from disk and left to the ingress,
+# enable use-gzip in the ingress-nginx configuration to compress them.
+TYPES = {
+    "text/html",
+    "text/plain",
+    "application/json",
+}
+
+_bodies = cache.namespace("compressed", ttl=3600)
+
+# Responses, bytes before and after, CPU time and cached bodies per endpoint counted by this
+# worker, shown on the admin page
+stats = {}
+
+
+def record(endpoint, size, compressed_size, cpu, cached):
+    entry = stats.setdefault(
+        endpoint, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_ms": 0.0, "cached": 0}
+    )
+    entry["responses"] += 1
+    entry["bytes_in"] += size
+    entry["bytes_out"] += compressed_size
+    entry["cpu_ms"] += cpu * 1000
+    entry["cached"] += cached
+
+
+def route_stats():
+    rows = []
+    for endpoint, entry in sorted(stats.items()):
+        ratio = entry["bytes_in"] / entry["bytes_out"] if entry["bytes_out"] else 0
+        computed = entry["responses"] - entry["cached"]
+        rows.append(
+            dict(
+                entry,
+                endpoint=endpoint,
+                ratio=ratio,
+                cpu_per_response=entry["cpu_ms"] / computed if computed else 0,
+            )
+        )
+    return rows
+
+
+# The best encoding the client accepts, brotli wins a tie
+def negotiate():
+    accepted = request.accept_encodings
+    choices = []
+    if brotli is not None and accepted.quality("br"):
+        choices.append((accepted.quality("br"), 1, "br"))
+    if accepted.quality("gzip"):
+        choices.append((accepted.quality("gzip"), 0, "gzip"))
+    return max(choices)[2] if choices else None
+
+
+def compress(data, encoding, cached):
+    if encoding == "br":
+        return brotli.compress(data, quality=CACHED_BROTLI_QUALITY if cached else BROTLI_QUALITY)
+    return gzip.compress(data, CACHED_GZIP_LEVEL if cached else GZIP_LEVEL, mtime=0)
+
+
+def compressible(response):
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return False
+    if "Content-Encoding" in response.headers or response.mimetype not in TYPES:
+        return False
+    return response.content_length is None or response.content_length >= MIN_SIZE
+
+
+def init_app(app):
+    # Registered before the other hooks so it runs after them, on the final headers and body
+    @app.after_request
+    def compress_response(response):
+        if not compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate()
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        started = time.thread_time()
+        etag = response.get_etag()[0]
+        if etag:
+            # The ETag names the uncompressed body, the path and size guard against reuse elsewhere
+            key = hashlib.sha1(f"{encoding}|{request.path}|{etag}|{len(data)}".encode()).hexdigest()
+            found = _bodies.get(key)
+            if found is None:
+                found = compress(data, encoding, cached=True)
+                _bodies.set(key, found)
+                cached = False
+            else:
+                cached = True
+        else:
+            found = compress(data, encoding, cached=False)
+            cached = False
+        # Compressing doesn't always pay off, tiny or already compressed bodies can grow
+        if len(found) >= len(data):
+            return response
+        record(request.endpoint or "static", len(data), len(found), time.thread_time() - started, cached)
+        response.set_data(found)
+        # The ETag is left alone, the bot compares it strongly and each encoding keeps its own
+        # cache entry through Vary
+        response.headers["Content-Encoding"] = encoding
+        return response
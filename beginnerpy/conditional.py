@@ -0,0 +1,142 @@
+import hashlib
+import os
+from flask import g, request, session as flask_session, current_app
+from flask_login import current_user
+from sqlalchemy import case, func
+from beginnerpy.models import Article, Category, Tag, Module, articleTags, articleModules
+from beginnerpy.db import Session
+from beginnerpy.func import getSetting
+
+# Changes with every deploy, templates and static files may have changed with it
+BUILD_ID = os.environ.get("BUILD_ID", "dev")
+# Browsers revalidate listings every time, the ingress keeps them briefly. Articles change rarely
+# and may be reused for a minute without asking.
+CACHE_CONTROL = {
+    "index": "public, max-age=0, s-maxage=30, stale-while-revalidate=60",
+    "category": "public, max-age=0, s-maxage=60, stale-while-revalidate=120",
+    "tag": "public, max-age=0, s-maxage=60, stale-while-revalidate=120",
+    "module": "public, max-age=0, s-maxage=60, stale-while-revalidate=120",
+    "page": "public, max-age=60, s-maxage=300, stale-while-revalidate=600",
+}
+PRIVATE = "private, no-cache"
+
+# The newer of the last edit and the last render, which changes what listings show as well
+edited = func.coalesce(Article.last_modified, Article.date_created)
+changed = case([(Article.rendered_at > edited, Article.rendered_at)], else_=edited)
+
+
+# Newest change and number of the published articles matching, an unpublished or deleted
+# article lowers the count even when the newest change stays the same
+def published(session, *criteria, join=None):
+    query = session.query(func.max(changed), func.count(Article.id)).filter(Article.draft == 0)
+    if join is not None:
+        query = query.join(join)
+    return query.filter(*criteria).one()
+
+
+def index_state(session, arguments):
+    return published(session)
+
+
+def category_state(session, arguments):
+    category = (
+        session.query(Category.id, Category.active)
+        .filter_by(link=arguments["category_link"])
+        .first()
+    )
+    if category is None or not category.active:
+        return None
+    return published(session, Article.category_id == category.id)
+
+
+def tag_state(session, arguments):
+    tag_id = session.query(Tag.id).filter_by(link=arguments["tag_link"]).scalar()
+    if tag_id is None:
+        return None
+    return published(session, articleTags.c.tag_id == tag_id, join=articleTags)
+
+
+def module_state(session, arguments):
+    module_id = session.query(Module.id).filter_by(link=arguments["module_link"]).scalar()
+    if module_id is None:
+        return None
+    return published(session, articleModules.c.module_id == module_id, join=articleModules)
+
+
+def page_state(session, arguments):
+    link = arguments["link"]
+    if arguments.get("module"):
+        link = f"{arguments['module']}/{link}"
+    article = session.query(Article.id, changed, Article.draft).filter_by(link=link).first()
+    if article is None or article.draft:
+        return None
+    return article[1], article.id
+
+
+STATES = {
+    "index": index_state,
+    "category": category_state,
+    "tag": tag_state,
+    "module": module_state,
+    "page": page_state,
+}
+
+
+# The ETag and Last-Modified of the page, None when the view decides alone (missing, draft, ...)
+def validators(session, endpoint, arguments):
+    state = STATES[endpoint](session, arguments)
+    if state is None or state[0] is None:
+        return None
+    modified = state[0].replace(microsecond=0)
+    nav_version = getSetting(session, "NAV_VERSION", 0)
+    # The ETag keeps the microseconds, the render job often writes within a second of the save
+    parts = [BUILD_ID, endpoint, request.path, nav_version, state[0].isoformat(), *state[1:]]
+    etag = hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:20]
+    return etag, modified
+
+
+def cacheable():
+    if request.method not in ("GET", "HEAD") or request.endpoint not in STATES:
+        return False
+    # Admins see edit links and anyone may have a message flashed to them
+    return "_flashes" not in flask_session and not current_user.is_authenticated
+
+
+def not_modified(etag, modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return bool(request.if_modified_since) and modified <= request.if_modified_since
+
+
+def init_app(app):
+    # Answers a revalidation with a 304 before the view queries and renders anything
+    @app.before_request
+    def check_validators():
+        if not cacheable():
+            return None
+        session = Session()
+        try:
+            found = validators(session, request.endpoint, request.view_args or {})
+        finally:
+            session.close()
+        if found is None:
+            return None
+        g.validators = found
+        if not_modified(*found):
+            return current_app.response_class(status=304)
+        return None
+
+    @app.after_request
+    def add_validators(response):
+        found = g.get("validators")
+        if found is None or response.status_code not in (200, 304):
+            return response
+        response.set_etag(found[0], weak=True)
+        response.last_modified = found[1]
+        response.vary.add("Cookie")
+        # A response setting a cookie belongs to one visitor
+        if flask_session.modified:
+            response.headers["Cache-Control"] = PRIVATE
+        else:
+            response.headers["Cache-Control"] = CACHE_CONTROL[request.endpoint]
+        return response
@@ -0,0 +1,243 @@
+import os
+import random
+import threading
+import time
+from flask import has_request_context, request, g, session as cookie
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, Session as BaseSession
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+dbname = os.environ.get("DB_NAME", "bpydb")
+user = os.environ.get("DB_USER", "postgresadmin")
+host = os.environ.get("DB_HOST", "0.0.0.0")
+port = os.environ.get("DB_PORT", "5432")
+sslmode = "require" if os.environ.get("PRODUCTION", False) else None
+password = os.environ.get("DB_PASSWORD", "dev-env-password-safe-to-be-public")
+
+# Comma separated host[:port] list, the replicas use the primary's database and credentials
+REPLICA_HOSTS = os.environ.get("DB_REPLICA_HOSTS", "")
+# Full urls take precedence, handy for pointing at local stand-ins
+PRIMARY_URL = os.environ.get("DB_URL")
+REPLICA_URLS = os.environ.get("DB_REPLICA_URLS", "")
+# LISTEN needs a server session of its own, a pooler in transaction mode like the DigitalOcean
+# pool named by DB_NAME never delivers notifications. Listeners connect to the database directly
+# through DB_LISTEN_URL, or DB_LISTEN_HOST, DB_LISTEN_PORT and DB_LISTEN_NAME with the usual
+# credentials. With none of them set they use the main connection settings.
+LISTEN_URL = os.environ.get("DB_LISTEN_URL")
+LISTEN_HOST = os.environ.get("DB_LISTEN_HOST", host)
+LISTEN_PORT = os.environ.get("DB_LISTEN_PORT")
+LISTEN_NAME = os.environ.get("DB_LISTEN_NAME")
+REPLICA_CHECK_INTERVAL = float(os.environ.get("DB_REPLICA_CHECK_INTERVAL", 10))
+# A replica further behind than this is skipped until it catches up
+REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG", 5))
+# After a write, the same browser keeps reading from the primary for this long
+STICKY_SECONDS = float(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+# How quickly old connection wait times stop counting
+POOL_WAIT_HALF_LIFE = float(os.environ.get("DB_POOL_WAIT_HALF_LIFE", 5))
+
+
+# Moving average of how long getting a connection took in this worker. It decays with time as
+# well as with new samples, so it drops again while requests are being turned away.
+class PoolWait:
+    def __init__(self, half_life):
+        self.half_life = half_life
+        self.value = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def current(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.value * 0.5 ** ((now - self.updated) / self.half_life)
+
+    def add(self, seconds):
+        with self.lock:
+            now = time.monotonic()
+            value = self.current(now)
+            self.value = value + 0.2 * (seconds - value)
+            self.updated = now
+
+
+_pool_wait = PoolWait(POOL_WAIT_HALF_LIFE)
+
+
+def pool_wait():
+    return _pool_wait.current()
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            _pool_wait.add(time.monotonic() - start)
+
+
+def make_engine(url):
+    if url.startswith("postgresql"):
+        return create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            connect_args={"sslmode": sslmode},
+            pool_recycle=300,
+            max_overflow=0,
+        )
+    return create_engine(url)
+
+
+def replica_urls():
+    if REPLICA_URLS:
+        return [url.strip() for url in REPLICA_URLS.split(",") if url.strip()]
+    urls = []
+    for item in REPLICA_HOSTS.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        replica_host, _, replica_port = item.partition(":")
+        urls.append(
+            f"postgresql://{user}:{password}@{replica_host}:{replica_port or port}/{dbname}"
+        )
+    return urls
+
+
+engine = make_engine(PRIMARY_URL or f"postgresql://{user}:{password}@{host}:{port}/{dbname}")
+
+
+def listen_url():
+    if LISTEN_URL:
+        return LISTEN_URL
+    if LISTEN_PORT or LISTEN_NAME:
+        return (
+            f"postgresql://{user}:{password}@{LISTEN_HOST}:{LISTEN_PORT or port}/"
+            f"{LISTEN_NAME or dbname}"
+        )
+    return None
+
+
+_listen_engine = []
+
+
+# Connections held in LISTEN for the life of a worker, they never go back to a pool
+def listen_engine():
+    url = listen_url()
+    if url is None:
+        return engine
+    if not _listen_engine:
+        arguments = {"sslmode": sslmode} if url.startswith("postgresql") else {}
+        _listen_engine.append(create_engine(url, poolclass=NullPool, connect_args=arguments))
+    return _listen_engine[0]
+
+
+class Replica:
+    def __init__(self, url):
+        self.engine = make_engine(url)
+        self.healthy = True
+        self.checked = 0
+        self.lag = None
+        event.listen(self.engine, "handle_error", self.on_error)
+
+    # A dropped connection takes the replica out of rotation until the next successful check
+    def on_error(self, context):
+        if context.is_disconnect:
+            self.healthy = False
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = connection.execute(
+                        "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                    ).scalar()
+                else:
+                    connection.execute("SELECT 1")
+                    self.lag = 0
+            self.healthy = self.lag <= REPLICA_MAX_LAG
+        except Exception:
+            self.healthy = False
+        self.checked = time.monotonic()
+        return self.healthy
+
+
+replicas = [Replica(url) for url in replica_urls()]
+_checker = []
+_checker_lock = threading.Lock()
+
+
+def check_replicas():
+    while True:
+        for replica in replicas:
+            replica.check()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+# The checker starts on first use so it runs in each gunicorn worker and not in the master
+def start_checker():
+    if _checker:
+        return
+    with _checker_lock:
+        if _checker:
+            return
+        thread = threading.Thread(target=check_replicas, name="replica-check", daemon=True)
+        thread.start()
+        _checker.append(thread)
+
+
+def pick_replica():
+    if not replicas:
+        return None
+    start_checker()
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None
+    return random.choice(healthy).engine
+
+
+# Only reads of safe requests may use a replica, and not right after the same browser wrote something
+def replica_allowed():
+    if not has_request_context() or request.method not in ("GET", "HEAD"):
+        return False
+    if g.get("db_primary"):
+        return False
+    return cookie.get("db_primary_until", 0) < time.time()
+
+
+# Call inside a GET handler whose reads must see the latest writes
+def use_primary():
+    g.db_primary = True
+
+
+def stick_to_primary():
+    cookie["db_primary_until"] = time.time() + STICKY_SECONDS
+
+
+# Sends reads to a replica when allowed, everything else and everything after a write to the primary
+class RoutingSession(BaseSession):
+    def __init__(self, primary=False, **kwargs):
+        super().__init__(**kwargs)
+        self.primary = primary
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self.primary:
+            if self._flushing or isinstance(clause, UpdateBase) or is_locking(clause):
+                self.primary = True
+            elif replica_allowed():
+                replica = pick_replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause)
+
+
+def is_locking(clause):
+    return getattr(clause, "_for_update_arg", None) is not None
+
+
+Session = sessionmaker(class_=RoutingSession, bind=engine)
+
+
+def init_app(app):
+    @app.after_request
+    def remember_write(response):
+        if request.method not in ("GET", "HEAD", "OPTIONS") and replicas:
+            stick_to_primary()
+        return response
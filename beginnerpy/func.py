@@ -1,21 +1,9 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from beginnerpy.models import Category
-
-dbname = os.environ.get("DB_NAME", "beginnerpy")
-user = os.environ.get("DB_USER", "postgres")
-host = os.environ.get("DB_HOST", "127.0.0.1")
-port = os.environ.get("DB_PORT", "5432")
-sslmode = "require" if os.environ.get("PRODUCTION", False) else None
-password = os.environ.get("DB_PASSWORD", "P7COFca3DBgu3j")
-
-engine = create_engine(
-	f"postgresql://{user}:{password}@{host}:{port}/{dbname}",
-	connect_args={"sslmode": sslmode},
-)
-
-Session = sessionmaker(bind=engine)
+import pickle
+import re
+from sqlalchemy import func, select
+from beginnerpy.models import Category, Settings
+from beginnerpy.db import engine, Session
 
 # Returns the sidebar navigation elements in alphabetical order
 def getSideNav():
@@ -39,3 +27,51 @@ def getSideNav():
 	session.close()
 	return nav
 
+
+
+# Fix removed <br> tags in code blocks by replacing them with \n
+def replaceBr(string):
+	summ = re.findall(r"<code|</code>|.+?(?=<code|</code>|$)", string)
+	insidePre = False
+	for item in summ:
+		if insidePre:
+			summ[summ.index(item)] = item.replace("<br>", "\n")
+		if item == "<code":
+			insidePre = True
+		else:
+			insidePre = False
+	string = "".join(summ)
+	return string
+
+# Reads a pickled value from the settings table
+def getSetting(session, name, default=None):
+	row = session.query(Settings).filter_by(name=name).first()
+	if row is None or row.value is None:
+		return default
+	return pickle.loads(row.value.encode())
+
+
+# Stores a value in the settings table, creating the row if it doesn't exist yet
+def setSetting(session, name, value):
+	row = session.query(Settings).filter_by(name=name).first()
+	if row is None:
+		row = Settings(name=name)
+		session.add(row)
+	row.value = pickle.dumps(value, protocol=0).decode()
+	return value
+
+
+# Increments an integer setting, locking the row so concurrent writers get distinct values. The
+# first writers of a missing row have nothing to lock, they queue on an advisory lock instead.
+def bumpSetting(session, name):
+	row = session.query(Settings).filter_by(name=name).with_for_update().first()
+	if row is None and engine.dialect.name == "postgresql":
+		session.execute(select([func.pg_advisory_xact_lock(func.hashtext(name))]))
+		row = session.query(Settings).filter_by(name=name).with_for_update().first()
+	current = pickle.loads(row.value.encode()) if row and row.value else 0
+	return setSetting(session, name, current + 1)
+
+
+# Marks the navigation, tags or modules as changed, every public page shows them
+def bumpNavVersion(session):
+	return bumpSetting(session, "NAV_VERSION")
@@ -0,0 +1,176 @@
+import re
+from collections import deque, namedtuple
+from sqlalchemy import func
+from beginnerpy.models import Article, Category
+from beginnerpy import jobs
+
+CATEGORY_LINK = "glossary"
+# Links are left out of code, existing links and the headings
+SKIPPED_TAGS = {"a", "code", "pre", "script", "style", "h1", "h2", "h3", "h4", "h5", "h6"}
+TAG = re.compile(r"(<[^>]*>)")
+TAG_NAME = re.compile(r"</?\s*([a-zA-Z0-9]+)")
+
+Term = namedtuple("Term", "text url article_id")
+
+
+def is_word_character(character):
+    return character.isalnum() or character == "_"
+
+
+def lower(text):
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    # A few characters lower to more than one, positions have to stay the same
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+# Aho-Corasick: a trie of all terms with failure links, finds every term in one pass over the text
+class Matcher:
+    def __init__(self, terms):
+        self.terms = list(terms)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for index, term in enumerate(self.terms):
+            state = 0
+            for character in lower(term.text):
+                following = self.goto[state].get(character)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto[state][character] = following
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                state = following
+            if self.output[state] is None:
+                self.output[state] = index
+        # The nearest state down the failure links that ends a term
+        self.next_output = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, following in self.goto[state].items():
+                queue.append(following)
+                fallback = self.fail[state]
+                while fallback and character not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = failed = self.goto[fallback].get(character, 0)
+                self.next_output[following] = (
+                    failed if self.output[failed] is not None else self.next_output[failed]
+                )
+
+    # (start, end, term index) of every occurrence, overlapping ones included
+    def find(self, text):
+        state = 0
+        for position, character in enumerate(lower(text)):
+            while state and character not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(character, 0)
+            found = state if self.output[state] is not None else self.next_output[state]
+            while found:
+                index = self.output[found]
+                yield position + 1 - len(self.terms[index].text), position + 1, index
+                found = self.next_output[found]
+
+    # Whole word occurrences, the leftmost and then longest wins where they overlap
+    def matches(self, text):
+        chosen = []
+        end = 0
+        for start, stop, index in sorted(self.find(text), key=lambda m: (m[0], m[0] - m[1])):
+            if start < end:
+                continue
+            if start > 0 and is_word_character(text[start - 1]):
+                continue
+            if stop < len(text) and is_word_character(text[stop]):
+                continue
+            chosen.append((start, stop, index))
+            end = stop
+        return chosen
+
+
+# Links the first occurrence of each term in the article's text, a glossary entry doesn't
+# link to itself
+def link_terms(html, matcher, article_id=None):
+    if not html or matcher is None or not matcher.terms:
+        return html
+    linked = set()
+    skipped = 0
+    parts = TAG.split(html)
+    for position, part in enumerate(parts):
+        if position % 2:
+            name = TAG_NAME.match(part)
+            if name and name.group(1).lower() in SKIPPED_TAGS and not part.endswith("/>"):
+                skipped = max(0, skipped - 1) if part.startswith("</") else skipped + 1
+            continue
+        if skipped or not part.strip():
+            continue
+        pieces = []
+        last = 0
+        for start, stop, index in matcher.matches(part):
+            term = matcher.terms[index]
+            if term.url in linked or term.article_id == article_id:
+                continue
+            linked.add(term.url)
+            pieces.append(part[last:start])
+            pieces.append(f'<a href="{term.url}" class="glossary-link">{part[start:stop]}</a>')
+            last = stop
+        if pieces:
+            parts[position] = "".join(pieces) + part[last:]
+    return "".join(parts)
+
+
+def load_terms(session):
+    rows = (
+        session.query(Article.title, Article.link, Article.id)
+        .join(Category, Article.category_id == Category.id)
+        .filter(Category.link == CATEGORY_LINK, Article.draft == 0)
+        .all()
+    )
+    # Longer titles first, so a duplicate title links to the more specific entry
+    return [
+        Term(title.strip(), f"/{CATEGORY_LINK}/{link}", article_id)
+        for title, link, article_id in sorted(rows, key=lambda row: -len(row[0] or ""))
+        if title and title.strip()
+    ]
+
+
+# The matcher of this process, rebuilt when the glossary's newest change or size changes
+_state = {"version": None, "matcher": None}
+
+
+def version(session):
+    changed = func.coalesce(Article.last_modified, Article.date_created)
+    return tuple(
+        session.query(func.max(changed), func.count(Article.id))
+        .join(Category, Article.category_id == Category.id)
+        .filter(Category.link == CATEGORY_LINK, Article.draft == 0)
+        .one()
+    )
+
+
+def refresh(session):
+    current = version(session)
+    if current != _state["version"]:
+        _state["matcher"] = Matcher(load_terms(session))
+        _state["version"] = current
+    return _state["matcher"]
+
+
+def matcher():
+    return _state["matcher"]
+
+
+# Sets the terms of a worker process of the backfill, the parent already loaded them
+def use_terms(terms):
+    _state["matcher"] = Matcher(terms)
+
+
+def terms():
+    return _state["matcher"].terms if _state["matcher"] else []
+
+
+# Every article may link to an entry that was added, renamed or removed, so all are rendered again.
+# The job bumps the navigation version once they are, see render.render_all_job.
+def changed(session):
+    jobs.enqueue(session, "render_all_articles")
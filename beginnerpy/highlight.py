@@ -0,0 +1,116 @@
+import hashlib
+import html
+import re
+from beginnerpy import cache
+
+try:
+    from pygments import lex
+    from pygments.lexers import get_lexer_by_name
+    from pygments.token import Token
+    from pygments.util import ClassNotFound
+except ImportError:  # Code blocks are then shipped escaped but without token markup
+    lex = None
+
+# CKEditor's code block language names that pygments knows by another name
+LANGUAGE_ALIASES = {"plaintext": "text", "cs": "csharp"}
+
+CODE_BLOCK = re.compile(
+    r"<pre[^>]*>\s*<code([^>]*)>(.*?)</code>\s*</pre>", re.DOTALL | re.IGNORECASE
+)
+LANGUAGE_CLASS = re.compile(r"\blang(?:uage)?-([\w+#-]+)", re.IGNORECASE)
+TAG = re.compile(r"<[^>]+>")
+BR = re.compile(r"<br\s*/?>", re.IGNORECASE)
+
+_cache = cache.namespace("highlight")
+
+
+# Maps pygments token types to the class names prism.css already styles
+def prism_classes():
+    return {
+        Token.Comment: "comment",
+        Token.Keyword: "keyword",
+        Token.Keyword.Constant: "boolean",
+        Token.Name.Builtin: "builtin",
+        Token.Name.Builtin.Pseudo: "builtin",
+        Token.Name.Exception: "class-name",
+        Token.Name.Class: "class-name",
+        Token.Name.Function: "function",
+        Token.Name.Function.Magic: "function",
+        Token.Name.Decorator: "decorator",
+        Token.Name.Tag: "tag",
+        Token.Name.Attribute: "attr-name",
+        Token.Name.Namespace: "namespace",
+        Token.Name.Constant: "constant",
+        Token.Name.Variable: "variable",
+        Token.Name.Entity: "entity",
+        Token.String: "string",
+        Token.String.Regex: "regex",
+        Token.String.Interpol: "interpolation",
+        Token.Number: "number",
+        Token.Operator: "operator",
+        Token.Operator.Word: "keyword",
+        Token.Punctuation: "punctuation",
+        Token.Generic.Deleted: "deleted",
+        Token.Generic.Inserted: "inserted",
+    }
+
+
+CLASSES = prism_classes() if lex else {}
+
+
+def token_class(token_type):
+    while token_type is not None:
+        name = CLASSES.get(token_type)
+        if name:
+            return name
+        token_type = token_type.parent
+    return None
+
+
+def get_lexer(language):
+    language = LANGUAGE_ALIASES.get(language.lower(), language.lower())
+    try:
+        return get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return get_lexer_by_name("text", stripnl=False, ensurenl=False)
+
+
+# Returns the code as escaped html with prism style token spans
+def highlight_code(code, language):
+    if lex is None:
+        return html.escape(code, quote=False)
+    key = hashlib.sha1(f"{language}\0{code}".encode()).hexdigest()
+    return _cache.get_or_set(key, lambda: highlight_tokens(code, language))
+
+
+# Neighbouring tokens of the same class are merged to keep the markup small
+def highlight_tokens(code, language):
+    tokens = []
+    for token_type, value in lex(code, get_lexer(language)):
+        name = token_class(token_type)
+        if tokens and tokens[-1][0] == name:
+            tokens[-1][1] += value
+        else:
+            tokens.append([name, value])
+    return "".join(
+        f'<span class="token {name}">{html.escape(value, quote=False)}</span>'
+        if name
+        else html.escape(value, quote=False)
+        for name, value in tokens
+    )
+
+
+def highlight_block(match):
+    attributes, body = match.group(1), match.group(2)
+    language = LANGUAGE_CLASS.search(attributes)
+    language = language.group(1) if language else "plaintext"
+    code = html.unescape(TAG.sub("", BR.sub("\n", body)))
+    return (
+        f'<pre class="language-{language}"><code class="language-{language}">'
+        f"{highlight_code(code, language)}</code></pre>"
+    )
+
+
+# Replaces every code block of an article with pre-highlighted markup
+def highlight_html(string):
+    return CODE_BLOCK.sub(highlight_block, string)
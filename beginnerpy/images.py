@@ -0,0 +1,251 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+from markupsafe import Markup
+from werkzeug.security import safe_join
+from beginnerpy.models import Article
+from beginnerpy.db import Session
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Without Pillow the original images are served unchanged
+    Image = None
+
+# Only these widths are generated, anything else would let a client fill the cache
+WIDTHS = (64, 128, 160, 320, 480, 640, 960, 1280)
+ARTICLE_WIDTHS = (320, 640, 960, 1280)
+ARTICLE_SIZES = "(max-width: 768px) 100vw, 768px"
+# Folders under static/ that may be resized
+SOURCE_FOLDERS = ("assets", "img")
+CACHE_DIR = os.environ.get(
+    "IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "beginnerpy-images")
+)
+CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", 512)) * 1024 * 1024
+
+DATA_IMAGE = re.compile(
+    r'<img([^>]*?)\ssrc="data:image/(png|jpeg|gif|webp);base64,([A-Za-z0-9+/=\s]+)"([^>]*)>'
+)
+
+images_blueprint = Blueprint("images", __name__, url_prefix="/img")
+
+
+# Content addressed variants on local disk, the least recently used ones are removed past the size limit
+class DiskCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def set(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.replace(temporary, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self.measure()
+            else:
+                self.size += len(data)
+            if self.size > self.max_size:
+                self.evict()
+        return path
+
+    def entries(self):
+        for root, folders, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, os.path.join(root, name)
+
+    def measure(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    # Other workers share the directory, so the real size is measured again before removing anything
+    def evict(self):
+        entries = sorted(self.entries())
+        self.size = sum(size for mtime, size, path in entries)
+        target = self.max_size * 0.9
+        for mtime, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+cache = DiskCache(CACHE_DIR, CACHE_SIZE)
+
+
+def variant_key(source_digest, width, image_format):
+    return hashlib.sha1(f"{source_digest}:{width}:{image_format}".encode()).hexdigest()
+
+
+def accepts_webp():
+    return "image/webp" in request.headers.get("Accept", "")
+
+
+# Resizes and re-encodes one image, never scaling it up
+def make_variant(data, width, webp):
+    image = Image.open(io.BytesIO(data))
+    source_format = image.format
+    if source_format == "GIF" and getattr(image, "is_animated", False):
+        return data, "gif"
+    image = ImageOps.exif_transpose(image)
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    output = io.BytesIO()
+    if webp:
+        image.save(output, "WEBP", quality=80, method=4)
+        return output.getvalue(), "webp"
+    if source_format in ("PNG", "GIF"):
+        image.save(output, "PNG", optimize=True)
+        return output.getvalue(), "png"
+    image.convert("RGB").save(output, "JPEG", quality=82, optimize=True, progressive=True)
+    return output.getvalue(), "jpeg"
+
+
+def send_variant(source_digest, width, load_source, max_age):
+    if width not in WIDTHS:
+        abort(404)
+    webp = Image is not None and accepts_webp()
+    # Variants are stored under the format make_variant produced, animated GIFs stay GIFs for
+    # every client
+    for image_format in (["webp", "gif"] if webp else ["jpeg", "png", "gif"]):
+        key = variant_key(source_digest, width, image_format)
+        path = cache.get(key)
+        if path:
+            return send_variant_file(path, image_format, key, max_age)
+    data = load_source()
+    if Image is None:
+        response = send_file(io.BytesIO(data), mimetype=guess_mimetype(data))
+        return finish(response, source_digest, max_age)
+    try:
+        variant, image_format = make_variant(data, width, webp)
+    except (OSError, ValueError):
+        abort(404)
+    key = variant_key(source_digest, width, image_format)
+    path = cache.set(key, variant)
+    return send_variant_file(path, image_format, key, max_age)
+
+
+def send_variant_file(path, image_format, key, max_age):
+    response = send_file(path, mimetype=f"image/{image_format}", conditional=True)
+    return finish(response, key, max_age)
+
+
+def guess_mimetype(data):
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def finish(response, key, max_age):
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.vary.add("Accept")
+    return response.make_conditional(request)
+
+
+# Resized versions of files under static/, e.g. user avatars
+@images_blueprint.route("/<int:width>/<path:filename>")
+def static_variant(width, filename):
+    if filename.split("/")[0] not in SOURCE_FOLDERS:
+        abort(404)
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    source_digest = f"{filename}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def load_source():
+        with open(path, "rb") as handle:
+            return handle.read()
+
+    return send_variant(source_digest, width, load_source, 86400)
+
+
+# Resized versions of images pasted into an article, the editor stores them inline as base64
+@images_blueprint.route("/article/<int:article_id>/<digest>/<int:width>")
+def article_variant(article_id, digest, width):
+    def load_source():
+        session = Session()
+        article = session.query(Article).get(article_id)
+        session.close()
+        if article is None:
+            abort(404)
+        for match in DATA_IMAGE.finditer(article.summary + article.content):
+            if embedded_digest(match.group(3)) == digest:
+                return base64.b64decode(match.group(3))
+        abort(404)
+
+    return send_variant(digest, width, load_source, 31536000)
+
+
+def embedded_digest(encoded):
+    return hashlib.sha1(encoded.encode()).hexdigest()[:20]
+
+
+def static_url(filename, width):
+    return url_for("images.static_variant", width=width, filename=filename)
+
+
+# Emits src and srcset attributes, with a display width the variants are 1x/2x/3x densities
+@images_blueprint.app_template_global()
+def srcset(filename, width=None, sizes=ARTICLE_SIZES):
+    if width:
+        candidates = {}
+        for factor in (1, 2, 3):
+            variant = next((w for w in WIDTHS if w >= width * factor), WIDTHS[-1])
+            candidates.setdefault(variant, f"{factor}x")
+        urls = ", ".join(f"{static_url(filename, w)} {d}" for w, d in candidates.items())
+        return Markup(f'src="{static_url(filename, min(candidates))}" srcset="{urls}"')
+    urls = ", ".join(f"{static_url(filename, w)} {w}w" for w in ARTICLE_WIDTHS)
+    return Markup(
+        f'src="{static_url(filename, ARTICLE_WIDTHS[1])}" srcset="{urls}" sizes="{sizes}"'
+    )
+
+
+# Replaces inline base64 images in rendered article html with responsive, cacheable variants
+def responsive_images(string, article_id):
+    def replace(match):
+        before, encoded, after = match.group(1), match.group(3), match.group(4)
+        digest = embedded_digest(encoded)
+        urls = ", ".join(
+            f"/img/article/{article_id}/{digest}/{width} {width}w" for width in ARTICLE_WIDTHS
+        )
+        return (
+            f'<img{before} src="/img/article/{article_id}/{digest}/{ARTICLE_WIDTHS[1]}"'
+            f' srcset="{urls}" sizes="{ARTICLE_SIZES}" loading="lazy"{after}>'
+        )
+
+    if article_id is None:
+        return string
+    return DATA_IMAGE.sub(replace, string)
@@ -0,0 +1,203 @@
+import json
+import os
+import pickle
+import select
+import threading
+import time
+from sqlalchemy import event, func, select as sql_select
+from beginnerpy.db import engine, listen_engine, Session
+from beginnerpy.func import bumpSetting
+from beginnerpy import cache
+
+# Writes tell every worker of every pod what changed through Postgres NOTIFY, set to "off" to
+# only invalidate the worker that wrote
+ENABLED = os.environ.get("INVALIDATION_BUS", "on") != "off"
+CHANNEL = "beginnerpy_invalidate"
+SEQUENCE_SETTING = "INVALIDATION_SEQUENCE"
+# An idle listener compares its sequence number with the database this often
+HEARTBEAT = float(os.environ.get("INVALIDATION_HEARTBEAT", 30))
+RECONNECT_DELAY = float(os.environ.get("INVALIDATION_RECONNECT_DELAY", 5))
+# NOTIFY payloads are limited to 8000 bytes, longer key lists invalidate the whole kind
+MAX_PAYLOAD = 7000
+# How long the worker that cleared the namespaces for an event keeps its claim
+CLAIM_TTL = 600
+
+# Functions called with the changed keys, or None for everything of the kind, by kind. They drop
+# what the worker holds itself, every worker runs them.
+_handlers = {}
+# Cache namespaces emptied by kind, once per event wherever the backend keeps them
+_namespaces = {}
+_threads = []
+_lock = threading.Lock()
+# What this worker's listener has seen, shown on the admin page
+status = {"connected": False, "sequence": None, "received": 0, "flushes": 0}
+
+
+def active():
+    return ENABLED and engine.dialect.name == "postgresql"
+
+
+def subscribe(kind, handler):
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def clears(kind, namespace):
+    _namespaces.setdefault(kind, []).append(namespace)
+
+
+# The first worker to claim the event in the cache backend clears the namespaces, so a backend
+# shared by a pod or the whole site gets a single new generation, a local one one per worker
+def clear_namespaces(event, namespaces):
+    if not namespaces:
+        return
+    try:
+        claimed = cache.backend.add(f"{cache.PREFIX}:invalidated:{event}", b"1", CLAIM_TTL)
+    except (OSError, cache.CacheError):
+        claimed = True
+    if claimed:
+        for namespace in namespaces:
+            namespace.clear()
+
+
+# Call inside the transaction making the change. The event is only delivered once it commits,
+# numbered by a settings row that is locked until then, so events arrive in commit order.
+def publish(session, kind, keys=None):
+    keys = sorted(keys) if keys is not None else None
+    if not active():
+        session.info.setdefault("invalidations", []).append((kind, keys, None))
+        return
+    sequence = bumpSetting(session, SEQUENCE_SETTING)
+    session.info.setdefault("invalidations", []).append((kind, keys, sequence))
+    payload = json.dumps({"sequence": sequence, "kind": kind, "keys": keys})
+    if len(payload) > MAX_PAYLOAD:
+        payload = json.dumps({"sequence": sequence, "kind": kind, "keys": None})
+    session.execute(sql_select([func.pg_notify(CHANNEL, payload)]))
+
+
+def apply(kind, keys):
+    for handler in _handlers.get(kind, []):
+        try:
+            handler(keys)
+        except Exception as error:
+            print(f"Invalidating {kind} failed: {error}")
+
+
+# After a missed event nothing cached can be trusted. Every worker noticing the same gap names
+# it by the same sequence number, so shared namespaces are still cleared once.
+def flush_all(sequence):
+    status["flushes"] += 1
+    clear_namespaces(f"flush:{sequence}", list(cache.namespaces.values()))
+    for kind in list(_handlers):
+        apply(kind, None)
+
+
+def receive(payload):
+    try:
+        message = json.loads(payload)
+        sequence = int(message["sequence"])
+    except (ValueError, KeyError, TypeError):
+        print(f"Ignoring invalidation {payload!r}")
+        return
+    status["received"] += 1
+    last = status["sequence"]
+    if last is not None and sequence <= last:
+        return
+    if last is not None and sequence > last + 1:
+        flush_all(sequence)
+    else:
+        apply(message["kind"], message["keys"])
+        clear_namespaces(sequence, _namespaces.get(message["kind"]))
+    status["sequence"] = sequence
+
+
+def drain(connection):
+    connection.poll()
+    while connection.notifies:
+        receive(connection.notifies.pop(0).payload)
+
+
+# Events committed while the listener wasn't connected, or dropped on the way, show up as a
+# sequence number it never received
+def catch_up(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT value FROM settings WHERE name = %s", (SEQUENCE_SETTING,))
+    row = cursor.fetchone()
+    cursor.close()
+    drain(connection)
+    current = pickle.loads(row[0].encode()) if row and row[0] else 0
+    if status["sequence"] is not None and current > status["sequence"]:
+        flush_all(current)
+    if status["sequence"] is None or current > status["sequence"]:
+        status["sequence"] = current
+
+
+def connect(channel=CHANNEL):
+    # A connection of its own, it stays in LISTEN for the life of the worker
+    pooled = listen_engine().raw_connection()
+    pooled.detach()
+    connection = pooled.connection
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute(f"LISTEN {channel}")
+    cursor.close()
+    return connection
+
+
+def listen():
+    while True:
+        connection = None
+        try:
+            connection = connect()
+            status["connected"] = True
+            catch_up(connection)
+            while True:
+                if select.select([connection], [], [], HEARTBEAT) == ([], [], []):
+                    catch_up(connection)
+                else:
+                    drain(connection)
+        except Exception as error:
+            print(f"Invalidation listener failed: {error}")
+        status["connected"] = False
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        time.sleep(RECONNECT_DELAY)
+
+
+# The listener starts on first use so it runs in each gunicorn worker and not in the master
+def start_listener():
+    if _threads or not active():
+        return
+    with _lock:
+        if _threads:
+            return
+        thread = threading.Thread(target=listen, name="invalidation", daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+# The worker that wrote clears the namespaces once the events are committed, the listeners of
+# the other workers find the event claimed. Without the bus it applies the events itself.
+@event.listens_for(Session, "after_commit")
+def committed(session):
+    pending = session.info.pop("invalidations", [])
+    for kind, keys, sequence in pending:
+        if sequence is None:
+            apply(kind, keys)
+            for namespace in _namespaces.get(kind, []):
+                namespace.clear()
+        else:
+            clear_namespaces(sequence, _namespaces.get(kind))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def rolled_back(session, previous_transaction):
+    session.info.pop("invalidations", None)
+
+
+def init_app(app):
+    @app.before_request
+    def start():
+        start_listener()
@@ -0,0 +1,277 @@
+import json
+import os
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select as sql_select
+from sqlalchemy.dialects.postgresql import insert
+from beginnerpy.models import Job
+from beginnerpy.db import engine, Session
+from beginnerpy import invalidation
+
+# "thread" runs jobs in every web worker, which suits a single development server. "none" leaves
+# them to `flask run-jobs`, production runs it in a deployment of its own.
+RUNNER = os.environ.get("JOB_RUNNER", "thread")
+WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", 10))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+# An idle runner polls less and less often, down to this. On Postgres new jobs wake it through
+# NOTIFY, elsewhere only jobs enqueued by its own process do.
+IDLE_POLL_INTERVAL = float(os.environ.get("JOB_IDLE_POLL_INTERVAL", 30))
+CHANNEL = "beginnerpy_jobs"
+# Lets enqueue skip jobs identical to a pending one with ON CONFLICT
+PENDING_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS job_pending_dedup ON job (dedup_key) WHERE status = 'pending'"
+)
+# Running jobs older than this are assumed lost with their worker and retried
+TIMEOUT = float(os.environ.get("JOB_TIMEOUT", 300))
+RETRY_DELAY = 5
+
+handlers = {}
+# Jobs run by this process, shown on the admin page next to the queue metrics
+stats = {"done": 0, "retried": 0, "failed": 0, "run_seconds": 0.0}
+_threads = []
+_start_lock = threading.Lock()
+_wake = threading.Event()
+
+
+# Registers the function running jobs of a kind, it gets a session and the job's arguments
+def handler(kind, max_attempts=5):
+    def register(function):
+        handlers[kind] = (function, max_attempts)
+        return function
+
+    return register
+
+
+def dedup_key(kind, arguments):
+    return f"{kind}:{json.dumps(arguments, sort_keys=True)}"[:200]
+
+
+# Adds a job to the caller's transaction, so it only exists if the caller commits. A job identical
+# to one that is still pending isn't added again.
+def enqueue(session, kind, **arguments):
+    now = datetime.now()
+    values = {
+        "kind": kind,
+        "arguments": json.dumps(arguments),
+        "dedup_key": dedup_key(kind, arguments),
+        "status": "pending",
+        "attempts": 0,
+        "max_attempts": handlers.get(kind, (None, 5))[1],
+        "run_at": now,
+        "date_created": now,
+    }
+    if session.get_bind(clause=Job.__table__.insert()).dialect.name == "postgresql":
+        session.execute(
+            insert(Job.__table__)
+            .values(**values)
+            .on_conflict_do_nothing(
+                index_elements=["dedup_key"], index_where=Job.status == "pending"
+            )
+        )
+        # Delivered when the caller commits
+        session.execute(sql_select([func.pg_notify(CHANNEL, kind)]))
+    elif not (
+        session.query(Job.id).filter_by(dedup_key=values["dedup_key"], status="pending").first()
+    ):
+        session.execute(Job.__table__.insert().values(**values))
+    if RUNNER == "thread":
+        start()
+        _wake.set()
+
+
+# Takes due jobs no other worker holds, SKIP LOCKED lets many workers poll the table at once
+def claim(session, limit=BATCH_SIZE):
+    now = datetime.now()
+    claimed = (
+        session.query(Job)
+        .filter(Job.status == "pending", Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for job in claimed:
+        job.status = "running"
+        job.attempts += 1
+        job.date_started = now
+    session.commit()
+    return claimed
+
+
+def run(session, job):
+    function = handlers.get(job.kind, (None, 0))[0]
+    started = time.monotonic()
+    try:
+        if function is None:
+            raise LookupError(f"No handler for jobs of kind {job.kind}")
+        function(session, **json.loads(job.arguments))
+        job.status = "done"
+        job.error = None
+        stats["done"] += 1
+    except Exception as error:
+        session.rollback()
+        job.error = f"{type(error).__name__}: {error}"[:2000]
+        if job.attempts < job.max_attempts:
+            job.status = "pending"
+            job.run_at = datetime.now() + timedelta(seconds=RETRY_DELAY * 2 ** job.attempts)
+            stats["retried"] += 1
+        else:
+            job.status = "failed"
+            stats["failed"] += 1
+    stats["run_seconds"] += time.monotonic() - started
+    job.date_finished = datetime.now()
+    session.commit()
+
+
+def requeue_lost(session):
+    cutoff = datetime.now() - timedelta(seconds=TIMEOUT)
+    lost = (
+        session.query(Job)
+        .filter(Job.status == "running", Job.date_started < cutoff)
+        .update({"status": "pending", "run_at": datetime.now()}, synchronize_session=False)
+    )
+    session.commit()
+    return lost
+
+
+# Runs due jobs until none are left, returns how many ran
+def run_pending(limit=None):
+    count = 0
+    session = Session(primary=True)
+    try:
+        requeue_lost(session)
+        while limit is None or count < limit:
+            size = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - count)
+            claimed = claim(session, size)
+            if not claimed:
+                break
+            for job in claimed:
+                run(session, job)
+                count += 1
+    finally:
+        session.close()
+    return count
+
+
+# The job table and the index enqueue relies on, run by /admin/build and when a runner starts
+def create_tables(bind):
+    Job.__table__.create(bind=bind, checkfirst=True)
+    bind.execute(PENDING_INDEX)
+
+
+# Waits for the interval or until a job is enqueued, by this process or through NOTIFY
+def wait(connection, interval):
+    if connection is None:
+        _wake.wait(interval)
+        _wake.clear()
+        return
+    if select.select([connection], [], [], interval) != ([], [], []):
+        connection.poll()
+        connection.notifies.clear()
+
+
+def close(connection):
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+def work():
+    purged = 0
+    ready = False
+    connection = None
+    interval = POLL_INTERVAL
+    while True:
+        try:
+            if not ready:
+                create_tables(engine)
+                ready = True
+            if connection is None and engine.dialect.name == "postgresql":
+                connection = invalidation.connect(CHANNEL)
+            ran = run_pending()
+            if time.monotonic() - purged > 3600:
+                session = Session(primary=True)
+                purge(session)
+                session.close()
+                purged = time.monotonic()
+            interval = POLL_INTERVAL if ran else min(interval * 2, IDLE_POLL_INTERVAL)
+            wait(connection, interval)
+        except Exception as error:
+            print(f"Running jobs failed: {error}")
+            close(connection)
+            connection = None
+            time.sleep(POLL_INTERVAL)
+
+
+# Starts the job threads once per process, like the grader they outlive the request that started them
+def start():
+    if _threads:
+        return
+    with _start_lock:
+        if _threads:
+            return
+        for i in range(WORKERS):
+            thread = threading.Thread(target=work, name=f"jobs-{i}", daemon=True)
+            thread.start()
+            _threads.append(thread)
+
+
+# Queue depth, age of the oldest due job and latency of the jobs finished in the last hour
+def metrics(session):
+    now = datetime.now()
+    depth = dict(
+        session.query(Job.status, func.count(Job.id))
+        .filter(Job.status.in_(["pending", "running", "failed"]))
+        .group_by(Job.status)
+        .all()
+    )
+    oldest = (
+        session.query(func.min(Job.run_at))
+        .filter(Job.status == "pending", Job.run_at <= now)
+        .scalar()
+    )
+    recent = (
+        session.query(Job.kind, Job.date_created, Job.date_started, Job.date_finished)
+        .filter(Job.status == "done", Job.date_finished >= now - timedelta(hours=1))
+        .all()
+    )
+    latencies = sorted((job.date_finished - job.date_created).total_seconds() for job in recent)
+    return {
+        "pending": depth.get("pending", 0),
+        "running": depth.get("running", 0),
+        "failed": depth.get("failed", 0),
+        "oldest_wait": (now - oldest).total_seconds() if oldest else 0,
+        "done_last_hour": len(latencies),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+    }
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def purge(session, days=7):
+    cutoff = datetime.now() - timedelta(days=days)
+    removed = (
+        session.query(Job)
+        .filter(Job.status == "done", Job.date_finished < cutoff)
+        .delete(synchronize_session=False)
+    )
+    session.commit()
+    return removed
+
+
+def init_app(app):
+    # Jobs left by a restarted worker are picked up without waiting for the next enqueue
+    @app.before_request
+    def start_runner():
+        if RUNNER == "thread":
+            start()
@@ -0,0 +1,162 @@
+import os
+import re
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from beginnerpy.models import Article, Category, Tag, Module, Redirect
+from beginnerpy.db import Session
+from beginnerpy.render import batches
+from beginnerpy import cache, invalidation
+
+HREF = re.compile(r"""\bhref\s*=\s*["']([^"']*)["']""", re.IGNORECASE)
+HOSTS = {"beginnerpy.com", "www.beginnerpy.com"}
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Renamed articles keep answering on their old links, set to 0 to let old links break
+RECORD_REDIRECTS = os.environ.get("REDIRECTS_ON_RENAME", "1") == "1"
+
+_redirects = cache.namespace("redirects", ttl=3600)
+
+
+# The path of a link to this site, None for other sites, mail addresses and relative links
+def internal_path(href):
+    parts = urllib.parse.urlsplit(href.strip())
+    if parts.scheme and parts.scheme not in ("http", "https"):
+        return None
+    if parts.netloc:
+        if parts.netloc.lower() not in HOSTS:
+            return None
+    elif not parts.path.startswith("/"):
+        return None
+    return urllib.parse.unquote(parts.path).rstrip("/") or "/"
+
+
+# Everything a link may point to, small enough to be copied into every scanning process
+class LinkIndex:
+    def __init__(self, articles, listings, redirects, reserved):
+        self.articles = articles  # link -> draft
+        self.listings = listings
+        self.redirects = redirects
+        self.reserved = reserved  # first path segments of routes that aren't articles
+
+    # None when the link works, otherwise what is wrong with it
+    def resolve(self, path):
+        if path == "/" or path in self.listings:
+            return None
+        parts = path.strip("/").split("/")
+        if parts[0] == "static":
+            return None if os.path.isfile(os.path.join(STATIC, *parts[1:])) else "missing"
+        if parts[0] in self.reserved:
+            return None
+        if len(parts) in (2, 3):
+            # Like page(), the category in the path isn't checked
+            link = "/".join(parts[1:])
+            if link in self.articles:
+                return "draft" if self.articles[link] else None
+            if link in self.redirects:
+                return "redirected"
+        return "missing"
+
+
+def reserved_prefixes(app):
+    prefixes = set()
+    for rule in app.url_map.iter_rules():
+        first = rule.rule.strip("/").split("/")[0]
+        if first and "<" not in first:
+            prefixes.add(first)
+    return prefixes - {"category", "tag", "module"}
+
+
+def load_index(session, reserved):
+    articles = {link: draft for link, draft in session.query(Article.link, Article.draft)}
+    listings = {f"/category/{link}" for (link,) in session.query(Category.link)}
+    listings |= {f"/tag/{link}" for (link,) in session.query(Tag.link)}
+    listings |= {f"/module/{link}" for (link,) in session.query(Module.link)}
+    return LinkIndex(articles, listings, load_redirects(session), reserved)
+
+
+_index = [None]
+
+
+def use_index(index):
+    _index[0] = index
+
+
+# Runs in the scanning processes, takes and returns plain tuples
+def check_row(row):
+    article_id, content, summary = row
+    problems = []
+    for html in (summary, content):
+        for href in HREF.findall(html or ""):
+            path = internal_path(href)
+            if path is None:
+                continue
+            problem = _index[0].resolve(path)
+            if problem:
+                problems.append((article_id, href, problem))
+    return problems
+
+
+# Extracts the links of all articles in a pool of processes, returns the ones that don't work
+def scan(session, reserved, workers=None):
+    index = load_index(session, reserved)
+    problems = []
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(), initializer=use_index, initargs=(index,)
+    ) as pool:
+        for rows in batches(session):
+            for found in pool.map(check_row, rows, chunksize=8):
+                problems.extend(found)
+    titles = dict(session.query(Article.id, Article.title))
+    return [
+        {"article_id": article_id, "title": titles.get(article_id), "href": href, "problem": problem}
+        for article_id, href, problem in sorted(problems)
+    ]
+
+
+# Old link -> current url of the article, for published articles only
+def load_redirects(session):
+    rows = (
+        session.query(Redirect.old_link, Article.link, Category.link)
+        .join(Article, Redirect.article_id == Article.id)
+        .join(Category, Article.category_id == Category.id)
+        .filter(Article.draft == 0)
+    )
+    return {old_link: f"/{category}/{link}" for old_link, link, category in rows}
+
+
+def redirect_map():
+    def load():
+        session = Session()
+        try:
+            return load_redirects(session)
+        finally:
+            session.close()
+
+    return _redirects.get_or_set("map", load)
+
+
+def lookup(link):
+    return redirect_map().get(link)
+
+
+# Called in the transaction renaming the article, the old link leads to it once it's committed
+def record_rename(session, article, old_link):
+    if not RECORD_REDIRECTS or not old_link or old_link == article.link:
+        return
+    session.query(Redirect).filter_by(old_link=article.link).delete(synchronize_session=False)
+    existing = session.query(Redirect).filter_by(old_link=old_link).first()
+    if existing is None:
+        session.add(Redirect(old_link=old_link, article_id=article.id, date_created=datetime.now()))
+    else:
+        existing.article_id = article.id
+
+
+def forget(session, article_ids):
+    session.query(Redirect).filter(Redirect.article_id.in_(article_ids)).delete(
+        synchronize_session=False
+    )
+
+
+# Renamed, deleted and moved articles change the map
+invalidation.clears("article", _redirects)
+invalidation.clears("category", _redirects)
@@ -0,0 +1,411 @@
+import http.cookiejar
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from flask_bcrypt import generate_password_hash
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from beginnerpy.models import *
+from beginnerpy.func import getSetting, setSetting
+from beginnerpy.render import render_fields
+from beginnerpy import glossary, invalidation, links
+
+# Share of requests per kind, weights don't need to add up to anything
+DEFAULT_MIX = "article=60,listing=20,tag=10,pip=8,save=2"
+PREFIX = "loadtest"
+# save_article puts articles of this category under their module's link
+MODULE_CATEGORY = 9
+EMAIL = "loadtest@beginnerpy.com"
+WORDS = (
+    "python list loop function value return string class module import error dict key "
+    "index slice tuple set generator iterator decorator file read write print input"
+).split()
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind.strip() not in REQUESTS:
+            raise ValueError(f"Unknown request kind {kind}, use one of {', '.join(REQUESTS)}")
+        weights[kind.strip()] = float(weight or 1)
+    return weights
+
+
+def paragraph(generator, words=60):
+    return "<p>" + " ".join(generator.choice(WORDS) for i in range(words)) + "</p>"
+
+
+def article_body(generator):
+    parts = []
+    for section in range(generator.randint(2, 6)):
+        parts.append(f"<h2>Part {section + 1}</h2>")
+        parts.extend(paragraph(generator) for i in range(generator.randint(1, 4)))
+        if generator.random() < 0.6:
+            code = "\n".join(f"x{i} = {i} * 2" for i in range(generator.randint(2, 12)))
+            parts.append(f'<pre><code class="language-python">{code}</code></pre>')
+    return "".join(parts)
+
+
+# Creates the same articles for the same seed, existing load test articles are reused
+def seed(session, articles=200, seed_value=0, password=None):
+    generator = random.Random(seed_value)
+    user = session.query(Useraccount).filter_by(email=EMAIL).first()
+    if user is None:
+        user = Useraccount(displayname="Load Test", email=EMAIL, is_admin=True, password="")
+        session.add(user)
+    if password:
+        user.password = generate_password_hash(password).decode("utf-8")
+    if getSetting(session, "PIP_CHALLENGE_VERSION") is None:
+        setSetting(session, "PIP_CHALLENGE_VERSION", "1.0.0")
+    categories = session.query(Category).filter_by(active=True, bot=0).all()
+    tag_ids = [tag.id for tag in session.query(Tag)]
+    module_ids = [module.id for module in session.query(Module)]
+    existing = session.query(Article).filter(Article.link.like(f"%{PREFIX}-%")).count()
+    session.flush()
+    for number in range(existing, articles):
+        content = article_body(generator)
+        summary = paragraph(generator, 25)
+        category_id = generator.choice(categories).id
+        module_id = None
+        if module_ids and (category_id == MODULE_CATEGORY or generator.random() < 0.2):
+            module_id = generator.choice(module_ids)
+        # The link is what save_article derives from the title, so saves keep it
+        link = f"{PREFIX}-{number}"
+        if category_id == MODULE_CATEGORY:
+            link = f"{session.query(Module).get(module_id).link}/{link}"
+        article = Article(
+            title=f"{PREFIX.title()} {number}",
+            link=link,
+            content=content,
+            summary=summary,
+            draft=0,
+            author_id=user.id,
+            category_id=category_id,
+            date_created=datetime.now() - timedelta(days=generator.randint(0, 700)),
+        )
+        session.add(article)
+        session.flush()
+        for name, value in render_fields(article.id, content, summary).items():
+            setattr(article, name, value)
+        for tag_id in generator.sample(tag_ids, min(3, len(tag_ids))):
+            session.execute(articleTags.insert().values(article_id=article.id, tag_id=tag_id))
+        if module_id:
+            session.execute(
+                articleModules.insert().values(article_id=article.id, module_id=module_id)
+            )
+    session.commit()
+    return max(articles - existing, 0)
+
+
+# Removes the account and the articles seed() created, along with what the run's saves added
+def cleanup(session):
+    user = session.query(Useraccount).filter_by(email=EMAIL).first()
+    if user is None:
+        return 0
+    articles = session.query(Article).filter_by(author_id=user.id)
+    ids = [article.id for article in articles]
+    glossary_changed = articles.join(Category).filter(
+        Category.link == glossary.CATEGORY_LINK
+    ).count()
+    if ids:
+        session.execute(articleTags.delete().where(articleTags.c.article_id.in_(ids)))
+        session.execute(articleModules.delete().where(articleModules.c.article_id.in_(ids)))
+        links.forget(session, ids)
+    session.query(ArticleRevision).filter(
+        (ArticleRevision.article_id.in_(ids)) | (ArticleRevision.author_id == user.id)
+    ).delete(synchronize_session=False)
+    deleted = articles.delete(synchronize_session=False)
+    session.delete(user)
+    if glossary_changed:
+        glossary.changed(session)
+    invalidation.publish(session, "article", ids)
+    session.commit()
+    return deleted
+
+
+# What the requests are built from, read once before the run
+def load_targets(session):
+    articles = session.query(Article).filter(Article.draft == 0).all()
+    categories = {item.id: item.link for item in session.query(Category)}
+    active = [item.link for item in session.query(Category).filter_by(active=True, bot=0)]
+    return {
+        "articles": [(categories[a.category_id], a.link) for a in articles],
+        "editable": [
+            {
+                "title": a.title,
+                "link": a.link,
+                "content": a.content,
+                "summary": a.summary,
+                "cat_id": str(a.category_id),
+                "cat_link": categories[a.category_id],
+                "tags": [tag.id for tag in a.tags],
+                "modules": [module.id for module in a.modules],
+            }
+            for a in articles
+            if a.link.rpartition("/")[2].startswith(f"{PREFIX}-")
+        ],
+        "listings": ["/"] + [f"/category/{link}" for link in active],
+        "tags": [item.link for item in session.query(Tag)],
+    }
+
+
+def article_request(targets, generator):
+    category, link = generator.choice(targets["articles"])
+    return "GET", f"/{category}/{link}", None
+
+
+def listing_request(targets, generator):
+    return "GET", generator.choice(targets["listings"]), None
+
+
+def tag_request(targets, generator):
+    return "GET", f"/tag/{generator.choice(targets['tags'])}", None
+
+
+def pip_request(targets, generator):
+    return "GET", "/challenges/pip-version", None
+
+
+# Saves one of the load test articles with a paragraph added, like an editor would
+def save_request(targets, generator):
+    article = generator.choice(targets["editable"])
+    form = {
+        "title": article["title"],
+        "link": article["link"],
+        "content": article["content"] + paragraph(generator, 20),
+        "summary": article["summary"],
+        "cat_id": article["cat_id"],
+        "cat_link": article["cat_link"],
+        "draft": "on",
+    }
+    form.update({f"tag_{tag_id}": "on" for tag_id in article["tags"]})
+    form.update({f"module_{module_id}": "on" for module_id in article["modules"]})
+    return "POST", "/admin/save_article", form
+
+
+REQUESTS = {
+    "article": article_request,
+    "listing": listing_request,
+    "tag": tag_request,
+    "pip": pip_request,
+    "save": save_request,
+}
+
+
+def client_address(generator):
+    return f"10.{generator.randrange(256)}.{generator.randrange(256)}.{generator.randrange(1, 255)}"
+
+
+# Drives the app in this process through the WSGI interface. Visitors come from many addresses
+# so the rate limiter sees realistic traffic, only the saves carry the admin's login.
+class WSGIClient:
+    def __init__(self, app, user_id, generator):
+        self.visitor = app.test_client()
+        self.admin = app.test_client()
+        self.generator = generator
+        with self.admin.session_transaction() as cookie:
+            cookie["_user_id"] = str(user_id)
+            cookie["_fresh"] = True
+
+    def request(self, method, path, form):
+        client = self.admin if method == "POST" else self.visitor
+        response = client.open(
+            path,
+            method=method,
+            data=form,
+            environ_base={"REMOTE_ADDR": client_address(self.generator)},
+        )
+        response.close()
+        return response.status_code
+
+
+# Drives a running server over HTTP, logging in once for the admin saves
+class HTTPClient:
+    def __init__(self, base_url, email, password, generator):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.generator = generator
+        self.token = None
+        self.visitor = urllib.request.build_opener(NoRedirect())
+        self.admin = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def login(self):
+        page = self.admin.open(self.base_url + "/login").read().decode()
+        self.token = CSRF_TOKEN.search(page).group(1)
+        self.send("POST", "/login", {"email": self.email, "password": self.password})
+
+    def send(self, method, path, form):
+        data = None
+        if form is not None:
+            data = urllib.parse.urlencode(dict(form, csrf_token=self.token)).encode()
+        # Only used by a server started with RATE_LIMIT_PROXY_HOPS=1
+        headers = {"X-Forwarded-For": client_address(self.generator)}
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            opener = self.admin if method == "POST" else self.visitor
+            with opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def request(self, method, path, form):
+        if method == "POST" and self.token is None:
+            self.login()
+        return self.send(method, path, form)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+# Counts every statement sent to any engine in this process
+class QueryCounter:
+    description = "statements sent from this process"
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self.lock:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(Engine, "before_cursor_execute", self)
+
+
+# A server in another process can only be observed from the database, Postgres counts transactions
+class TransactionCounter:
+    description = "transactions committed by all clients of the database"
+    QUERY = (
+        "SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()"
+    )
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def read(self):
+        with self.engine.connect() as connection:
+            return connection.execute(self.QUERY).scalar()
+
+    def __enter__(self):
+        self.start = self.read()
+        return self
+
+    def __exit__(self, *args):
+        self.count = self.read() - self.start
+
+
+# Runs clients in threads until the duration or request count is reached
+def run(make_client, targets, mix, concurrency, duration=None, requests=None, seed_value=0,
+        counter=None):
+    kinds, weights = zip(*mix.items())
+    results = {kind: {"latencies": [], "errors": 0} for kind in kinds}
+    lock = threading.Lock()
+    issued = [0]
+    deadline = time.monotonic() + duration if duration else None
+
+    def next_request():
+        with lock:
+            if requests is not None and issued[0] >= requests:
+                return False
+            issued[0] += 1
+        return deadline is None or time.monotonic() < deadline
+
+    def client_loop(number):
+        generator = random.Random(seed_value * 1000 + number)
+        client = make_client(generator)
+        while next_request():
+            kind = generator.choices(kinds, weights)[0]
+            method, path, form = REQUESTS[kind](targets, generator)
+            started = time.perf_counter()
+            try:
+                status = client.request(method, path, form)
+            except Exception:
+                status = 599
+            elapsed = time.perf_counter() - started
+            with lock:
+                results[kind]["latencies"].append(elapsed)
+                if status >= 400:
+                    results[kind]["errors"] += 1
+
+    with counter or QueryCounter() as queries:
+        started = time.monotonic()
+        threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    return summarize(results, elapsed, queries)
+
+
+def summarize(results, elapsed, queries):
+    rows = []
+    everything = []
+    errors = 0
+    for kind, result in results.items():
+        latencies = sorted(result["latencies"])
+        everything.extend(latencies)
+        errors += result["errors"]
+        rows.append(summary_row(kind, latencies, result["errors"], elapsed))
+    everything.sort()
+    rows.append(summary_row("total", everything, errors, elapsed))
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "queries_per_second": queries.count / elapsed if elapsed else 0,
+        "queries": queries.description,
+    }
+
+
+def summary_row(name, latencies, errors, elapsed):
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "per_second": len(latencies) / elapsed if elapsed else 0,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "error_rate": errors / len(latencies) * 100 if latencies else 0,
+    }
+
+
+def report(summary):
+    lines = [
+        f"{'kind':<10}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'errors':>9}"
+    ]
+    for row in summary["rows"]:
+        lines.append(
+            f"{row['name']:<10}{row['requests']:>10}{row['per_second']:>10.1f}{row['p50']:>10.1f}"
+            f"{row['p95']:>10.1f}{row['p99']:>10.1f}{row['error_rate']:>8.1f}%"
+        )
+    lines.append(
+        f"{summary['seconds']:.1f} s, {summary['queries_per_second']:.1f} database queries/s"
+        f" ({summary['queries']})"
+    )
+    return "\n".join(lines)
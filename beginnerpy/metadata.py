@@ -0,0 +1,101 @@
+import html
+import json
+import math
+import re
+from html.parser import HTMLParser
+
+EXCERPT_LENGTH = 200
+# Prose is read faster than code, code is counted per line
+WORDS_PER_MINUTE = 230
+CODE_LINES_PER_MINUTE = 30
+
+HEADING = re.compile(r"<h([2-4])([^>]*)>(.*?)</h\1>", re.DOTALL | re.IGNORECASE)
+ID_ATTRIBUTE = re.compile(r'\sid="([^"]*)"')
+TAG = re.compile(r"<[^>]+>")
+SPACE = re.compile(r"\s+")
+
+
+# Splits article html into prose and code, skipping markup
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.prose = []
+        self.code = []
+        self.code_blocks = 0
+        self.in_pre = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "pre":
+            self.in_pre += 1
+            self.code_blocks += 1
+        elif tag in ("p", "li", "br", "div", "h2", "h3", "h4", "td"):
+            self.prose.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag == "pre" and self.in_pre:
+            self.in_pre -= 1
+
+    def handle_data(self, data):
+        (self.code if self.in_pre else self.prose).append(data)
+
+    def text(self):
+        return SPACE.sub(" ", "".join(self.prose)).strip()
+
+
+def extract_text(string):
+    extractor = TextExtractor()
+    extractor.feed(string or "")
+    extractor.close()
+    return extractor
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-") or "section"
+
+
+# Cuts at a word boundary so the excerpt doesn't end in half a word
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+# Gives every h2-h4 an id to link to and returns the headings in order
+def add_heading_ids(string):
+    toc = []
+    used = set()
+
+    def replace(match):
+        level, attributes, inner = match.group(1), match.group(2), match.group(3)
+        title = SPACE.sub(" ", html.unescape(TAG.sub("", inner))).strip()
+        if not title:
+            return match.group(0)
+        existing = ID_ATTRIBUTE.search(attributes)
+        anchor = existing.group(1) if existing else slugify(title)
+        if not existing:
+            base, number = anchor, 2
+            while anchor in used:
+                anchor, number = f"{base}-{number}", number + 1
+            attributes = f'{attributes} id="{anchor}"'
+        used.add(anchor)
+        toc.append({"level": int(level), "title": title, "anchor": anchor})
+        return f"<h{level}{attributes}>{inner}</h{level}>"
+
+    return HEADING.sub(replace, string or ""), toc
+
+
+# Derives what the listings and the article header show from the rendered html, done once per save
+def extract(rendered_content, rendered_summary):
+    content, toc = add_heading_ids(rendered_content)
+    body = extract_text(content)
+    summary = extract_text(rendered_summary).text()
+    words = len(body.text().split()) + len(summary.split())
+    code_lines = sum(part.count("\n") for part in body.code) + body.code_blocks
+    minutes = words / WORDS_PER_MINUTE + code_lines / CODE_LINES_PER_MINUTE
+    return content, {
+        "excerpt": make_excerpt(summary or body.text()),
+        "reading_time": max(1, math.ceil(minutes)),
+        "toc": json.dumps(toc),
+        "code_block_count": body.code_blocks,
+    }
@@ -1,7 +1,8 @@
 from flask_login import UserMixin
-from sqlalchemy import create_engine, Column, Integer, BIGINT, String, Boolean, ForeignKey, Table, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, BIGINT, String, Boolean, ForeignKey, Table, Text, DateTime, LargeBinary, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+import json
 import os
 
 Base = declarative_base()
@@ -118,6 +119,12 @@ class Article(Base):
     link = Column(String(150), unique=True, index=True)
     content = Column(Text, nullable=False)
     summary = Column(Text, nullable=False)
+    rendered_content = Column(Text)  # content as shown to readers, code blocks already highlighted
+    rendered_summary = Column(Text)
+    excerpt = Column(Text)  # plain text, the metadata is extracted from the rendered html on save
+    reading_time = Column(Integer)
+    toc = Column(Text)  # json list of headings
+    code_block_count = Column(Integer)
     draft = Column(Integer, nullable=False, default=1, index=True)
     author_id = Column(Integer, ForeignKey('useraccount.id'))
     author = relationship("Useraccount", backref="articles", lazy='joined')
@@ -125,12 +132,31 @@ class Article(Base):
     category = relationship("Category", backref="articles", lazy='joined')
     date_created = Column(DateTime(), nullable=False, index=True)
     last_modified = Column(DateTime(), index=True)
+    rendered_at = Column(DateTime())  # when the render job last wrote the rendered columns
     viewCount = Column(Integer, default=0, index=True)
     usefulCount = Column(Integer, default=0, index=True)
     notUsefulCount = Column(Integer, default=0)
     modules = relationship('Module', secondary='articleModules', backref='articles', lazy='joined')
     tags = relationship('Tag', secondary='articleTags', backref='articles', lazy='joined')
 
+    @property
+    def table_of_contents(self):
+        return json.loads(self.toc) if self.toc else []
+
+
+class ArticleRevision(Base):
+    __tablename__ = "article_revision"
+    __table_args__ = (UniqueConstraint("article_id", "number"),)
+
+    id = Column(Integer, primary_key=True, unique=True, nullable=False)
+    article_id = Column(Integer, ForeignKey('article.id'), nullable=False, index=True)
+    number = Column(Integer, nullable=False)
+    snapshot = Column(Boolean, nullable=False, default=False)  # full copy, otherwise a delta against the previous revision
+    data = Column(LargeBinary, nullable=False)  # zlib compressed JSON
+    size = Column(Integer, nullable=False)
+    author_id = Column(Integer, ForeignKey('useraccount.id'))
+    author = relationship("Useraccount", lazy='joined')
+    date_created = Column(DateTime(), nullable=False, index=True)
 
 class Message(Base):
     __tablename__ = "message"
@@ -151,6 +177,72 @@ class Settings(Base):
     value = Column(String(2048))
 
 
+class Challenge(Base):
+    __tablename__ = "challenge"
+
+    id = Column(Integer, primary_key=True, unique=True, nullable=False, index=True)
+    slug = Column(String(100), unique=True, nullable=False, index=True)
+    title = Column(String(200), nullable=False)
+    description = Column(Text, nullable=False, default="")
+    function_name = Column(String(100), nullable=False)
+    tests_hash = Column(String(64), nullable=False, default="")  # changes whenever the tests do, so old grades aren't reused
+    active = Column(Boolean, default=False)
+    date_created = Column(DateTime(), nullable=False, index=True)
+    tests = relationship("ChallengeTest", backref="challenge", order_by="ChallengeTest.id", cascade="all, delete-orphan")
+
+
+class ChallengeTest(Base):
+    __tablename__ = "challenge_test"
+
+    id = Column(Integer, primary_key=True, unique=True, nullable=False)
+    challenge_id = Column(Integer, ForeignKey('challenge.id'), nullable=False, index=True)
+    arguments = Column(Text, nullable=False, default="[]")  # JSON list of positional arguments
+    expected = Column(Text, nullable=False, default="null")  # JSON encoded return value
+    hidden = Column(Boolean, default=False)
+
+
+class ChallengeSubmission(Base):
+    __tablename__ = "challenge_submission"
+
+    id = Column(Integer, primary_key=True, unique=True, nullable=False, index=True)
+    challenge_id = Column(Integer, ForeignKey('challenge.id'), nullable=False, index=True)
+    author = Column(String(100), nullable=False, default="")
+    solution = Column(Text, nullable=False)
+    solution_hash = Column(String(64), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending, running, passed, failed, error
+    passed = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+    result = Column(Text)  # JSON list with one entry per test
+    date_created = Column(DateTime(), nullable=False, index=True)
+    date_graded = Column(DateTime())
+
+
+class Job(Base):
+    __tablename__ = "job"
+
+    id = Column(Integer, primary_key=True, unique=True, nullable=False)
+    kind = Column(String(50), nullable=False)
+    arguments = Column(Text, nullable=False, default="{}")  # JSON keyword arguments for the handler
+    dedup_key = Column(String(200), index=True)  # only one pending job per key, see jobs.enqueue
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    error = Column(Text)
+    run_at = Column(DateTime(), nullable=False, index=True)  # not picked up before this, moved back on retries
+    date_created = Column(DateTime(), nullable=False)
+    date_started = Column(DateTime())
+    date_finished = Column(DateTime(), index=True)
+
+
+class Redirect(Base):
+    __tablename__ = "redirect"
+
+    id = Column(Integer, primary_key=True, unique=True, nullable=False)
+    old_link = Column(String(150), unique=True, nullable=False)  # link the article had before a rename
+    article_id = Column(Integer, ForeignKey('article.id'), nullable=False, index=True)
+    date_created = Column(DateTime(), nullable=False)
+
+
 def build(engine, session):
     Base.metadata.create_all(bind=engine)
 
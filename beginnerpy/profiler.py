@@ -0,0 +1,276 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, request, current_app
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from beginnerpy.queryaudit import normalize
+
+# Profiles of all workers of a pod go to one directory so the admin page lists them all
+DIRECTORY = os.environ.get(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "beginnerpy-profiles")
+)
+KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+# Profiles one request in this many, 0 only profiles requests asking for it
+SAMPLE_RATE = int(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# Signed X-Profile headers are accepted for this long after signing
+HEADER_TTL = 300
+HEADER = "X-Profile"
+PARAMETER = "_profile"
+
+PACKAGE = os.path.dirname(os.path.abspath(__file__))
+STANDARD_LIBRARY = os.path.dirname(os.__file__)
+SQL_LENGTH = 120
+
+# The statement each profiled thread is waiting on, by thread id
+_statements = {}
+
+
+def secret():
+    return (os.environ.get("PROFILE_SECRET") or current_app.secret_key).encode()
+
+
+def sign(timestamp):
+    return hmac.new(secret(), str(timestamp).encode(), hashlib.sha256).hexdigest()
+
+
+# The value of the X-Profile header that profiles requests for the next few minutes
+def header_value():
+    timestamp = int(time.time())
+    return f"{timestamp}:{sign(timestamp)}"
+
+
+def valid_header(value):
+    timestamp, _, signature = value.partition(":")
+    if not timestamp.isdigit() or time.time() - int(timestamp) > HEADER_TTL:
+        return False
+    return hmac.compare_digest(signature, sign(timestamp))
+
+
+def requested():
+    if request.headers.get(HEADER) and valid_header(request.headers[HEADER]):
+        return True
+    if PARAMETER in request.args and current_user.is_authenticated and current_user.is_admin:
+        return True
+    return SAMPLE_RATE > 0 and random.randrange(SAMPLE_RATE) == 0
+
+
+def label(code):
+    filename = code.co_filename
+    if filename.endswith(".html"):
+        return f"[template] {os.path.basename(filename)}:{code.co_name}"
+    if filename.startswith(PACKAGE):
+        filename = os.path.relpath(filename, os.path.dirname(PACKAGE))
+    elif "site-packages" in filename:
+        filename = filename.split("site-packages/")[-1]
+    elif filename.startswith(STANDARD_LIBRARY):
+        filename = os.path.relpath(filename, STANDARD_LIBRARY)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+
+
+# The stack of a sample from Flask's dispatch down, or from the WSGI entry for the hooks around
+# it, with the running statement as its leaf
+def collapse(frame, statement):
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    start = 0
+    for entry in (("dispatch_request", "full_dispatch_request"), ("wsgi_app",)):
+        for position, code in enumerate(codes):
+            if code.co_name in entry and "flask" in code.co_filename:
+                start = position + 1
+        if start:
+            break
+    names = [label(code) for code in codes[start:]]
+    if statement:
+        names.append(f"[sql] {statement}")
+    return ";".join(names)
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval=INTERVAL):
+        super().__init__(name="profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame, _statements.get(self.thread_id))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    thread_id = threading.get_ident()
+    if thread_id in _statements:
+        _statements[thread_id] = normalize(statement)[:SQL_LENGTH].replace(";", ",")
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    thread_id = threading.get_ident()
+    if thread_id in _statements:
+        _statements[thread_id] = None
+
+
+# Time spent in queries and templates, from the samples that were in them
+def attribute(stacks, interval):
+    sql = template = 0
+    for stack, count in stacks.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        if leaf.startswith("[sql]"):
+            sql += count
+        elif "[template]" in stack:
+            template += count
+    return sql * interval * 1000, template * interval * 1000
+
+
+def save(profile):
+    os.makedirs(DIRECTORY, exist_ok=True)
+    path = os.path.join(DIRECTORY, profile["name"] + ".json")
+    with open(path + ".tmp", "w") as handle:
+        json.dump(profile, handle)
+    os.replace(path + ".tmp", path)
+    for name in sorted(os.listdir(DIRECTORY))[:-KEEP]:
+        try:
+            os.remove(os.path.join(DIRECTORY, name))
+        except OSError:
+            pass
+
+
+def load(name):
+    path = os.path.join(DIRECTORY, os.path.basename(name) + ".json")
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+# Newest first, without their stacks
+def recent():
+    try:
+        names = sorted(os.listdir(DIRECTORY), reverse=True)
+    except OSError:
+        return []
+    profiles = []
+    for name in names:
+        if name.endswith(".json"):
+            profile = load(name[:-5])
+            if profile is not None:
+                profile.pop("stacks")
+                profile["date"] = datetime.fromtimestamp(profile["started"])
+                profiles.append(profile)
+    return profiles
+
+
+# One "frame;frame;frame count" line per stack, as read by flamegraph.pl and speedscope
+def collapsed(profile):
+    lines = [f"{stack} {count}" for stack, count in sorted(profile["stacks"].items())]
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(profile):
+    frames = []
+    indexes = {}
+    samples = []
+    weights = []
+    for stack, count in profile["stacks"].items():
+        sample = []
+        for name in stack.split(";"):
+            if name not in indexes:
+                indexes[name] = len(frames)
+                frames.append({"name": name})
+            sample.append(indexes[name])
+        samples.append(sample)
+        weights.append(count * profile["interval"] * 1000)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": f"{profile['method']} {profile['path']}",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        ],
+        "name": profile["name"],
+        "exporter": "beginnerpy",
+    }
+
+
+def init_app(app):
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        if not requested():
+            return
+        thread_id = threading.get_ident()
+        _statements[thread_id] = None
+        sampler = Sampler(thread_id)
+        g.profile = {
+            "name": f"{time.time():.6f}-{os.getpid()}",
+            "started": time.time(),
+            "clock": time.perf_counter(),
+            "sampler": sampler,
+        }
+        sampler.start()
+
+    @app.after_request
+    def name_profile(response):
+        if "profile" in g:
+            response.headers["X-Profile-Id"] = g.profile["name"]
+        return response
+
+    # Runs after the response was built, whether the view failed or not
+    @app.teardown_request
+    def save_profile(error=None):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        stacks = profile["sampler"].stop()
+        _statements.pop(threading.get_ident(), None)
+        sql_ms, template_ms = attribute(stacks, INTERVAL)
+        try:
+            save(
+                {
+                    "name": profile["name"],
+                    "started": profile["started"],
+                    "method": request.method,
+                    "path": request.full_path.rstrip("?"),
+                    "endpoint": request.endpoint,
+                    "duration_ms": (time.perf_counter() - profile["clock"]) * 1000,
+                    "interval": INTERVAL,
+                    "samples": sum(stacks.values()),
+                    "sql_ms": sql_ms,
+                    "template_ms": template_ms,
+                    "error": repr(error) if error else None,
+                    "stacks": dict(stacks),
+                }
+            )
+        except OSError as failure:
+            print(f"Saving the profile failed: {failure}")
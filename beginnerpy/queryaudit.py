@@ -0,0 +1,134 @@
+import os
+import re
+import traceback
+from collections import deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# "off", "log" to print and keep reports for the admin page, "raise" to fail the request,
+# which is what the tests run with
+MODE = os.environ.get("QUERY_AUDIT", "off")
+# A statement run this many times in one request is reported as a likely N+1
+REPEAT_THRESHOLD = int(os.environ.get("QUERY_AUDIT_REPEATS", 5))
+STACK_DEPTH = 8
+
+PACKAGE = os.path.dirname(os.path.abspath(__file__))
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAMETER = re.compile(r"%\([^)]+\)s|%s|:\w+|\?")
+PARAMETER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+SPACE = re.compile(r"\s+")
+
+# The latest reports of this worker, newest last
+reports = deque(maxlen=50)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+# Views declare how many statements a request may take, below the route and login decorators
+def query_budget(limit):
+    def declare(view):
+        view.query_budget = limit
+        return view
+
+    return declare
+
+
+# Statements differing only in their values, IN lists of any length included, normalize the same
+def normalize(statement):
+    statement = STRING.sub("?", statement)
+    statement = NUMBER.sub("?", statement)
+    statement = PARAMETER.sub("?", statement)
+    statement = PARAMETER_LIST.sub("?", statement)
+    return SPACE.sub(" ", statement).strip()
+
+
+# The application frames that led to the statement, templates included
+def application_stack():
+    frames = [
+        frame
+        for frame in traceback.extract_stack()[:-3]
+        if frame.filename.startswith(PACKAGE) and not frame.filename.endswith("queryaudit.py")
+    ]
+    return "".join(traceback.format_list(frames[-STACK_DEPTH:]))
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+    audit = g.setdefault("query_audit", {"total": 0, "statements": {}})
+    audit["total"] += 1
+    key = normalize(statement)
+    entry = audit["statements"].get(key)
+    if entry is None:
+        audit["statements"][key] = entry = {"count": 0, "stack": application_stack()}
+    entry["count"] += 1
+
+
+def view_name(view, path):
+    if view is None:
+        return path
+    return f"{view.__module__}.{getattr(view, '__qualname__', view.__name__)}"
+
+
+# None when the request stayed within its budget and nothing repeated
+def report(audit, view, path):
+    if not audit:
+        return None
+    budget = getattr(view, "query_budget", None)
+    repeated = [
+        {"sql": sql, "count": entry["count"], "stack": entry["stack"]}
+        for sql, entry in audit["statements"].items()
+        if entry["count"] >= REPEAT_THRESHOLD
+    ]
+    over_budget = budget is not None and audit["total"] > budget
+    if not repeated and not over_budget:
+        return None
+    repeated.sort(key=lambda item: -item["count"])
+    return {
+        "path": path,
+        "view": view_name(view, path),
+        "total": audit["total"],
+        "budget": budget,
+        "over_budget": over_budget,
+        "repeated": repeated,
+    }
+
+
+def format_report(item):
+    budget = "no budget" if item["budget"] is None else f"budget {item['budget']}"
+    lines = [f"{item['view']} ran {item['total']} statements for {item['path']} ({budget})"]
+    for statement in item["repeated"]:
+        lines.append(f"  {statement['count']}x {statement['sql']}")
+        lines.append("    " + statement["stack"].rstrip().replace("\n", "\n    "))
+    return "\n".join(lines)
+
+
+def init_app(app):
+    if MODE == "off":
+        return
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+
+    def check(item):
+        if item is None:
+            return
+        reports.append(item)
+        if MODE == "raise":
+            raise QueryBudgetExceeded(format_report(item))
+        print(format_report(item))
+
+    @app.after_request
+    def audit_queries(response):
+        audit = g.setdefault("query_audit", {"total": 0, "statements": {}})
+        view = app.view_functions.get(request.endpoint)
+        path = request.path
+        if response.is_streamed:
+            # Streamed templates keep querying while the body is sent, they count into the same
+            # audit and are checked once the server closes the response
+            response.call_on_close(lambda: check(report(audit, view, path)))
+        else:
+            check(report(audit, view, path))
+        return response
@@ -0,0 +1,148 @@
+import importlib
+import os
+import struct
+import threading
+import time
+from flask import request, session as cookie
+from beginnerpy import db
+from beginnerpy.shm import SharedTable
+
+# "shared" keeps buckets in shared memory for all workers of a pod, "memory" per worker,
+# anything else is imported as "module:attribute" and must provide take(key, rate, burst)
+BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "shared")
+ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") != "0"
+# Behind the ingress the client address is the n-th last X-Forwarded-For entry, 0 trusts no header.
+# Deployments behind ingress-nginx set 1, with 0 every visitor would share the ingress' bucket.
+PROXY_HOPS = int(os.environ.get("RATE_LIMIT_PROXY_HOPS", 0))
+BUCKET_SLOTS = int(os.environ.get("RATE_LIMIT_SLOTS", 65536))
+# Listing routes answer with 503 while getting a database connection takes longer than this
+SHED_POOL_WAIT = float(os.environ.get("SHED_POOL_WAIT_MS", 250)) / 1000
+
+# Requests per second and burst size per route group
+LIMITS = {
+    "article": (2.0, 30),
+    "listing": (2.0, 20),
+    "api": (10.0, 100),
+}
+GROUPS = {
+    "page": "article",
+    "index": "listing",
+    "module": "listing",
+    "tag": "listing",
+    "category": "listing",
+    "login": "listing",
+    "register": "listing",
+    "suggest.suggestions": "api",
+}
+SHED_GROUPS = {"listing"}
+
+BUCKET = struct.Struct("dd")
+
+# Requests turned away by this worker, shown on the admin page
+stats = {"limited": 0, "shed": 0}
+
+
+# Buckets are refilled lazily: tokens grow with the time since the last request, up to the burst size
+def refill(tokens, updated, rate, burst, now):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def spend(state, rate, burst, now):
+    tokens, updated = state if state else (burst, now)
+    tokens = refill(tokens, updated, rate, burst, now)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class MemoryBackend:
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        with self.lock:
+            state, retry_after = spend(self.buckets.get(key), rate, burst, now)
+            self.buckets[key] = state
+            if len(self.buckets) > BUCKET_SLOTS:
+                self.prune(now)
+        return retry_after
+
+    # Full buckets hold no information, so they are the ones dropped
+    def prune(self, now):
+        for key, (tokens, updated) in list(self.buckets.items()):
+            rate, burst = LIMITS.get(key.partition(":")[0], LIMITS["listing"])
+            if refill(tokens, updated, rate, burst, now) >= burst:
+                del self.buckets[key]
+
+
+class SharedBackend:
+    def __init__(self):
+        self.table = SharedTable("ratelimit", BUCKET_SLOTS, BUCKET.size)
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        result = {}
+
+        def update(value):
+            state, result["retry_after"] = spend(
+                BUCKET.unpack(value) if value else None, rate, burst, now
+            )
+            return BUCKET.pack(*state)
+
+        self.table.update(key, update)
+        return result["retry_after"]
+
+
+def load_backend(name):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "shared":
+        return SharedBackend()
+    module, _, attribute = name.partition(":")
+    backend = getattr(importlib.import_module(module), attribute)
+    return backend() if isinstance(backend, type) else backend
+
+
+backend = load_backend(BACKEND)
+
+
+def client_address():
+    if PROXY_HOPS and len(request.access_route) >= PROXY_HOPS:
+        return request.access_route[-PROXY_HOPS]
+    return request.remote_addr
+
+
+def route_group():
+    if request.blueprint == "bot_api":
+        return "api"
+    return GROUPS.get(request.endpoint)
+
+
+def retry_response(status, message, retry_after):
+    return message, status, {"Retry-After": str(max(1, round(retry_after)))}
+
+
+# Runs before every request, turns it away before it touches the database
+def check_request():
+    group = route_group()
+    if group is None:
+        return None
+    # Admins are never limited, the cookie check avoids loading the user
+    if cookie.get("_user_id"):
+        return None
+    if group in SHED_GROUPS and db.pool_wait() > SHED_POOL_WAIT:
+        stats["shed"] += 1
+        return retry_response(503, "The site is busy, please try again shortly.", 5)
+    rate, burst = LIMITS[group]
+    retry_after = backend.take(f"{group}:{client_address()}", rate, burst)
+    if retry_after:
+        stats["limited"] += 1
+        return retry_response(429, "Too many requests, please slow down.", retry_after)
+    return None
+
+
+def init_app(app):
+    if ENABLED:
+        app.before_request(check_request)
@@ -0,0 +1,135 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy.orm import object_session
+from beginnerpy.models import Article
+from beginnerpy.func import replaceBr, bumpNavVersion
+from beginnerpy.highlight import highlight_html
+from beginnerpy.images import responsive_images
+from beginnerpy.metadata import extract
+from beginnerpy import jobs, glossary, invalidation
+
+BATCH_SIZE = 200
+
+
+# Some unnecessary elements the editor places into the html structure need fixing
+def clean_html(string):
+    string = string.replace(' contenteditable="true"', "")
+    string = string.replace("ck ck-widget__selection-handle", "hide")
+    return string
+
+
+# Turns the editor's html into what readers get, done once when an article is saved
+def render_html(string, article_id=None):
+    if not string:
+        return string
+    string = highlight_html(replaceBr(clean_html(string)))
+    return responsive_images(string, article_id)
+
+
+# Rendered html plus the metadata the listings show, keyed by column name. Glossary terms are
+# linked with the matcher the caller refreshed, on the fly renders use whatever this worker has.
+def render_fields(article_id, content, summary):
+    rendered_summary = render_html(summary, article_id)
+    rendered_content = glossary.link_terms(
+        render_html(content, article_id), glossary.matcher(), article_id
+    )
+    rendered_content, fields = extract(rendered_content, rendered_summary)
+    fields["rendered_content"] = rendered_content
+    fields["rendered_summary"] = rendered_summary
+    return fields
+
+
+# The article needs an id for its images to get urls, so flush new articles first
+def render_article(article):
+    session = object_session(article)
+    if session is not None:
+        glossary.refresh(session)
+    for name, value in render_fields(article.id, article.content, article.summary).items():
+        setattr(article, name, value)
+
+
+# What the article page shows until the job rendered the article: the editor's html without
+# highlighting, responsive images or glossary links, cheap enough for the request thread
+def fallback(content):
+    if not content:
+        return content
+    return replaceBr(clean_html(content))
+
+
+# Leaves rendering to the job runner, until it ran the article page shows fallback()
+def schedule(session, article):
+    article.rendered_content = None
+    article.rendered_summary = None
+    jobs.enqueue(session, "render_article", article_id=article.id)
+
+
+@jobs.handler("render_article")
+def render_job(session, article_id):
+    article = session.query(Article).get(article_id)
+    if article is not None:
+        render_article(article)
+        # Listings show the excerpt, reading time and code blocks written here, rendered_at
+        # changes their validators without touching the date authors see, see conditional.py
+        article.rendered_at = datetime.now()
+        session.commit()
+
+
+# Used by the backfill, takes and returns plain tuples so it can run in another process
+def render_row(row):
+    article_id, content, summary = row
+    return dict(
+        render_fields(article_id, content, summary), id=article_id, rendered_at=datetime.now()
+    )
+
+
+def batches(session):
+    last_id = 0
+    while True:
+        rows = (
+            session.query(Article.id, Article.content, Article.summary)
+            .filter(Article.id > last_id)
+            .order_by(Article.id)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        yield rows
+
+
+# Pages are validated by the navigation version and every worker drops its cached articles,
+# readers fetch the new renders once all are saved
+def rendered_all(session):
+    bumpNavVersion(session)
+    invalidation.publish(session, "article")
+    session.commit()
+
+
+# Renders every article again in a pool of processes, returns how many were updated
+def backfill(session, workers=None):
+    workers = workers or os.cpu_count()
+    updated = 0
+    glossary.refresh(session)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=glossary.use_terms, initargs=(glossary.terms(),)
+    ) as pool:
+        for rows in batches(session):
+            mappings = list(pool.map(render_row, rows, chunksize=8))
+            session.bulk_update_mappings(Article, mappings)
+            session.commit()
+            updated += len(mappings)
+    rendered_all(session)
+    return updated
+
+
+# Queued when the glossary changed, renders in the job runner without a pool of processes
+@jobs.handler("render_all_articles", max_attempts=3)
+def render_all_job(session):
+    glossary.refresh(session)
+    for rows in batches(session):
+        session.bulk_update_mappings(Article, [render_row(row) for row in rows])
+        session.commit()
+    rendered_all(session)
+
@@ -0,0 +1,183 @@
+import difflib
+import json
+import random
+import re
+import zlib
+from datetime import datetime
+from sqlalchemy import func
+from beginnerpy.models import Article, ArticleRevision
+
+# Every n-th revision stores the full text, so rebuilding one never replays more than n-1 deltas
+SNAPSHOT_EVERY = 10
+FIELDS = ("title", "summary", "content")
+
+# Editor html is often a single line, splitting after every tag gives the diff useful units
+TOKEN = re.compile(r"[^>]*>|[^>]+$")
+
+
+def tokenize(text):
+    return TOKEN.findall(text or "")
+
+
+def encode(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode(), 9)
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob).decode())
+
+
+# Describes new as ranges copied from old plus inserted text
+def delta(old, new):
+    old_tokens, new_tokens = tokenize(old), tokenize(new)
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(new_tokens[j1:j2]))
+    return ops
+
+
+def patch(old, ops):
+    old_tokens = tokenize(old)
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(old_tokens[op[0]:op[1]])
+    return "".join(parts)
+
+
+def fields_of(article):
+    return {field: getattr(article, field) or "" for field in FIELDS}
+
+
+def latest(session, article_id):
+    return (
+        session.query(ArticleRevision)
+        .filter_by(article_id=article_id)
+        .order_by(ArticleRevision.number.desc())
+        .first()
+    )
+
+
+# Rebuilds the fields of one revision from the closest snapshot before it
+def reconstruct(session, article_id, number):
+    snapshot = (
+        session.query(func.max(ArticleRevision.number))
+        .filter_by(article_id=article_id, snapshot=True)
+        .filter(ArticleRevision.number <= number)
+        .scalar()
+    )
+    if snapshot is None:
+        return None
+    chain = (
+        session.query(ArticleRevision)
+        .filter_by(article_id=article_id)
+        .filter(ArticleRevision.number.between(snapshot, number))
+        .order_by(ArticleRevision.number)
+        .all()
+    )
+    fields = None
+    for revision in chain:
+        data = decode(revision.data)
+        if revision.snapshot:
+            fields = data
+        else:
+            fields = {field: patch(fields[field], data[field]) for field in FIELDS}
+    return fields
+
+
+def add_revision(session, article, number, fields, previous, author_id):
+    snapshot = previous is None or (number - 1) % SNAPSHOT_EVERY == 0
+    if snapshot:
+        data = encode(fields)
+    else:
+        data = encode({field: delta(previous[field], fields[field]) for field in FIELDS})
+    revision = ArticleRevision(
+        article_id=article.id,
+        number=number,
+        snapshot=snapshot,
+        data=data,
+        size=len(data),
+        author_id=author_id,
+        date_created=datetime.now(),
+    )
+    session.add(revision)
+    return revision
+
+
+# Records the current state of an article, old_fields is the state before an edit and
+# becomes the first revision of articles written before history was kept. The article row stays
+# locked until the caller commits, so concurrent saves don't take the same number.
+def record(session, article, author_id=None, old_fields=None):
+    session.query(Article.id).filter_by(id=article.id).with_for_update().scalar()
+    last = latest(session, article.id)
+    fields = fields_of(article)
+    if last is None:
+        if old_fields is not None and old_fields != fields:
+            add_revision(session, article, 1, old_fields, None, None)
+            return add_revision(session, article, 2, fields, old_fields, author_id)
+        return add_revision(session, article, 1, fields, None, author_id)
+    previous = reconstruct(session, article.id, last.number)
+    if previous == fields:
+        return last
+    return add_revision(session, article, last.number + 1, fields, previous, author_id)
+
+
+# Line based diff of two revisions, the html is broken after every tag to keep lines short
+def diff(old, new):
+    lines = []
+    for field in FIELDS:
+        before = tokenize(old[field]) if old else []
+        after = tokenize(new[field])
+        changes = list(difflib.unified_diff(before, after, lineterm="", n=2))
+        if changes:
+            lines.append(f"### {field}")
+            lines.extend(changes[2:])
+    return lines
+
+
+def stats(session, article_id=None):
+    query = session.query(
+        func.count(ArticleRevision.id),
+        func.coalesce(func.sum(ArticleRevision.size), 0),
+        func.count(ArticleRevision.id).filter(ArticleRevision.snapshot.is_(True)),
+    )
+    if article_id is not None:
+        query = query.filter(ArticleRevision.article_id == article_id)
+    count, size, snapshots = query.one()
+    return {
+        "revisions": count,
+        "bytes": size,
+        "snapshots": snapshots,
+        "bytes_per_edit": size / count if count else 0,
+    }
+
+
+# Replays an editing session of small random edits on the text, compares the storage with full copies
+def simulate(text, edits, seed=0):
+    generator = random.Random(seed)
+    words = re.findall(r"\w+", text) or ["word"]
+    fields = {"title": "Simulated", "summary": "", "content": text}
+    stored = full = 0
+    previous = None
+    for number in range(1, edits + 1):
+        tokens = tokenize(fields["content"])
+        position = generator.randrange(len(tokens) + 1)
+        sentence = " ".join(generator.choice(words) for i in range(generator.randint(3, 15)))
+        if tokens and generator.random() < 0.3:
+            tokens[min(position, len(tokens) - 1)] = f"<p>{sentence}</p>"
+        else:
+            tokens.insert(position, f"<p>{sentence}</p>")
+        fields = dict(fields, content="".join(tokens))
+        if previous is None or (number - 1) % SNAPSHOT_EVERY == 0:
+            stored += len(encode(fields))
+        else:
+            stored += len(encode({f: delta(previous[f], fields[f]) for f in FIELDS}))
+        full += len(json.dumps(fields).encode())
+        previous = fields
+    return {"edits": edits, "delta_bytes_per_edit": stored / edits, "full_bytes_per_edit": full / edits}
@@ -0,0 +1,135 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# /dev/shm is memory backed and shared by every gunicorn worker in the pod
+SHM_DIR = os.environ.get(
+    "SHM_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+PROBES = 8
+HEADER = struct.Struct("16sI")
+
+
+# A fixed size hash table in a memory mapped file, safe to use from several processes and threads.
+# Keys are hashed to 16 bytes, values are bytes up to value_size. When all probed slots are taken
+# the last one is overwritten, so callers must be fine with entries disappearing.
+class SharedTable:
+    def __init__(self, name, slots, value_size):
+        self.slots = slots
+        self.value_size = value_size
+        self.slot_size = HEADER.size + value_size
+        self.path = os.path.join(SHM_DIR, f"beginnerpy-{name}")
+        self.thread_lock = threading.RLock()
+        self.map = None
+        self.fd = None
+        self.pid = None
+
+    # Mapped lazily, and again after a fork, so gunicorn workers don't share a file descriptor
+    def open(self):
+        if self.map is not None and self.pid == os.getpid():
+            return
+        size = self.slots * self.slot_size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self.fd = fd
+        self.map = mmap.mmap(fd, size)
+        self.pid = os.getpid()
+
+    @contextmanager
+    def locked(self):
+        with self.thread_lock:
+            self.open()
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def digest(key):
+        return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+    def find(self, digest):
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        free = None
+        for probe in range(PROBES):
+            index = (start + probe) % self.slots
+            stored, length = HEADER.unpack_from(self.map, index * self.slot_size)
+            if stored == digest:
+                return index, True
+            if free is None and stored == bytes(16):
+                free = index
+        return (free if free is not None else (start + PROBES - 1) % self.slots), False
+
+    def read(self, index):
+        offset = index * self.slot_size
+        stored, length = HEADER.unpack_from(self.map, offset)
+        start = offset + HEADER.size
+        return bytes(self.map[start:start + length])
+
+    def write(self, index, digest, value):
+        if len(value) > self.value_size:
+            raise ValueError(f"Value of {len(value)} bytes doesn't fit a {self.value_size} byte slot.")
+        offset = index * self.slot_size
+        HEADER.pack_into(self.map, offset, digest, len(value))
+        start = offset + HEADER.size
+        self.map[start:start + len(value)] = value
+
+    def get(self, key):
+        digest = self.digest(key)
+        with self.locked():
+            index, found = self.find(digest)
+            return self.read(index) if found else None
+
+    def set(self, key, value):
+        digest = self.digest(key)
+        with self.locked():
+            index, found = self.find(digest)
+            self.write(index, digest, value)
+
+    def get_many(self, keys):
+        digests = [self.digest(key) for key in keys]
+        values = []
+        with self.locked():
+            for digest in digests:
+                index, found = self.find(digest)
+                values.append(self.read(index) if found else None)
+        return values
+
+    def set_many(self, items):
+        digests = [(self.digest(key), value) for key, value in items]
+        with self.locked():
+            for digest, value in digests:
+                index, found = self.find(digest)
+                self.write(index, digest, value)
+
+    def delete(self, key):
+        digest = self.digest(key)
+        with self.locked():
+            index, found = self.find(digest)
+            if found:
+                HEADER.pack_into(self.map, index * self.slot_size, bytes(16), 0)
+
+    # Reads, changes and writes one value while holding the lock, function gets None for new keys
+    def update(self, key, function):
+        digest = self.digest(key)
+        with self.locked():
+            index, found = self.find(digest)
+            value = function(self.read(index) if found else None)
+            if value is not None:
+                self.write(index, digest, value)
+            return value
+
+    def clear(self):
+        with self.locked():
+            self.map[:] = bytes(len(self.map))
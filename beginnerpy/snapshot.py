@@ -0,0 +1,334 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+from flask import request, render_template, abort
+from sqlalchemy import desc
+from sqlalchemy.exc import OperationalError, InterfaceError
+from beginnerpy.models import *
+from beginnerpy.db import Session
+from beginnerpy.func import getSideNav
+from beginnerpy.render import render_article
+from beginnerpy.bot.api import serialize_message, json_response
+
+PATH = os.environ.get(
+    "SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "beginnerpy-snapshot")
+)
+# How often a pod writes a new snapshot while the database is up
+INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 300))
+# After a failed query public pages skip the database for this long
+RETRY_SECONDS = float(os.environ.get("SNAPSHOT_RETRY_SECONDS", 10))
+LATEST_COUNT = 20
+
+# The file is a header, one json document per key and a json index of key -> (offset, length)
+MAGIC = b"BPYSNAP1"
+HEADER = struct.Struct("8sQQ")
+DATABASE_ERRORS = (OperationalError, InterfaceError)
+PUBLIC_ENDPOINTS = {
+    "index", "category", "tag", "module", "page", "bot_api.messages", "bot_api.message"
+}
+
+
+def serialize_article(article, full=False):
+    data = {
+        "id": article.id,
+        "title": article.title,
+        "link": article.link,
+        "excerpt": article.excerpt,
+        "reading_time": article.reading_time,
+        "code_block_count": article.code_block_count,
+        "draft": 0,
+        "date_created": article.date_created.isoformat(),
+        "author": {"id": article.author.id, "displayname": article.author.displayname},
+        "category": {
+            "id": article.category.id,
+            "name": article.category.name,
+            "link": article.category.link,
+        },
+    }
+    if full:
+        data.update(
+            summary=article.summary,
+            rendered_content=article.rendered_content,
+            rendered_summary=article.rendered_summary,
+            table_of_contents=article.table_of_contents,
+            modules=[{"name": item.name, "link": item.link} for item in article.modules],
+            tags=[{"name": item.name, "link": item.link} for item in article.tags],
+        )
+    return data
+
+
+# Everything the public pages need, keyed the way the fallback views look it up
+def collect(session):
+    documents = {"nav": getSideNav()}
+    articles = (
+        session.query(Article).filter_by(draft=0).order_by(desc(Article.date_created)).all()
+    )
+    listings = {}
+    for article in articles:
+        if article.rendered_content is None:
+            render_article(article)
+        documents[f"article:{article.link}"] = serialize_article(article, full=True)
+        summary = serialize_article(article)
+        keys = [f"category:{article.category_id}"]
+        keys += [f"tag:{item.link}" for item in article.tags]
+        keys += [f"module:{item.link}" for item in article.modules]
+        for key in keys:
+            listings.setdefault(key, []).append(summary)
+    documents["latest"] = [serialize_article(article) for article in articles[:LATEST_COUNT]]
+    for key, items in listings.items():
+        # The live tag and module pages list the oldest first
+        if not key.startswith("category:"):
+            items.reverse()
+        documents[f"listing:{key}"] = items
+    documents["tags"] = [
+        {"name": item.name, "title": item.title, "link": item.link} for item in session.query(Tag)
+    ]
+    documents["modules"] = [
+        {"name": item.name, "title": item.title, "link": item.link} for item in session.query(Module)
+    ]
+    documents["messages"] = [
+        serialize_message(message) for message in session.query(Message).order_by(Message.id)
+    ]
+    session.rollback()
+    return documents
+
+
+# Written next to the old file and renamed over it, readers keep their mapping of the old one
+def write(session, path=PATH):
+    documents = collect(session)
+    directory = os.path.dirname(path) or "."
+    fd, temporary = tempfile.mkstemp(dir=directory)
+    index = {}
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(bytes(HEADER.size))
+        offset = HEADER.size
+        for key, value in documents.items():
+            data = json.dumps(value, separators=(",", ":")).encode()
+            handle.write(data)
+            index[key] = (offset, len(data))
+            offset += len(data)
+        data = json.dumps(index, separators=(",", ":")).encode()
+        handle.write(data)
+        handle.seek(0)
+        handle.write(HEADER.pack(MAGIC, offset, len(data)))
+    os.replace(temporary, path)
+    return len(documents), offset + len(data)
+
+
+def parse_dates(item):
+    for key in ("date_created", "last_modified"):
+        if isinstance(item.get(key), str):
+            item[key] = datetime.fromisoformat(item[key])
+    return item
+
+
+# A memory mapped snapshot, remapped when a newer file replaces it
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.index = {}
+        self.decoded = {}
+        self.version = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked < 1:
+            return
+        self.checked = now
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if version == self.version:
+            return
+        with open(self.path, "rb") as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset, length = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            mapped.close()
+            return
+        with self.lock:
+            self.index = json.loads(mapped[offset:offset + length])
+            self.decoded = {}
+            self.map = mapped
+            self.version = version
+
+    def get(self, key, default=None):
+        self.refresh()
+        value = self.decoded.get(key)
+        if value is not None:
+            return value
+        with self.lock:
+            location = self.index.get(key)
+            if location is None:
+                return default
+            offset, length = location
+            value = json.loads(self.map[offset:offset + length], object_hook=parse_dates)
+            self.decoded[key] = value
+        return value
+
+    @property
+    def available(self):
+        self.refresh()
+        return self.map is not None
+
+
+snapshot = Snapshot(PATH)
+_down_until = [0.0]
+_writer = []
+_writer_lock = threading.Lock()
+
+
+def mark_down():
+    _down_until[0] = time.monotonic() + RETRY_SECONDS
+
+
+def is_down():
+    return time.monotonic() < _down_until[0]
+
+
+# Only one worker per pod writes, the others see a fresh file and skip their turn
+def write_if_due():
+    try:
+        age = time.time() - os.stat(PATH).st_mtime
+    except OSError:
+        age = INTERVAL
+    if age < INTERVAL or is_down():
+        return
+    with open(PATH + ".lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        if os.path.exists(PATH) and time.time() - os.stat(PATH).st_mtime < INTERVAL:
+            return
+        session = Session()
+        try:
+            write(session)
+        except DATABASE_ERRORS:
+            mark_down()
+        except Exception as error:
+            print(f"Writing the content snapshot failed: {error}")
+        finally:
+            session.close()
+
+
+def write_periodically():
+    while True:
+        write_if_due()
+        time.sleep(min(INTERVAL, 30))
+
+
+def start_writer():
+    if _writer:
+        return
+    with _writer_lock:
+        if _writer:
+            return
+        thread = threading.Thread(target=write_periodically, name="snapshot", daemon=True)
+        thread.start()
+        _writer.append(thread)
+
+
+def render(template, **context):
+    return render_template(template, degraded=True, property="front", **context)
+
+
+# The public views rebuilt on top of the snapshot, their templates get the same context shape
+def serve(endpoint, arguments):
+    if not snapshot.available:
+        return None
+    sidenav = snapshot.get("nav", [])
+    if endpoint == "index":
+        return render(
+            "index.html",
+            sidenav=sidenav,
+            content=snapshot.get("latest", []),
+            title="Welcome to Beginner Python!",
+            endpoint="/",
+        )
+    if endpoint == "category":
+        cat = next((item for item in sidenav if item["link"] == arguments["category_link"]), None)
+        if cat is None:
+            abort(404)
+        return render(
+            "category.html",
+            cat_id=cat["id"],
+            sidenav=sidenav,
+            articles=snapshot.get(f"listing:category:{cat['id']}", []),
+            endpoint=cat["name"],
+        )
+    if endpoint in ("tag", "module"):
+        link = arguments[f"{endpoint}_link"]
+        item = next((i for i in snapshot.get(f"{endpoint}s", []) if i["link"] == link), None)
+        if item is None:
+            abort(404)
+        return render(
+            "index.html",
+            sidenav=sidenav,
+            content=snapshot.get(f"listing:{endpoint}:{link}", []),
+            title=item["title"],
+            endpoint=endpoint,
+        )
+    if endpoint == "page":
+        link = arguments["link"]
+        if arguments.get("module"):
+            link = f"{arguments['module']}/{link}"
+        article = snapshot.get(f"article:{link}")
+        if article is None:
+            abort(404)
+        return render("page.html", sidenav=sidenav, article=article, endpoint="article_view")
+    if endpoint in ("bot_api.messages", "bot_api.message"):
+        return serve_messages(arguments)
+    return None
+
+
+# The bot keeps getting rules and tips, without a collection version since none can be read
+def serve_messages(arguments):
+    message_type = arguments["message_type"].upper()
+    messages = [m for m in snapshot.get("messages", []) if m["message_type"] == message_type]
+    etag = f"{message_type}-snapshot-{snapshot.version[1]}"
+    if "label" not in arguments:
+        payload = {"version": None, "message_type": message_type, "messages": messages}
+        return json_response(json.dumps(payload), etag)
+    label = arguments["label"].lower()
+    for item in messages:
+        if label in [value.lower() for value in item["labels"]]:
+            return json_response(json.dumps({"version": None, "message": item}), etag)
+    abort(404)
+
+
+def unavailable():
+    sidenav = snapshot.get("nav", []) if snapshot.available else []
+    return render("offline.html", sidenav=sidenav, endpoint="offline"), 503, {"Retry-After": "30"}
+
+
+def init_app(app):
+    # Skips the database while it is known to be down
+    @app.before_request
+    def serve_while_down():
+        start_writer()
+        if is_down() and request.endpoint in PUBLIC_ENDPOINTS:
+            return serve(request.endpoint, request.view_args or {}) or unavailable()
+        return None
+
+    def database_error(error):
+        mark_down()
+        if request.method == "GET" and request.endpoint in PUBLIC_ENDPOINTS:
+            response = serve(request.endpoint, request.view_args or {})
+            if response is not None:
+                return response
+        return unavailable()
+
+    for error in DATABASE_ERRORS:
+        app.register_error_handler(error, database_error)
@@ -0,0 +1,44 @@
+// Inputs with a data-suggest attribute get their datalist filled from /suggest while typing.
+// Picking a suggestion opens it, or ticks its checkbox when the input has data-suggest-check.
+document.querySelectorAll("input[data-suggest]").forEach(function (input) {
+	let list = document.getElementById(input.getAttribute("list"));
+	let found = {};
+	let timer = null;
+
+	input.addEventListener("input", function () {
+		let match = found[input.value];
+		if (match) {
+			pick_suggestion(input, match);
+			return;
+		}
+		clearTimeout(timer);
+		if (input.value.trim() == "") {
+			return;
+		}
+		timer = setTimeout(function () {
+			let url = "/suggest?kind=" + input.dataset.suggest + "&q=" + encodeURIComponent(input.value);
+			fetch(url).then(response => response.json()).then(function (data) {
+				found = {};
+				list.innerHTML = "";
+				data.suggestions.forEach(function (item) {
+					found[item.title] = item;
+					let option = document.createElement("option");
+					option.value = item.title;
+					list.appendChild(option);
+				});
+			});
+		}, 100);
+	});
+});
+
+function pick_suggestion(input, item) {
+	if (input.dataset.suggestCheck === undefined) {
+		window.location = item.url;
+		return;
+	}
+	let checkbox = document.getElementById(item.kind + "_" + item.id);
+	if (checkbox) {
+		checkbox.checked = true;
+	}
+	input.value = "";
+}
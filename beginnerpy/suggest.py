@@ -0,0 +1,267 @@
+import bisect
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from flask import Blueprint, request, jsonify
+from beginnerpy.models import Article, Category, Tag, Module
+from beginnerpy.db import Session
+from beginnerpy import cache, invalidation
+
+LIMIT = 10
+# Short prefixes match many titles, only this many are ranked
+MAX_CANDIDATES = int(os.environ.get("SUGGEST_MAX_CANDIDATES", 100))
+# Index rows looked at per kind and list, a common word with a rare second word would otherwise
+# walk every title containing the common one
+MAX_VISITED = int(os.environ.get("SUGGEST_MAX_VISITED", 500))
+# How often a worker checks whether another worker changed the index, when the invalidation
+# bus isn't there to tell it
+CHECK_INTERVAL = float(os.environ.get("SUGGEST_CHECK_INTERVAL", 2))
+KINDS = ("article", "tag", "module")
+WORD = re.compile(r"[a-z0-9]+")
+
+Entry = namedtuple("Entry", "key kind id title url words phrase")
+
+suggest_blueprint = Blueprint("suggest", __name__)
+_shared = cache.namespace("suggest")
+
+
+def words(text):
+    return WORD.findall((text or "").lower())
+
+
+def make_entry(kind, item_id, title, url):
+    parts = words(title)
+    return Entry(f"{kind}:{item_id}", kind, item_id, title, url, tuple(set(parts)), " ".join(parts))
+
+
+def remove_sorted(items, item):
+    position = bisect.bisect_left(items, item)
+    if position < len(items) and items[position] == item:
+        del items[position]
+
+
+# Sorted lists of (title, key) and (word, key) pairs per kind, a prefix is found by bisecting them
+class PrefixIndex:
+    def __init__(self, entries=()):
+        self.entries = {entry.key: entry for entry in entries}
+        self.phrases = {kind: [] for kind in KINDS}
+        self.words = {kind: [] for kind in KINDS}
+        for entry in self.entries.values():
+            self.phrases[entry.kind].append((entry.phrase, entry.key))
+            self.words[entry.kind].extend((word, entry.key) for word in entry.words)
+        for items in (*self.phrases.values(), *self.words.values()):
+            items.sort()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            remove_sorted(self.phrases[entry.kind], (entry.phrase, key))
+            for word in entry.words:
+                remove_sorted(self.words[entry.kind], (word, key))
+
+    def add(self, entry):
+        self.remove(entry.key)
+        with self.lock:
+            self.entries[entry.key] = entry
+            bisect.insort(self.phrases[entry.kind], (entry.phrase, entry.key))
+            for word in entry.words:
+                bisect.insort(self.words[entry.kind], (word, entry.key))
+
+    # Keys of the entries after (prefix,) in a sorted list, as long as they start with it. Stops
+    # after visiting MAX_VISITED pairs, whether they passed the check or not.
+    def scan(self, items, prefix, found, limit, check=None):
+        position = bisect.bisect_left(items, (prefix,))
+        stop = min(len(items), position + MAX_VISITED)
+        while position < stop and len(found) < limit:
+            text, key = items[position]
+            if not text.startswith(prefix):
+                break
+            position += 1
+            if key not in found and (check is None or check(self.entries[key])):
+                found[key] = self.entries[key]
+
+    # Titles starting with the query come first, then titles having a word starting with every
+    # word of the query. The longest query word picks those candidates, it matches the fewest.
+    def search(self, query, kinds=KINDS, limit=LIMIT):
+        wanted = words(query)
+        if not wanted:
+            return []
+        phrase = " ".join(wanted)
+        found = {}
+
+        def has_every_word(entry):
+            return all(any(word.startswith(part) for word in entry.words) for part in wanted)
+
+        with self.lock:
+            for kind in kinds:
+                self.scan(self.phrases[kind], phrase, found, len(found) + limit)
+            if len(found) < limit:
+                driver = max(wanted, key=len)
+                check = has_every_word if len(wanted) > 1 else None
+                for kind in kinds:
+                    self.scan(self.words[kind], driver, found, MAX_CANDIDATES, check)
+        ranked = sorted(
+            found.values(),
+            key=lambda entry: (
+                not entry.phrase.startswith(phrase),
+                KINDS.index(entry.kind),
+                len(entry.title),
+                entry.title.lower(),
+            ),
+        )
+        return ranked[:limit]
+
+
+def article_entries(session, *criteria):
+    rows = (
+        session.query(Article.id, Article.title, Article.link, Category.link)
+        .join(Category, Article.category_id == Category.id)
+        .filter(Article.draft == 0, *criteria)
+        .yield_per(1000)
+    )
+    return [make_entry("article", row[0], row[1], f"/{row[3]}/{row[2]}") for row in rows]
+
+
+def load_entries(session):
+    entries = article_entries(session)
+    entries += [make_entry("tag", tag.id, tag.title, f"/tag/{tag.link}") for tag in session.query(Tag)]
+    entries += [
+        make_entry("module", module.id, module.title, f"/module/{module.link}")
+        for module in session.query(Module)
+    ]
+    return entries
+
+
+_index = [None]
+_version = [None]
+_checked = [0.0]
+_build_lock = threading.Lock()
+_threads = []
+
+
+def build(only_missing=False):
+    with _build_lock:
+        if only_missing and _index[0] is not None:
+            return
+        version = _shared.get("version")
+        session = Session()
+        try:
+            _index[0] = PrefixIndex(load_entries(session))
+        finally:
+            session.close()
+        _version[0] = version
+
+
+def build_in_background():
+    if any(thread.is_alive() for thread in _threads):
+        return
+    thread = threading.Thread(target=build, name="suggest", daemon=True)
+    thread.start()
+    _threads[:] = [thread]
+
+
+# Another worker changed its index, this one is rebuilt while the old one keeps answering
+def check_version():
+    if invalidation.active():
+        return
+    now = time.monotonic()
+    if now - _checked[0] < CHECK_INTERVAL:
+        return
+    _checked[0] = now
+    if _shared.get("version") != _version[0]:
+        build_in_background()
+
+
+def index():
+    if _index[0] is None:
+        build(only_missing=True)
+    check_version()
+    return _index[0]
+
+
+# Tells the other workers to rebuild, the changes were already applied to this worker's index
+def publish():
+    version = f"{os.getpid()}-{time.time_ns()}"
+    _shared.set("version", version)
+    _version[0] = version
+
+
+# Applies committed changes to these articles, tags or modules to this worker's index
+def update(session, kind, ids):
+    if _index[0] is None:
+        return
+    if kind == "article":
+        current = {entry.id: entry for entry in article_entries(session, Article.id.in_(ids))}
+    else:
+        model = {"tag": Tag, "module": Module}[kind]
+        current = {
+            item.id: make_entry(kind, item.id, item.title, f"/{kind}/{item.link}")
+            for item in session.query(model).filter(model.id.in_(ids))
+        }
+    # Unpublished and deleted articles aren't found and leave the index
+    for item_id in ids:
+        if item_id in current:
+            _index[0].add(current[item_id])
+        else:
+            _index[0].remove(f"{kind}:{item_id}")
+    if not invalidation.active():
+        publish()
+
+
+# For changes touching many entries at once, like a category's link
+def rebuild():
+    if not invalidation.active():
+        publish()
+    build_in_background()
+
+
+def invalidated(kind):
+    def handler(ids):
+        if ids is None:
+            rebuild()
+            return
+        session = Session()
+        try:
+            update(session, kind, ids)
+        finally:
+            session.close()
+
+    return handler
+
+
+for kind in KINDS:
+    invalidation.subscribe(kind, invalidated(kind))
+invalidation.subscribe("category", lambda ids: rebuild())
+
+
+@suggest_blueprint.route("/suggest")
+def suggestions():
+    query = request.args.get("q", "")[:100]
+    kinds = tuple(kind for kind in request.args.get("kind", "").split(",") if kind in KINDS)
+    limit = max(1, min(request.args.get("limit", LIMIT, type=int), 50))
+    found = index().search(query, kinds or KINDS, limit)
+    response = jsonify(
+        query=query,
+        suggestions=[
+            {"kind": entry.kind, "id": entry.id, "title": entry.title, "url": entry.url}
+            for entry in found
+        ],
+    )
+    response.headers["Cache-Control"] = "public, max-age=30"
+    return response
+
+
+def init_app(app):
+    # Built while the first requests are served instead of on the first keystroke
+    @app.before_request
+    def warm_up():
+        if _index[0] is None and not _threads:
+            build_in_background()
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+from flask import current_app, stream_with_context
+from flask_wtf.csrf import generate_csrf
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from beginnerpy import cache
+
+BYTECODE_DIR = os.environ.get(
+    "JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "beginnerpy-jinja")
+)
+# Rows fetched per round trip by streamed listings, and template chunks sent per write
+STREAM_BATCH = int(os.environ.get("STREAM_BATCH", 100))
+STREAM_BUFFER = int(os.environ.get("STREAM_BUFFER", 40))
+
+
+# Compiled templates survive worker restarts and deploys, they are keyed on the template source
+class CountingBytecodeCache(FileSystemBytecodeCache):
+    def load_bytecode(self, bucket):
+        super().load_bytecode(bucket)
+        cache.count("bytecode", bucket.code is not None)
+
+
+def bytecode_cache():
+    os.makedirs(BYTECODE_DIR, exist_ok=True)
+    return CountingBytecodeCache(BYTECODE_DIR)
+
+
+# Adds {% cache "name", key, ... %}...{% endcache %}, the body is only rendered when the key changes
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render", [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    # Each fragment name is its own cache namespace, so its entries are shared by all workers
+    def _render(self, parts, caller):
+        name = str(parts[0])
+        key = hashlib.sha1("\0".join(str(part) for part in parts).encode()).hexdigest()
+        return Markup(cache.namespace(f"fragment:{name}").get_or_set(key, lambda: str(caller())))
+
+
+# A short key that changes whenever anything shown in the navigation changes
+def nav_version(sidenav):
+    digest = hashlib.sha1()
+    for item in sidenav:
+        digest.update(
+            f"{item['id']}|{item['name']}|{item['link']}|{item['bot']}|{item['active']}\n".encode()
+        )
+    return digest.hexdigest()[:16]
+
+
+# Fetches the rows in batches through a server side cursor instead of all at once
+def batched(query):
+    return query.yield_per(STREAM_BATCH)
+
+
+# Sends the page while the template renders, reading the rows from the session as it goes. The
+# session is closed once the last chunk is sent or the client went away.
+def stream_template(name, session, **context):
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    # The session cookie is sent before the body, so the csrf token is stored now. Views take the
+    # flashed messages before calling this and pass them in the context.
+    generate_csrf()
+    stream = app.jinja_env.get_template(name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    chunks = iter(stream)
+    try:
+        first = next(chunks, "")
+    except Exception:
+        session.close()
+        raise
+
+    def generate():
+        try:
+            yield first
+            yield from chunks
+        finally:
+            session.close()
+
+    return app.response_class(stream_with_context(generate()), mimetype="text/html")
+
+
+def init_app(app):
+    app.jinja_env.bytecode_cache = bytecode_cache()
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.filters["nav_version"] = nav_version
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+# Set before the app is imported, the modules read their configuration at import time
+DATABASE = os.path.join(tempfile.mkdtemp(prefix="beginnerpy-tests-"), "test.db")
+os.environ.setdefault("DB_URL", f"sqlite:///{DATABASE}")
+os.environ["QUERY_AUDIT"] = "raise"
+os.environ["CACHE_BACKEND"] = "local"
+os.environ["JOB_RUNNER"] = "none"
+os.environ["INVALIDATION_BUS"] = "off"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["JINJA_CACHE_DIR"] = os.path.join(os.path.dirname(DATABASE), "jinja")
+
+import pytest
+from beginnerpy import app as flask_app, loadtest
+from beginnerpy.db import engine, Session
+from beginnerpy.models import Base, Category, Tag, Module, Useraccount, categories, tags, modules
+
+
+# A SQLite stand-in with the default categories, tags and modules plus the load test articles
+@pytest.fixture(scope="session")
+def database():
+    Base.metadata.create_all(bind=engine)
+    session = Session()
+    for category in categories:
+        session.add(Category(**category))
+    for tag in tags:
+        session.add(Tag(**tag))
+    for module in modules:
+        session.add(Module(**module))
+    session.commit()
+    loadtest.seed(session, articles=40, password="test")
+    session.close()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def app(database):
+    flask_app.config["TESTING"] = True
+    flask_app.config["WTF_CSRF_ENABLED"] = False
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    session = Session()
+    user = session.query(Useraccount).filter_by(email=loadtest.EMAIL).one()
+    client = app.test_client()
+    with client.session_transaction() as browser:
+        browser["_user_id"] = str(user.id)
+        browser["_fresh"] = True
+    session.close()
+    return client
@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+from beginnerpy import cache
+
+
+# Stands in for the shared memory backend, the namespaces of one test play different workers
+class SharedBackend(cache.LocalBackend):
+    shared = True
+
+
+class SmallSharedBackend(SharedBackend):
+    def fits(self, size):
+        return False
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = SharedBackend()
+    monkeypatch.setattr(cache, "backend", backend)
+    # Every lookup checks the generation, as if the workers' copies had just expired
+    monkeypatch.setattr(cache, "GENERATION_TTL", 0)
+    return backend
+
+
+def later(seconds, function):
+    timer = threading.Timer(seconds, function)
+    timer.start()
+    return timer
+
+
+def test_clear_starts_a_new_generation(backend):
+    namespace = cache.Namespace("test-clear")
+    namespace.set("key", "value")
+    old_key = namespace.full_key("key")
+    namespace.clear()
+    assert namespace.full_key("key") != old_key
+    assert namespace.get("key") is None
+
+
+def test_clear_reaches_other_workers(backend):
+    worker, other = cache.Namespace("test-workers"), cache.Namespace("test-workers")
+    worker.set("key", "value")
+    assert other.get("key") == "value"
+    other.clear()
+    assert worker.get("key") is None
+
+
+# A generation lost to eviction is replaced, the entries written under it are never read again
+def test_lost_generation_hides_old_entries(backend):
+    namespace = cache.Namespace("test-evicted")
+    namespace.set("key", "value")
+    backend.delete([namespace.generation_key()])
+    assert namespace.get("key") is None
+    namespace.set("key", "new")
+    assert namespace.get("key") == "new"
+
+
+def test_get_or_set_computes_once_per_worker(backend):
+    namespace = cache.Namespace("test-threads")
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return "value"
+
+    def lookup():
+        barrier.wait()
+        results.append(namespace.get_or_set("key", compute))
+
+    results = []
+    threads = [threading.Thread(target=lookup) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ["value"] * 8
+
+
+def test_get_or_set_waits_for_other_worker(backend):
+    worker, other = cache.Namespace("test-wait"), cache.Namespace("test-wait")
+    assert other.lock("key")
+    later(0.2, lambda: (other.set("key", "theirs"), other.unlock("key")))
+    assert worker.get_or_set("key", lambda: "ours") == "theirs"
+
+
+# A worker that failed or kept its value to itself doesn't make the others wait for the timeout
+def test_get_or_set_computes_once_other_worker_let_go(backend, monkeypatch):
+    monkeypatch.setattr(cache, "COMPUTE_WAIT", 5)
+    worker, other = cache.Namespace("test-released"), cache.Namespace("test-released")
+    assert other.lock("key")
+    later(0.2, lambda: other.unlock("key"))
+    started = time.monotonic()
+    assert worker.get_or_set("key", lambda: "ours") == "ours"
+    assert time.monotonic() - started < 2
+
+
+def test_oversized_namespace_skips_the_lock(monkeypatch):
+    monkeypatch.setattr(cache, "backend", SmallSharedBackend())
+    monkeypatch.setattr(cache, "COMPUTE_WAIT", 5)
+    worker, other = cache.Namespace("test-oversized"), cache.Namespace("test-oversized")
+    worker.set("other", "too big")
+    assert worker.oversized
+    assert other.lock("key")
+    started = time.monotonic()
+    assert worker.get_or_set("key", lambda: "ours") == "ours"
+    assert time.monotonic() - started < 1
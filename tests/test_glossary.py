@@ -0,0 +1,64 @@
+from beginnerpy.glossary import Matcher, Term, link_terms
+
+TERMS = [
+    Term("list", "/glossary/list", 1),
+    Term("list comprehension", "/glossary/list-comprehension", 2),
+    Term("comprehension", "/glossary/comprehension", 3),
+    Term("dict", "/glossary/dict", 4),
+]
+
+
+def found(text):
+    matcher = Matcher(TERMS)
+    return [(text[start:stop], TERMS[index].text) for start, stop, index in matcher.matches(text)]
+
+
+def test_find_reports_overlapping_terms():
+    text = "a list comprehension"
+    occurrences = sorted((start, stop) for start, stop, index in Matcher(TERMS).find(text))
+    assert occurrences == [(2, 6), (2, 20), (7, 20)]
+
+
+# The leftmost term wins, and the longest of those starting there
+def test_matches_prefer_leftmost_longest():
+    assert found("a list comprehension") == [("list comprehension", "list comprehension")]
+    assert found("a list, a comprehension") == [("list", "list"), ("comprehension", "comprehension")]
+
+
+def test_matches_whole_words_only():
+    assert found("lists and dictionaries, my_list and list2") == []
+    assert found("(list) and dict.") == [("list", "list"), ("dict", "dict")]
+
+
+def test_matches_ignore_case():
+    assert found("A List") == [("List", "list")]
+
+
+def test_link_terms_links_first_occurrence():
+    html = link_terms("<p>A list is a list.</p>", Matcher(TERMS))
+    assert html == '<p>A <a href="/glossary/list" class="glossary-link">list</a> is a list.</p>'
+
+
+# Code, existing links and headings are left alone, the text after them is linked
+def test_link_terms_skips_code_links_and_headings():
+    matcher = Matcher(TERMS)
+    for html in [
+        "<pre><code>list = []</code></pre>",
+        '<p><a href="/other">a list</a></p>',
+        "<h2>list</h2>",
+        "<p><code>dict</code></p>",
+    ]:
+        assert link_terms(html, matcher) == html
+    html = link_terms("<pre><code>list</code></pre><p>list</p>", matcher)
+    assert html == '<pre><code>list</code></pre><p><a href="/glossary/list" class="glossary-link">list</a></p>'
+
+
+def test_link_terms_leaves_own_entry():
+    assert link_terms("<p>dict and list</p>", Matcher(TERMS), article_id=4) == (
+        '<p>dict and <a href="/glossary/list" class="glossary-link">list</a></p>'
+    )
+
+
+def test_link_terms_leaves_tag_attributes():
+    html = '<p title="list"><img alt="dict" src="/list.png"/></p>'
+    assert link_terms(html, Matcher(TERMS)) == html
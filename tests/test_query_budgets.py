@@ -0,0 +1,90 @@
+import pytest
+from beginnerpy import app as flask_app
+from beginnerpy.db import Session
+from beginnerpy.models import Article, Category, Tag, Module
+from beginnerpy.queryaudit import QueryBudgetExceeded
+
+
+def published_article():
+    session = Session()
+    article, category = (
+        session.query(Article.link, Category.link)
+        .join(Category, Article.category_id == Category.id)
+        .filter(Article.draft == 0, Category.link != "glossary", ~Article.link.contains("/"))
+        .first()
+    )
+    session.close()
+    return article, category
+
+
+def first_link(model):
+    session = Session()
+    link = session.query(model.link).order_by(model.id).first()[0]
+    session.close()
+    return link
+
+
+# Streamed bodies are audited when the response is closed, so the whole body is read first
+def get(client, path):
+    response = client.get(path)
+    response.get_data()
+    response.close()
+    return response
+
+
+def test_index(client):
+    assert get(client, "/").status_code == 200
+
+
+def test_pip_version(client):
+    assert get(client, "/challenges/pip-version").status_code == 200
+
+
+def test_category(client):
+    assert get(client, "/category/articles").status_code == 200
+
+
+def test_tag(client):
+    assert get(client, f"/tag/{first_link(Tag)}").status_code == 200
+
+
+def test_module(client):
+    assert get(client, f"/module/{first_link(Module)}").status_code == 200
+
+
+def test_page(client):
+    link, category = published_article()
+    assert get(client, f"/{category}/{link}").status_code == 200
+
+
+def test_admin(admin_client):
+    assert get(admin_client, "/admin").status_code == 200
+
+
+def test_admin_category(admin_client):
+    assert get(admin_client, "/admin/category/articles").status_code == 200
+
+
+# The rows of the streamed listing are fetched while the body is sent and count against the budget
+def test_admin_category_counts_streamed_queries(admin_client, monkeypatch):
+    view = flask_app.view_functions["admin_category"]
+    monkeypatch.setattr(view, "query_budget", 1)
+    with pytest.raises(QueryBudgetExceeded):
+        get(admin_client, "/admin/category/articles")
+
+
+def test_save_article(admin_client):
+    session = Session()
+    article = session.query(Article).filter(Article.draft == 0).first()
+    form = {
+        "title": article.title,
+        "link": article.link,
+        "content": article.content + "<p>Edited</p>",
+        "summary": article.summary,
+        "cat_id": str(article.category_id),
+        "cat_link": session.query(Category.link).filter_by(id=article.category_id).scalar(),
+    }
+    form.update({f"tag_{tag.id}": "on" for tag in article.tags})
+    form.update({f"module_{module.id}": "on" for module in article.modules})
+    session.close()
+    assert admin_client.post("/admin/save_article", data=form).status_code == 302
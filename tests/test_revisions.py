@@ -0,0 +1,44 @@
+from beginnerpy import revisions
+from beginnerpy.db import Session
+from beginnerpy.models import Article, ArticleRevision
+
+OLD = '<h2>Lists</h2><p>A list holds items.</p><pre><code class="python">items = [1, 2]</code></pre>'
+NEW = '<h2>Lists</h2><p>A list holds <strong>any</strong> items.</p><p>Appended</p>'
+
+
+def test_delta_round_trip():
+    for old, new in [(OLD, NEW), (NEW, OLD), ("", NEW), (OLD, ""), (OLD, OLD), ("no tags", "none")]:
+        assert revisions.patch(old, revisions.delta(old, new)) == new
+
+
+# Unchanged runs are stored as ranges of the old tokens, only the new text is stored as is
+def test_delta_copies_unchanged_tokens():
+    ops = revisions.delta(OLD, OLD + "<p>More</p>")
+    assert ops == [[0, len(revisions.tokenize(OLD))], "<p>More</p>"]
+
+
+def test_delta_survives_encoding():
+    ops = revisions.decode(revisions.encode(revisions.delta(OLD, NEW)))
+    assert revisions.patch(OLD, ops) == NEW
+
+
+# Enough saves to pass a snapshot, every revision is rebuilt from the one before it
+def test_reconstruct_across_snapshots(database):
+    session = Session()
+    article = session.query(Article).first()
+    article_id, original = article.id, article.content
+    session.query(ArticleRevision).filter_by(article_id=article_id).delete()
+    contents = [f"<p>Version {number}</p>{OLD if number % 2 else NEW}" for number in range(13)]
+    for content in contents:
+        article.content = content
+        revisions.record(session, article)
+        session.commit()
+    # Saving unchanged fields doesn't add a revision
+    revisions.record(session, article)
+    session.commit()
+    assert revisions.latest(session, article_id).number == len(contents)
+    for number, content in enumerate(contents, 1):
+        assert revisions.reconstruct(session, article_id, number)["content"] == content
+    article.content = original
+    session.commit()
+    session.close()